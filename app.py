@@ -2,15 +2,25 @@ import nest_asyncio
 
 nest_asyncio.apply()
 # NFC先改，改完在这里测试
+import asyncio
+import os
+import time
 import traceback
 from activator import SharpActivator
-from mirai import Event, MessageChain, Mirai, MessageEvent, Plain, WebSocketAdapter
+from mirai import Event, MessageChain, Mirai, MessageEvent, Plain, Shutdown, Startup, WebSocketAdapter
 import plugin
+from dispatcher import Dispatcher
+from normalizer import Normalizer
+from outbox import Outbox
+from bot_cache import BotCache
+from event_trace import TraceWriter
 from plugin import CommandNotFoundError
 from mirai.models.events import MemberCardChangeEvent, GroupRecallEvent, NudgeEvent, MemberJoinRequestEvent, MemberJoinEvent, MemberUnmuteEvent
 from mirai.models.api import RespOperate
-import zhconv
 import config
+from utilities import get_logger
+
+logger = get_logger()
 
 bot = Mirai(config.BOT_QQ_ID, adapter=WebSocketAdapter(
     verify_key=config.MIRAI_VERIFY_KEY, 
@@ -19,34 +29,92 @@ bot = Mirai(config.BOT_QQ_ID, adapter=WebSocketAdapter(
 ))
 
 activator = SharpActivator()
+normalizer = Normalizer()
+
+# 群和成员信息的查询走缓存
+bot_cache = BotCache(
+    bot,
+    member_ttl=getattr(config, 'BOT_CACHE_MEMBER_TTL', 600),
+    profile_ttl=getattr(config, 'BOT_CACHE_PROFILE_TTL', 60),
+    group_ttl=getattr(config, 'BOT_CACHE_GROUP_TTL', 600),
+)
+
+# 插件的所有发送都经过outbox限速排队, 事件订阅仍在bot上
+outbox = Outbox(
+    bot_cache,
+    rate=getattr(config, 'OUTBOX_RATE', 1),
+    burst=getattr(config, 'OUTBOX_BURST', 5),
+    global_rate=getattr(config, 'OUTBOX_GLOBAL_RATE', 5),
+    global_burst=getattr(config, 'OUTBOX_GLOBAL_BURST', 10),
+    temp_rate=getattr(config, 'OUTBOX_TEMP_RATE', 1 / 3),
+    coalesce=getattr(config, 'OUTBOX_COALESCE', False),
+)
+
+engine = plugin.Engine(outbox)
+engine.bot_cache = bot_cache
+outbox.priority_of = engine.send_priority
+bot_cache.metrics = engine.metrics
+engine.concurrent_handlers = getattr(config, 'CONCURRENT_HANDLERS', False)
+engine.backup_interval = getattr(config, 'BACKUP_INTERVAL', engine.backup_interval)
+engine.backup_max_staleness = getattr(config, 'BACKUP_MAX_STALENESS', engine.backup_max_staleness)
+engine.profile_imports = getattr(config, 'PROFILE_IMPORTS', False)
+dispatcher = Dispatcher(
+    max_workers=getattr(config, 'DISPATCH_MAX_WORKERS', 16),
+    max_queue=getattr(config, 'DISPATCH_MAX_QUEUE', 64),
+    overflow=getattr(config, 'DISPATCH_OVERFLOW', 'wait'),
+)
+dispatcher.metrics = engine.metrics
+
+# 录制收到的事件, 用于离线回放(benchmarks/replay.py)
+roster_task = None
 
-engine = plugin.Engine(bot)
+tracer = None
+if getattr(config, 'TRACE_DIR', None) is not None:
+    tracer = TraceWriter(
+        os.path.join(config.TRACE_DIR, time.strftime('trace-%Y%m%d-%H%M%S.jsonl.gz')),
+        bot_qq=config.BOT_QQ_ID,
+        anonymize=getattr(config, 'TRACE_ANONYMIZE', True),
+        salt=getattr(config, 'TRACE_SALT', None),
+        redact_text=getattr(config, 'TRACE_REDACT_TEXT', False),
+    )
 
 @bot.on(MemberJoinRequestEvent)
 async def on_join_req(event: MemberJoinRequestEvent):
-    with engine.of(event) as ctx:
+    received = time.perf_counter()
+    if tracer is not None:
+        tracer.record(event)
+    await dispatcher.submit(event, lambda: handle_join_req(event, received))
+
+async def handle_join_req(event: MemberJoinRequestEvent, received: float):
+    with engine.of(event, received=received) as ctx:
         async def resp(op: RespOperate, msg='bot自动处理'):
             await bot.resp_member_join_request_event(event.event_id, event.from_id, event.group_id, op, msg)
         await ctx.exec_join(resp)
 
 @bot.on(Event)
 async def on_event(event: Event):
+    # 所有事件(包括消息)都会经过这里
+    bot_cache.observe(event)
     if isinstance(event, (MemberCardChangeEvent, GroupRecallEvent, MemberJoinEvent, MemberUnmuteEvent, NudgeEvent)):
-        with engine.of(event) as ctx:
-            await ctx.exec()
+        received = time.perf_counter()
+        if tracer is not None:
+            tracer.record(event)
+        await dispatcher.submit(event, lambda: handle_event(event, received))
+
+async def handle_event(event: Event, received: float):
+    with engine.of(event, received=received) as ctx:
+        await ctx.exec()
 
 @bot.on(MessageEvent)
 async def on_message(event: MessageEvent):
-    with engine.of(event) as ctx:
-        def map_text(comp):
-            if isinstance(comp, Plain):
-                t = comp.text
-                t = t.replace('‭', '')
-                t = zhconv.convert(t, 'zh-cn')
-                return Plain(t)
-            return comp
+    received = time.perf_counter()
+    if tracer is not None:
+        tracer.record(event)
+    await dispatcher.submit(event, lambda: handle_message(event, received))
 
-        event.message_chain = MessageChain([map_text(c) for c in event.message_chain])
+async def handle_message(event: MessageEvent, received: float):
+    with engine.of(event, received=received) as ctx:
+        event.message_chain = normalizer.normalize_chain(event.message_chain)
 
         await ctx.exec_any(event.message_chain)
 
@@ -68,6 +136,26 @@ async def on_message(event: MessageEvent):
             traceback.print_exc()
             await ctx.send()
 
+@bot.on(Startup)
+async def on_startup(event: Startup):
+    # 连接建立后把延迟恢复的插件与延迟导入的依赖也准备好
+    await engine.wait_restored()
+    await engine.warm_up()
+    normalizer.load()
+    # 重连时也会触发Startup, 对账只启动一次
+    global roster_task
+    if roster_task is None:
+        roster_task = asyncio.create_task(bot_cache.roster.reconcile_forever(getattr(config, 'ROSTER_RECONCILE_INTERVAL', 6 * 60 * 60)))
+
+@bot.on(Shutdown)
+async def on_shutdown(event: Shutdown):
+    if tracer is not None:
+        tracer.close()
+    await engine.flush_backups()
+    for name, stats in engine.backup_stats().items():
+        if stats.writes > 0:
+            logger.info(f'{name}: {stats.writes} writes, {stats.bytes_written} bytes, {stats.coalesced} coalesced, loop paused {stats.loop_pause:.3f}s, serialize {stats.serialize_time:.3f}s')
+
 def main():
     engine.load()
     bot.run()
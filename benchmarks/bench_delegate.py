@@ -0,0 +1,64 @@
+# 测量@delegate跨插件调用的开销
+# 用法: python benchmarks/bench_delegate.py [调用次数]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 日志和备份都写到临时目录, 不污染工作区
+os.chdir(tempfile.mkdtemp())
+os.makedirs('logs', exist_ok=True)
+
+from plugin import Context, Engine, Plugin, delegate, route
+
+@route('bench')
+class Target(Plugin):
+    def __init__(self) -> None:
+        self.total = 0
+
+    async def raw(self, n: int):
+        self.total += n
+
+    @delegate()
+    async def ping(self):
+        self.total += 1
+
+    @delegate()
+    async def add(self, n: int):
+        self.total += n
+
+    @delegate()
+    async def add_ctx(self, n: int, ctx: Context):
+        self.total += n
+
+async def measure(name: str, fn, times: int):
+    for _ in range(min(times, 1000)):
+        await fn()
+    started = time.perf_counter()
+    for _ in range(times):
+        await fn()
+    elapsed = time.perf_counter() - started
+    print(f'{name:<24}{elapsed / times * 1e6:8.2f} us/call')
+    return elapsed / times
+
+async def main(times: int):
+    engine = Engine(None)
+    target = engine._load_plugin_cls(Target)
+    with engine.of() as ctx, ctx:
+        base = await measure('direct call', lambda: target.raw(1), times)
+        for name, fn in [
+            ('delegate()', lambda: target.ping()),
+            ('delegate(n)', lambda: target.add(1)),
+            ('delegate(n, ctx)', lambda: target.add_ctx(1)),
+        ]:
+            cost = await measure(name, fn, times)
+            print(f'{"":<24}{(cost - base) * 1e6:8.2f} us overhead')
+    # 没有进入上下文时每次调用都要新建一个
+    assert engine.get_context() is None
+    await measure('delegate(n) no context', lambda: target.add(1), times)
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,266 @@
+# 框架热路径的基准测试, 不需要网络和mirai
+# 用法: python benchmarks/bench_engine.py [--out report.json] [--baseline old.json] [--threshold 0.2]
+# 插件和备份复制到临时目录中加载, 不会改动工作区里的数据
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 退出时回到原来的目录并删除临时目录, 备份的副本不会留在磁盘上
+@contextmanager
+def prepare_workdir(plugins_dir: str, backups_dir: Optional[str]) -> Iterator[str]:
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        shutil.copytree(plugins_dir, os.path.join(workdir, 'plugins'), ignore=shutil.ignore_patterns('__pycache__'))
+        if backups_dir is not None and os.path.isdir(backups_dir):
+            shutil.copytree(backups_dir, os.path.join(workdir, 'backups'))
+        os.makedirs(os.path.join(workdir, 'backups'), exist_ok=True)
+        os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+        os.chdir(workdir)
+        yield workdir
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+async def measure(fn: Callable[[int], Awaitable], times: int, repeat: int = 5) -> dict:
+    # fn(i): 第i次调用; 取多轮中最快的一轮, 减少调度抖动的影响
+    for i in range(min(times, 50)):
+        await fn(i)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for i in range(times):
+            await fn(i)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {'ops': times, 'us_per_op': best / times * 1e6}
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+async def run(times: int) -> dict:
+    from mirai import Plain, At, GroupMessage
+    from mirai.models.entities import Group, GroupMember
+    from plugin import CommandNotFoundError, Context, Engine, Plugin, PluginConfig, delegate, route, top_instr
+    from utilities import GroupMemberOp, GroupOp, ensure_attr
+    from fakes import FakeMirai, group_message
+    from typing import Optional as Opt
+
+    @route('bench')
+    class Bench(Plugin):
+        @top_instr('benchping')
+        async def ping(self):
+            ...
+
+        async def sig_text(self, text: str, n: int): ...
+        async def sig_event(self, event: GroupMessage, member: GroupMember, group: Group): ...
+        async def sig_optional(self, target: Opt[At], count: int = 1): ...
+        async def sig_ops(self, ctx: Context, gop: GroupOp, mop: GroupMemberOp): ...
+
+    bot = FakeMirai()
+    engine = Engine(bot)
+    load_started = time.perf_counter()
+    engine.load()
+    load_time = time.perf_counter() - load_started
+    bench_plugin = engine._load_plugin_cls(Bench)
+    await engine.wait_restored()
+
+    members = 50
+    group_id = 1
+    for mid in range(members):
+        bot.member_of(group_id, 100 + mid)
+    texts = ['早', '喵喵喵', '今天吃什么', '有没有人一起打游戏', 'hhhhhh', '这个怎么弄啊', '晚安']
+    # 事件提前构造好, 不计入耗时
+    events: Dict[tuple, GroupMessage] = {}
+    def event_of(i: int, text: Optional[str] = None) -> GroupMessage:
+        # 轮换发言人和内容, 避免触发刷屏检测
+        i %= members * len(texts)
+        text = text or texts[i % len(texts)]
+        event = events.get((i, text))
+        if event is None:
+            event = events[(i, text)] = group_message(bot, text, member_id=100 + i % members, group_id=group_id, message_id=i + 1)
+        return event
+
+    results: Dict[str, dict] = {}
+    skipped: Dict[str, str] = {}
+    async def bench(name: str, fn: Callable[[int], Awaitable], times: int):
+        # 单项失败不影响其他项, 记在报告的skipped里
+        try:
+            results[name] = await measure(fn, times)
+        except Exception as e:
+            skipped[name] = repr(e)
+
+    # 解析参数: 在同一事件中反复解析, 即稳态下的计划执行与解析器开销
+    signatures = {
+        'resolve_args.text': (bench_plugin.sig_text, lambda: ['abc', '3']),
+        'resolve_args.event': (bench_plugin.sig_event, lambda: []),
+        'resolve_args.optional': (bench_plugin.sig_optional, lambda: [At(target=100)]),
+        'resolve_args.ops': (bench_plugin.sig_ops, lambda: []),
+    }
+    for name, (method, chain_of) in signatures.items():
+        with engine.of(event_of(0)) as ctx, ctx:
+            async def fn(i, method=method, chain_of=chain_of, ctx=ctx):
+                await ctx.resolve_args(method, chain_of())
+            await bench(name, fn, times)
+
+    # 指令路由: 每次一个新事件, 覆盖真实插件集合的顶层路由
+    async def exec_cmd_hit(i):
+        with engine.of(event_of(i, '#benchping')) as ctx:
+            await ctx.exec_cmd([Plain('benchping')])
+    await bench('exec_cmd.hit', exec_cmd_hit, times)
+
+    async def exec_cmd_miss(i):
+        with engine.of(event_of(i, '#no-such-command')) as ctx:
+            try:
+                await ctx.exec_cmd([Plain('no-such-command')])
+            except CommandNotFoundError: ...
+    await bench('exec_cmd.miss', exec_cmd_miss, times)
+
+    # exec_any的扇出: 只有调度开销, 以及真正执行所有any_instr
+    async def noop(method): ...
+    async def instrs_fanout(i):
+        with engine.of(event_of(i)) as ctx:
+            await ctx.instrs('_any_instr_', noop)
+    await bench('instrs.any_fanout', instrs_fanout, times)
+    if 'instrs.any_fanout' in results:
+        results['instrs.any_fanout']['handlers'] = len(engine.handlers.of('_any_instr_'))
+
+    async def exec_any(i):
+        event = event_of(i)
+        with engine.of(event) as ctx:
+            await ctx.exec_any(event.message_chain)
+    await bench('exec_any', exec_any, max(times // 10, 1))
+
+    admin = engine.plugins.get('admin')
+    if admin is not None and hasattr(admin, 'censor_speech'):
+        async def censor_speech(i):
+            event = event_of(i)
+            with engine.of(event) as ctx:
+                async def cb(method):
+                    return await method(*(await ctx.resolve_args(method, ctx.preprocess(event.message_chain)[1:])))
+                await ctx.instrs('_any_instr_', cb, handlers=[(admin, admin.censor_speech)])
+        await bench('admin.censor_speech', censor_speech, max(times // 10, 1))
+    else:
+        skipped['admin.censor_speech'] = 'Admin not loaded'
+
+    achv = next((p for p in engine.plugins.values() if p.__class__.__name__ == 'Achv'), None)
+    if achv is not None:
+        async def update_member_name(i):
+            with engine.of(event_of(i)) as ctx, ctx:
+                await achv.update_member_name()
+        await bench('achv.update_member_name', update_member_name, max(times // 10, 1))
+    else:
+        skipped['achv.update_member_name'] = 'Achv not loaded'
+
+    # 备份: 快照大小, 序列化/反序列化时间; 默认的日志模式下完整快照在线程中重写, dump_ms是journal=False时每次备份事件循环被占用的时间
+    backups = {}
+    for name, p in engine.plugins.items():
+        if not ensure_attr(p.__class__, PluginConfig).backup_enabled:
+            continue
+        try:
+            # 单次不到1ms, 取5次中最快的
+            timings = []
+            for _ in range(5):
+                started = time.perf_counter()
+                data = pickle.dumps(p)
+                dumped = time.perf_counter()
+                pickle.loads(data)
+                loaded = time.perf_counter()
+                timings.append((dumped - started, loaded - dumped))
+        except Exception as e:
+            skipped[f'backup.{name}'] = repr(e)
+            continue
+        backups[name] = {
+            'bytes': len(data),
+            'dump_ms': min(t[0] for t in timings) * 1000,
+            'load_ms': min(t[1] for t in timings) * 1000,
+        }
+
+    bot.discard_background_tasks()
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+            'times': times,
+            'plugins': sorted(engine.plugins.keys()),
+            'load_ms': load_time * 1000,
+        },
+        'results': results,
+        'backups': backups,
+        'skipped': skipped,
+        'outbound_calls': len(bot.calls),
+    }
+
+def compare(report: dict, baseline: dict, threshold: float):
+    regressions = []
+    for name, r in report['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if old is None: continue
+        ratio = r['us_per_op'] / old['us_per_op'] if old['us_per_op'] > 0 else 1
+        r['baseline_us_per_op'] = old['us_per_op']
+        if ratio > 1 + threshold:
+            regressions.append(f'{name}: {old["us_per_op"]:.1f}us -> {r["us_per_op"]:.1f}us ({ratio:.2f}x)')
+    for name, b in report['backups'].items():
+        old = baseline.get('backups', {}).get(name)
+        if old is None: continue
+        if old['bytes'] > 0 and b['bytes'] / old['bytes'] > 1 + threshold:
+            regressions.append(f'backup {name}.bytes: {old["bytes"]} -> {b["bytes"]}')
+        # 太小的耗时只是噪声
+        if b['dump_ms'] >= 1 and old['dump_ms'] > 0 and b['dump_ms'] / old['dump_ms'] > 1 + threshold:
+            regressions.append(f'backup {name}.dump_ms: {old["dump_ms"]:.1f}ms -> {b["dump_ms"]:.1f}ms')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', help='报告输出路径, 不给就输出到标准输出')
+    parser.add_argument('--baseline', help='与之前的报告比较, 有退化时返回1')
+    parser.add_argument('--threshold', type=float, default=0.2, help='变慢超过该比例算作退化')
+    parser.add_argument('--times', type=int, default=2000)
+    parser.add_argument('--plugins', default=os.path.join(ROOT, 'plugins'))
+    parser.add_argument('--backups', default=os.path.join(ROOT, 'backups'))
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(os.path.abspath(args.baseline), encoding='utf-8') as f:
+            baseline = json.load(f)
+    out = os.path.abspath(args.out) if args.out is not None else None
+    with prepare_workdir(os.path.abspath(args.plugins), os.path.abspath(args.backups)) as workdir:
+        report = asyncio.run(run(args.times))
+    report['meta']['workdir'] = workdir
+    regressions = compare(report, baseline, args.threshold) if baseline is not None else []
+    report['regressions'] = regressions
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if out is not None:
+        with open(out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    for name, r in report['results'].items():
+        print(f'{name:<28}{r["us_per_op"]:10.1f} us', file=sys.stderr)
+    for r in regressions:
+        print(f'REGRESSION {r}', file=sys.stderr)
+    sys.exit(1 if len(regressions) > 0 else 0)
+
+if __name__ == '__main__':
+    main()
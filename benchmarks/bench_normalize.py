@@ -0,0 +1,70 @@
+# 对比入站文本繁简转换: 直接调用zhconv vs Normalizer
+# 用法: python benchmarks/bench_normalize.py [语料文件] [重复次数]
+# 语料文件每行一条消息, 多个Plain片段用制表符分隔; 不给就用内置的样本
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import zhconv
+from normalizer import Normalizer
+
+SAMPLE = [
+    '早', '喵', '喵喵喵', '草', '哈哈哈哈哈哈', '？', '6', 'ok', '+1', 'hhhhhh', '晚安',
+    '#签到', '#来只纳延', '#叫一声', '#ai 今天吃什么', '#stats p99',
+    '有没有人一起打游戏', '这个怎么弄啊', '我觉得还行吧', '今天好热', '下班了下班了',
+    '我幹什麼不干你事。', '這個東西真的很好用', '請問群裡有人會寫程式嗎', '頭像換了嗎',
+    'https://b23.tv/abcdEFG', 'BV1xx411c7mD', 'git push --force 了一下', 'python是世界上最好的语言',
+    '@全体成员 明天开会', '发大水了', '一百昏', '仙人球', '[动画表情]',
+]
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n').split('\t') for line in f if line.strip()]
+
+def sample_corpus(n: int):
+    # 群聊里短消息反复出现, 用齐普夫分布模拟
+    random.seed(0)
+    weights = [1 / (i + 1) for i in range(len(SAMPLE))]
+    corpus = []
+    for _ in range(n):
+        k = 1 if random.random() < 0.8 else random.randint(2, 4)
+        corpus.append(random.choices(SAMPLE, weights, k=k))
+    return corpus
+
+def measure(name: str, fn, corpus, rounds: int):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for msg in corpus:
+            fn(msg)
+    elapsed = time.perf_counter() - started
+    n = len(corpus) * rounds
+    print(f'{name:<16}{elapsed / n * 1e6:8.2f} us/msg')
+    return elapsed
+
+def main():
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else sample_corpus(20000)
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    normalizer = Normalizer()
+    # 两边都先加载好词典
+    zhconv.convert('幹', 'zh-cn')
+    normalizer.load()
+
+    for msg in corpus:
+        expected = [zhconv.convert(t, 'zh-cn') for t in msg]
+        assert [normalizer.convert(t) for t in msg] == expected, msg
+        assert normalizer.convert_batch(msg) == expected, msg
+
+    base = measure('zhconv', lambda msg: [zhconv.convert(t, 'zh-cn') for t in msg], corpus, rounds)
+    normalizer = Normalizer()
+    normalizer.load()
+    single = measure('normalizer', lambda msg: [normalizer.convert(t) for t in msg], corpus, rounds)
+    batch = measure('batch', normalizer.convert_batch, corpus, rounds)
+    print(f'speedup: {base / single:.1f}x, batch {base / batch:.1f}x')
+    print(f'skipped {normalizer.skipped}, cache hits {normalizer.cache_hits}, converted {normalizer.converted}')
+
+if __name__ == '__main__':
+    main()
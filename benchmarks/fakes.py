@@ -0,0 +1,153 @@
+# 不连接mirai的假bot, 记录所有发出的调用
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+from mirai import GroupMessage
+from mirai.models.api import MemberListResponse, MessageResponse
+from mirai.models.entities import Group, GroupMember
+
+# 与mirai相同, 参数可以在member_info(...)或get/set中给出
+class FakeMemberInfo():
+    def __init__(self, bot: 'FakeMirai', args: tuple) -> None:
+        self.bot = bot
+        self.args = args
+
+    async def get(self, *args):
+        target, member_id = (*self.args, *args)
+        return await self.bot.call('member_info.get', target, member_id)
+
+    async def set(self, *args):
+        target, member_id, info = (*self.args, *args)
+        await self.bot.call('member_info.set', target, member_id, info)
+        name = getattr(info, 'name', None)
+        if name is not None:
+            member = self.bot.member_of(target, member_id)
+            self.bot.members[target][member_id] = member.copy(update={'member_name': name})
+
+class FakeMirai():
+    calls: List[Tuple[float, str, tuple]]
+    groups: Dict[int, Group]
+    members: Dict[int, Dict[int, GroupMember]]
+
+    # latency: 所有接口相同的延迟, 或者按接口名配置, 未配置的接口用default
+    def __init__(self, qq: int = 10000, *, latency: Union[float, Dict[str, float]] = 0, record: bool = True) -> None:
+        self.qq = qq
+        self.latency = latency
+        self.record = record
+        self.calls = []
+        self.groups = {}
+        self.members = {}
+        self.background_tasks = []
+        self.message_id = 0
+
+    def latency_of(self, api: str) -> float:
+        if isinstance(self.latency, dict):
+            return self.latency.get(api, self.latency.get('default', 0))
+        return self.latency
+
+    async def call(self, api: str, *args):
+        if self.record:
+            self.calls.append((time.perf_counter(), api, args))
+        latency = self.latency_of(api)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+    def group_of(self, group_id: int, name: Optional[str] = None) -> Group:
+        group = self.groups.get(group_id)
+        if group is None:
+            group = self.groups[group_id] = Group.parse_obj({'id': group_id, 'name': name or f'group{group_id}', 'permission': 'ADMINISTRATOR'})
+            self.members[group_id] = {}
+        return group
+
+    def member_of(self, group_id: int, member_id: int, name: Optional[str] = None, *, permission: str = 'MEMBER', special_title: str = '') -> GroupMember:
+        group = self.group_of(group_id)
+        member = self.members[group_id].get(member_id)
+        if member is None:
+            member = self.members[group_id][member_id] = GroupMember.parse_obj({
+                'id': member_id,
+                'memberName': name or f'member{member_id}',
+                'permission': permission,
+                'specialTitle': special_title,
+                'group': group.dict(by_alias=True),
+            })
+        return member
+
+    def learn(self, event):
+        # 从事件中记下群和成员, 之后get_group_member/member_list时返回
+        group = getattr(event, 'group', None)
+        if isinstance(group, Group):
+            self.group_of(group.id, group.name)
+        for member in (getattr(event, 'sender', None), getattr(event, 'member', None), getattr(event, 'operator', None)):
+            if isinstance(member, GroupMember):
+                self.group_of(member.group.id, member.group.name)
+                self.members[member.group.id].setdefault(member.id, member)
+
+    def add_background_task(self, coro):
+        self.background_tasks.append(coro)
+
+    def discard_background_tasks(self):
+        # autorun的任务不在假bot中运行
+        for coro in self.background_tasks:
+            coro.close()
+        self.background_tasks.clear()
+
+    def outbound(self, *apis: str) -> List[Tuple[float, str, tuple]]:
+        return [c for c in self.calls if c[1] in apis]
+
+    async def send_message(self, api: str, *args) -> MessageResponse:
+        await self.call(api, *args)
+        self.message_id += 1
+        return MessageResponse(code=0, msg='', message_id=self.message_id)
+
+    async def send_group_message(self, target: int, message_chain, quote=None):
+        return await self.send_message('send_group_message', target, message_chain)
+
+    async def send_temp_message(self, qq: int, group: int, message_chain, quote=None):
+        return await self.send_message('send_temp_message', qq, group, message_chain)
+
+    async def send_friend_message(self, target: int, message_chain, quote=None):
+        return await self.send_message('send_friend_message', target, message_chain)
+
+    async def get_group(self, group_id: int):
+        await self.call('get_group', group_id)
+        return self.group_of(group_id)
+
+    async def get_group_member(self, group: int, member_id: int):
+        await self.call('get_group_member', group, member_id)
+        return self.member_of(group, member_id)
+
+    async def member_list(self, target: int):
+        await self.call('member_list', target)
+        self.group_of(target)
+        return MemberListResponse(code=0, msg='', data=list(self.members[target].values()))
+
+    def member_info(self, *args):
+        return FakeMemberInfo(self, args)
+
+    async def recall(self, target: int, *args):
+        await self.call('recall', target, *args)
+
+    async def mute(self, target: int, member_id: int, time: int):
+        await self.call('mute', target, member_id, time)
+
+    async def unmute(self, target: int, member_id: int):
+        await self.call('unmute', target, member_id)
+
+    async def kick(self, target: int, member_id: int, msg: str = ''):
+        await self.call('kick', target, member_id, msg)
+
+    def __getattr__(self, name: str):
+        # 其他接口只记录调用
+        if name.startswith('_'):
+            raise AttributeError(name)
+        async def api(*args, **kwargs):
+            await self.call(name, *args)
+        return api
+
+def group_message(bot: FakeMirai, text: str, *, member_id: int = 1, group_id: int = 1, message_id: int = 1) -> GroupMessage:
+    member = bot.member_of(group_id, member_id)
+    return GroupMessage.parse_obj({
+        'type': 'GroupMessage',
+        'sender': member.dict(by_alias=True),
+        'messageChain': [{'type': 'Source', 'id': message_id, 'time': int(time.time())}, {'type': 'Plain', 'text': text}],
+    })
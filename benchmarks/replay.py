@@ -0,0 +1,202 @@
+# 把app.py录制的事件(TRACE_DIR)回放到Engine上, 对面是假bot
+# 用法: python benchmarks/replay.py trace.jsonl.gz [--speed 1|10|max] [--latency 0.05 | --latency send_group_message=0.3,default=0.02] [--copies N] [--out report.json]
+# --copies N: 把录制的事件复制到N组互不相干的群和成员上, 用来估计更多/更大的群的负载
+# --outbox [RATE]: 与app.py一样经过Outbox发送, RATE为每个目标每秒的条数(默认1, 限速是真实等待), 报告中包含排队等待时间
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple, Union
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_engine import prepare_workdir
+
+def parse_latency(s: str) -> Union[float, Dict[str, float]]:
+    if '=' not in s:
+        return float(s)
+    return {k.strip(): float(v) for k, v in (item.split('=') for item in s.split(','))}
+
+def load_events(path: str, copies: int) -> Tuple[dict, List[Tuple[float, object]]]:
+    from mirai import Event
+    from event_trace import Anonymizer, read_trace
+    header, events = read_trace(path)
+    events = list(events)
+    if copies <= 1:
+        return header, events
+    res = []
+    for k in range(copies):
+        # 每份用不同的salt重新映射QQ号和群号, bot自己的QQ号不变
+        anonymizer = Anonymizer(f'copy{k}', keep={header['bot_qq']: header['bot_qq']})
+        for t, event in events:
+            res.append((t, Event.parse_obj(anonymizer.map(json.loads(event.json(by_alias=True))))))
+    res.sort(key=lambda it: it[0])
+    return header, res
+
+async def replay(events: List[Tuple[float, object]], bot_qq: int, speed: float, latency, outbox_rate: Optional[float] = None) -> dict:
+    from mirai import MessageEvent
+    from mirai.models.api import RespOperate
+    from mirai.models.events import MemberJoinRequestEvent
+    from activator import SharpActivator
+    from dispatcher import Dispatcher
+    from normalizer import Normalizer
+    from outbox import Outbox
+    from bot_cache import BotCache
+    from plugin import CommandNotFoundError, Engine
+    from fakes import FakeMirai
+
+    bot = FakeMirai(bot_qq, latency=latency)
+    for _, event in events:
+        bot.learn(event)
+    bot_cache = BotCache(bot)
+    outbox = None
+    if outbox_rate is not None:
+        outbox = Outbox(bot_cache, rate=outbox_rate, global_rate=outbox_rate * 5, temp_rate=outbox_rate / 3)
+        engine = Engine(outbox)
+        outbox.priority_of = engine.send_priority
+    else:
+        engine = Engine(bot_cache)
+    engine.bot_cache = bot_cache
+    bot_cache.metrics = engine.metrics
+    engine.load()
+    activator = SharpActivator()
+    normalizer = Normalizer()
+    normalizer.load()
+    dispatcher = Dispatcher()
+    dispatcher.metrics = engine.metrics
+
+    # 以下与app.py中的处理流程一致
+    async def handle_join_req(event: MemberJoinRequestEvent, received: float):
+        with engine.of(event, received=received) as ctx:
+            async def resp(op: RespOperate, msg='bot自动处理'):
+                await bot.resp_member_join_request_event(event.event_id, event.from_id, event.group_id, op, msg)
+            await ctx.exec_join(resp)
+
+    async def handle_event(event, received: float):
+        with engine.of(event, received=received) as ctx:
+            await ctx.exec()
+
+    async def handle_message(event: MessageEvent, received: float):
+        with engine.of(event, received=received) as ctx:
+            event.message_chain = normalizer.normalize_chain(event.message_chain)
+            await ctx.exec_any(event.message_chain)
+            chain = activator.check(event)
+            if chain is None:
+                await ctx.exec_fall(event.message_chain)
+                return
+            try:
+                await ctx.exec_cmd(chain)
+            except CommandNotFoundError:
+                try:
+                    await ctx.exec_cmd(['ai', *chain])
+                except: ...
+            except Exception:
+                traceback.print_exc()
+                await ctx.send()
+
+    def job_of(event, received: float):
+        if isinstance(event, MemberJoinRequestEvent):
+            return lambda: handle_join_req(event, received)
+        if isinstance(event, MessageEvent):
+            return lambda: handle_message(event, received)
+        return lambda: handle_event(event, received)
+
+    await engine.wait_restored()
+    started = time.perf_counter()
+    behind = 0
+    for t, event in events:
+        if speed > 0:
+            delay = started + t / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                behind = max(behind, -delay)
+        received = time.perf_counter()
+        bot_cache.observe(event)
+        await dispatcher.submit(event, job_of(event, received))
+    submitted = time.perf_counter()
+    await dispatcher.drain()
+    if outbox is not None and outbox.task is not None:
+        await outbox.task
+    elapsed = time.perf_counter() - started
+    await engine.flush_backups()
+    bot.discard_background_tasks()
+
+    metrics = engine.metrics
+    outbound: Dict[str, int] = {}
+    for _, api, _ in bot.calls:
+        outbound[api] = outbound.get(api, 0) + 1
+    stats = dispatcher.stats
+    report = {
+        'events': len(events),
+        'elapsed_s': elapsed,
+        'submit_s': submitted - started,
+        'throughput_eps': len(events) / elapsed if elapsed > 0 else 0,
+        # 按录制的时间投递时, 投递落后于计划的最大值
+        'max_behind_s': behind,
+        'processing': {t: h.summary() for t, h in metrics.processing.items()},
+        'first_reply': {t: h.summary() for t, h in metrics.events.items()},
+        'handlers': metrics.top(10),
+        'dispatch': {
+            'processed': stats.processed,
+            'dropped': stats.dropped,
+            'max_depth': stats.max_depth,
+            'avg_wait_ms': stats.avg_wait * 1000,
+            'max_wait_ms': stats.max_wait * 1000,
+            'wait_by_kind': {kind: h.summary() for kind, h in metrics.dispatch_wait.items()},
+        },
+        'outbound': outbound,
+        'exceptions': metrics.exceptions,
+        'cache': {c.name: {'hits': c.hits, 'misses': c.misses, 'hit_rate': c.hit_rate()} for c in bot_cache.caches()},
+    }
+    if outbox is not None:
+        s = outbox.stats
+        report['outbox'] = {
+            'sent': s.sent,
+            'coalesced': s.coalesced,
+            'failed': s.failed,
+            'max_depth': s.max_depth,
+            'wait_ms': {p.name: {'avg': s.total_wait[p] / s.count[p] * 1000, 'max': s.max_wait[p] * 1000} for p in s.count if s.count[p] > 0},
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace')
+    parser.add_argument('--speed', default='max', help='回放倍速, 例如1, 10; max表示不等待')
+    parser.add_argument('--latency', default='0', help='假bot接口的延迟(秒), 或者 接口名=秒,...,default=秒')
+    parser.add_argument('--copies', type=int, default=1)
+    parser.add_argument('--outbox', type=float, nargs='?', const=1, help='发送经过Outbox限速排队, 可指定每个目标每秒的条数')
+    parser.add_argument('--out', help='报告输出路径, 不给就输出到标准输出')
+    parser.add_argument('--plugins', default=os.path.join(ROOT, 'plugins'))
+    parser.add_argument('--backups', default=os.path.join(ROOT, 'backups'))
+    args = parser.parse_args()
+
+    speed = 0 if args.speed == 'max' else float(args.speed)
+    header, events = load_events(os.path.abspath(args.trace), args.copies)
+    out = os.path.abspath(args.out) if args.out is not None else None
+    with prepare_workdir(os.path.abspath(args.plugins), os.path.abspath(args.backups)):
+        report = asyncio.run(replay(events, header['bot_qq'], speed, parse_latency(args.latency), args.outbox))
+    report['handlers'] = [
+        {'handler': f'{plugin_name}.{handler_name}', 'calls': m.calls, 'errors': m.errors, **summary}
+        for (plugin_name, handler_name), m, summary in report['handlers']
+    ]
+    report['trace'] = {'path': args.trace, 'speed': args.speed, 'latency': args.latency, 'copies': args.copies, 'outbox': args.outbox, **header}
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if out is not None:
+        with open(out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    print(f'{report["events"]} events in {report["elapsed_s"]:.2f}s, {report["throughput_eps"]:.1f} events/s', file=sys.stderr)
+    for t, s in report['processing'].items():
+        print(f'{t:<24}p50 {s["p50_ms"]:8.1f}ms  p95 {s["p95_ms"]:8.1f}ms  p99 {s["p99_ms"]:8.1f}ms', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
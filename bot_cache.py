@@ -0,0 +1,238 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+from mirai import Event, GroupMessage, Mirai, TempMessage
+from mirai.models.api import MemberListResponse
+from mirai.models.entities import Group, GroupMember
+from mirai.models.events import (
+    BotLeaveEventActive, BotLeaveEventKick, GroupNameChangeEvent, MemberCardChangeEvent, MemberJoinEvent,
+    MemberLeaveEventKick, MemberLeaveEventQuit, MemberPermissionChangeEvent, MemberSpecialTitleChangeEvent
+)
+
+from roster import Roster
+
+class TtlCache():
+    entries: Dict[Hashable, Tuple[float, Any]] # key -> (过期时间, 值)
+    inflight: Dict[Hashable, asyncio.Task]
+
+    def __init__(self, name: str, ttl: float, max_size: int = 10000) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        if len(self.entries) > self.max_size:
+            # dict保持插入顺序, 最早写入的先淘汰
+            del self.entries[next(iter(self.entries))]
+
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key, None)
+        # 正在进行的请求结果可能已经过时, 不再写入
+        self.inflight.pop(key, None)
+
+    def invalidate_where(self, pred: Callable[[Hashable], bool]):
+        for key in [k for k in self.entries if pred(k)]:
+            del self.entries[key]
+        for key in [k for k in self.inflight if pred(k)]:
+            del self.inflight[key]
+
+    async def load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        task = self.inflight.get(key)
+        if task is not None:
+            # 同一个key同时只有一个请求, 其余的等它的结果
+            self.hits += 1
+            return await asyncio.shield(task)
+        self.misses += 1
+        # 请求在单独的任务中进行, 某个调用者被取消时不影响其他等待者
+        task = self.inflight[key] = asyncio.create_task(self.fetch(key, loader))
+        # 所有调用者都被取消时避免"exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def fetch(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+        except BaseException:
+            self.discard_inflight(key, task)
+            raise
+        # 结果为None(比如成员已退群)不缓存
+        if self.discard_inflight(key, task) and value is not None:
+            self.put(key, value)
+        return value
+
+    def discard_inflight(self, key: Hashable, task: asyncio.Task) -> bool:
+        # 返回False表示请求期间key已失效
+        if self.inflight.get(key) is not task:
+            return False
+        del self.inflight[key]
+        return True
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+# 群, 群成员, 成员资料的缓存, 接口与Mirai相同, 其他接口原样转发
+# 事件中带的成员信息直接写入缓存, 名片/头衔/权限变化与退群时失效
+class BotCache():
+    # 超过这个数量的成员未命中时改为拉一次群成员列表
+    PREFETCH_LIST_THRESHOLD = 5
+
+    def __init__(self, bot: Mirai, *, member_ttl: float = 600, profile_ttl: float = 60, group_ttl: float = 600, max_size: int = 10000) -> None:
+        self.bot = bot
+        self.members = TtlCache('member', member_ttl, max_size)
+        self.profiles = TtlCache('profile', profile_ttl, max_size)
+        self.groups = TtlCache('group', group_ttl, max_size)
+        self.roster = Roster(bot)
+        self.metrics = None
+
+    def __getattr__(self, name):
+        if name == 'bot':
+            raise AttributeError(name)
+        return getattr(self.bot, name)
+
+    def caches(self) -> List[TtlCache]:
+        return [self.members, self.profiles, self.groups]
+
+    def count(self, cache: TtlCache, hits: int, misses: int):
+        if self.metrics is None:
+            return
+        if hits > 0:
+            self.metrics.count(f'bot_cache.{cache.name}.hit', hits)
+        if misses > 0:
+            self.metrics.count(f'bot_cache.{cache.name}.miss', misses)
+
+    async def load(self, cache: TtlCache, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        hits, misses = cache.hits, cache.misses
+        try:
+            return await cache.load(key, loader)
+        finally:
+            self.count(cache, cache.hits - hits, cache.misses - misses)
+
+    async def get_group(self, group_id: Union[Group, int]) -> Optional[Group]:
+        # 与Mirai一样也接受Group对象, 缓存统一以群号为键
+        group_id = getattr(group_id, 'id', group_id)
+        return await self.load(self.groups, group_id, lambda: self.bot.get_group(group_id))
+
+    async def get_group_member(self, group: Union[Group, int], member_id: int) -> Optional[GroupMember]:
+        group = getattr(group, 'id', group)
+        roster = self.roster.get(group)
+        if roster is not None:
+            member = roster.get(member_id)
+            if member is not None:
+                self.members.hits += 1
+                self.count(self.members, 1, 0)
+                return member
+        return await self.load(self.members, (group, member_id), lambda: self.bot.get_group_member(group, member_id))
+
+    async def member_list(self, target: Union[Group, int]):
+        target = getattr(target, 'id', target)
+        # 由成员镜像提供, 只有第一次需要请求
+        roster = await self.roster.of(target)
+        return MemberListResponse(code=0, msg='', data=list(roster.members.values()))
+
+    async def get_group_members(self, group_id: Union[Group, int], member_ids: Iterable[int]) -> Dict[int, GroupMember]:
+        # 批量获取, 未命中的较多时用一次member_list代替逐个请求; 不在群中的成员不出现在结果中
+        group_id = getattr(group_id, 'id', group_id)
+        member_ids = list(dict.fromkeys(member_ids))
+        res: Dict[int, GroupMember] = {}
+        missing = []
+        for member_id in member_ids:
+            member = self.members.get((group_id, member_id))
+            if member is None:
+                missing.append(member_id)
+            else:
+                res[member_id] = member
+        self.members.hits += len(res)
+        self.count(self.members, len(res), 0)
+        roster = self.roster.get(group_id)
+        if roster is None and len(missing) > self.PREFETCH_LIST_THRESHOLD:
+            self.members.misses += 1
+            self.count(self.members, 0, 1)
+            roster = await self.roster.of(group_id)
+        if roster is not None:
+            for member_id in missing:
+                member = roster.get(member_id)
+                if member is not None:
+                    res[member_id] = member
+        elif len(missing) > 0:
+            fetched = await asyncio.gather(*(self.get_group_member(group_id, member_id) for member_id in missing), return_exceptions=True)
+            for member_id, member in zip(missing, fetched):
+                if isinstance(member, GroupMember):
+                    res[member_id] = member
+        return {member_id: res[member_id] for member_id in member_ids if member_id in res}
+
+    def member_info(self, *args):
+        return CachedMemberInfo(self, args)
+
+    async def kick(self, target: Union[Group, int], member_id: int, *args, **kwargs):
+        target = getattr(target, 'id', target)
+        try:
+            return await self.bot.kick(target, member_id, *args, **kwargs)
+        finally:
+            self.forget_member(target, member_id)
+
+    def forget_member(self, group_id: int, member_id: int):
+        self.members.invalidate((group_id, member_id))
+        self.profiles.invalidate((group_id, member_id))
+
+    def forget_group(self, group_id: int):
+        self.groups.invalidate(group_id)
+        self.members.invalidate_where(lambda k: k[0] == group_id)
+        self.profiles.invalidate_where(lambda k: k[0] == group_id)
+
+    def observe(self, event: Event):
+        # 在分发之前调用, 保证处理器看到的是事件之后的状态
+        self.roster.apply(event)
+        if isinstance(event, (GroupMessage, TempMessage)):
+            member = event.sender
+            self.members.put((member.group.id, member.id), member)
+            self.groups.put(member.group.id, member.group)
+        elif isinstance(event, (MemberCardChangeEvent, MemberSpecialTitleChangeEvent, MemberPermissionChangeEvent)):
+            self.forget_member(event.member.group.id, event.member.id)
+        elif isinstance(event, MemberJoinEvent):
+            self.members.put((event.member.group.id, event.member.id), event.member)
+        elif isinstance(event, (MemberLeaveEventKick, MemberLeaveEventQuit)):
+            self.forget_member(event.member.group.id, event.member.id)
+        elif isinstance(event, GroupNameChangeEvent):
+            self.groups.invalidate(event.group.id)
+        elif isinstance(event, (BotLeaveEventActive, BotLeaveEventKick)):
+            self.forget_group(event.group.id)
+
+class CachedMemberInfo():
+    # 对应bot.member_info(group, member).get() 与 bot.member_info().set(group, member, info)
+    def __init__(self, cache: BotCache, args: tuple) -> None:
+        self.cache = cache
+        self.args = args
+
+    async def get(self, *args):
+        group_id, member_id = (*self.args, *args)
+        group_id = getattr(group_id, 'id', group_id)
+        return await self.cache.load(self.cache.profiles, (group_id, member_id), lambda: self.cache.bot.member_info(group_id, member_id).get())
+
+    async def set(self, *args):
+        group_id, member_id, *rest = (*self.args, *args)
+        group_id = getattr(group_id, 'id', group_id)
+        try:
+            return await self.cache.bot.member_info(group_id, member_id).set(*rest)
+        finally:
+            self.cache.forget_member(group_id, member_id)
@@ -0,0 +1,141 @@
+import asyncio
+from dataclasses import dataclass
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Hashable, Literal, Optional
+from mirai import Event, FriendMessage, GroupMessage, StrangerMessage, TempMessage
+from mirai.models.events import NudgeEvent, MemberJoinRequestEvent, GroupRecallEvent, MemberJoinEvent, MemberUnmuteEvent, MemberCardChangeEvent
+
+from metrics import Metrics
+from utilities import get_logger
+
+logger = get_logger()
+
+def lane_of(event: Event) -> Hashable:
+    if isinstance(event, (GroupMessage, TempMessage)):
+        return ('group', event.group.id)
+    if isinstance(event, FriendMessage):
+        return ('friend', event.sender.id)
+    if isinstance(event, StrangerMessage):
+        return ('stranger', event.sender.id)
+    if isinstance(event, NudgeEvent):
+        if event.subject.kind == 'Group':
+            return ('group', event.subject.id)
+        return ('friend', event.subject.id)
+    if isinstance(event, MemberJoinRequestEvent):
+        return ('group', event.group_id)
+    if isinstance(event, GroupRecallEvent):
+        return ('group', event.group.id)
+    if isinstance(event, (MemberJoinEvent, MemberUnmuteEvent, MemberCardChangeEvent)):
+        return ('group', event.member.group.id)
+    return ('event', event.type)
+
+@dataclass
+class LaneStats():
+    submitted: int = 0
+    processed: int = 0
+    dropped: int = 0
+    max_depth: int = 0
+    total_wait: float = 0
+    max_wait: float = 0
+
+    @property
+    def avg_wait(self):
+        if self.processed == 0:
+            return 0
+        return self.total_wait / self.processed
+
+@dataclass
+class Lane():
+    queue: asyncio.Queue
+    worker: Optional[asyncio.Task] = None
+    pending: int = 0 # 正在等待入队的事件数
+
+# 位于bot.on(...)与Engine.of(...)之间: 同一个群/好友的事件按顺序处理, 不同的群之间并行
+# 排队深度与等待时间按通道类型汇总到metrics; lane_stats只保留现存的通道, 回收时并入stats
+class Dispatcher():
+    lanes: Dict[Hashable, Lane]
+    lane_stats: Dict[Hashable, LaneStats]
+    stats: LaneStats
+    metrics: Optional[Metrics]
+
+    def __init__(self, *, max_workers: int = 16, max_queue: int = 64, overflow: Literal['wait', 'drop'] = 'wait', slow_wait: float = 5) -> None:
+        self.lanes = {}
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.slow_wait = slow_wait
+        self.semaphore = asyncio.Semaphore(max_workers)
+        self.lane_stats = {}
+        self.stats = LaneStats()
+        self.metrics = None
+
+    def stats_of(self, key: Hashable) -> LaneStats:
+        if key not in self.lane_stats:
+            self.lane_stats[key] = LaneStats()
+        return self.lane_stats[key]
+
+    async def submit(self, event: Event, job: Callable[[], Awaitable[Any]]):
+        key = lane_of(event)
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = Lane(queue=asyncio.Queue(self.max_queue))
+        if lane.queue.full():
+            if self.overflow == 'drop':
+                self.stats_of(key).dropped += 1
+                self.stats.dropped += 1
+                if self.metrics is not None:
+                    self.metrics.count(f'dispatch.{key[0]}.dropped')
+                logger.warning(f'{key}的事件队列已满, 丢弃{event.type}')
+                return
+            logger.warning(f'{key}的事件队列已满, 等待处理...')
+        lane.pending += 1
+        try:
+            await lane.queue.put((time.monotonic(), job))
+        finally:
+            lane.pending -= 1
+        depth = lane.queue.qsize()
+        for stats in (self.stats_of(key), self.stats):
+            stats.submitted += 1
+            stats.max_depth = max(stats.max_depth, depth)
+        if self.metrics is not None:
+            self.metrics.count(f'dispatch.{key[0]}.submitted')
+            self.metrics.peak(f'dispatch.{key[0]}.depth', depth)
+        if lane.worker is None:
+            lane.worker = asyncio.create_task(self.work(key, lane))
+
+    async def work(self, key: Hashable, lane: Lane):
+        try:
+            while not lane.queue.empty():
+                ts, job = lane.queue.get_nowait()
+                async with self.semaphore:
+                    wait = time.monotonic() - ts
+                    for stats in (self.stats_of(key), self.stats):
+                        stats.processed += 1
+                        stats.total_wait += wait
+                        stats.max_wait = max(stats.max_wait, wait)
+                    if self.metrics is not None:
+                        self.metrics.dispatch_waited(key[0], wait)
+                    if wait > self.slow_wait:
+                        logger.warning(f'{key}的事件排队了{wait:.2f}s')
+                    try:
+                        await job()
+                    except Exception:
+                        traceback.print_exc()
+        finally:
+            lane.worker = None
+            # 空闲的通道直接回收, 还有事件在等待入队时由它们重新拉起worker
+            if lane.queue.empty() and lane.pending == 0 and self.lanes.get(key) is lane:
+                self.lanes.pop(key, None)
+                self.lane_stats.pop(key, None)
+
+    # 等待所有已提交的事件处理完
+    async def drain(self):
+        while len(self.lanes) > 0:
+            workers = [lane.worker for lane in self.lanes.values() if lane.worker is not None]
+            if len(workers) == 0:
+                await asyncio.sleep(0)
+                continue
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def depth(self):
+        return {key: lane.queue.qsize() for key, lane in self.lanes.items()}
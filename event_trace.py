@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import secrets
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+from mirai import Event
+
+# 录制的事件文件: gzip压缩的json lines, 第一行是文件头, 之后每行一个事件
+# {"t": 相对录制开始的秒数, "event": mirai事件(by_alias)}
+TRACE_VERSION = 1
+
+# 这些字段是QQ号或群号
+ID_KEYS = {'id', 'fromId', 'target', 'authorId', 'groupId', 'senderId', 'targetId'}
+# 这些类型的id是消息id, 保留原值, 撤回事件才能对得上
+MESSAGE_ID_TYPES = {'Source', 'Quote'}
+NAME_KEYS = {'memberName', 'nickname', 'remark', 'name', 'groupName', 'nick', 'specialTitle', 'display'}
+DROP_KEYS = {'url', 'path', 'base64'}
+# 名片修改事件中的新旧名片
+CARD_CHANGE_KEYS = {'origin', 'current'}
+COMMAND_PREFIXES = ('#', '＃', '/')
+
+class Anonymizer():
+    def __init__(self, salt: str, *, keep: Dict[int, int] = None, redact_text: bool = False) -> None:
+        self.salt = salt
+        self.keep = keep or {}
+        self.redact_text = redact_text
+        self.ids: Dict[int, int] = {}
+
+    def map_id(self, v: int) -> int:
+        if v in self.keep:
+            return self.keep[v]
+        mapped = self.ids.get(v)
+        if mapped is None:
+            # 同一个salt下映射稳定, 多次录制的文件之间也能对得上
+            digest = hashlib.blake2b(f'{self.salt}:{v}'.encode(), digest_size=4).digest()
+            mapped = self.ids[v] = 100000 + int.from_bytes(digest, 'little') % 900000000
+        return mapped
+
+    def map_text(self, text: str) -> str:
+        if not self.redact_text:
+            return text
+        # 保留指令名, 其余字符替换掉, 长度不变
+        head = ''
+        if text.startswith(COMMAND_PREFIXES):
+            head, text = re.match(r'(\S*)(.*)', text, re.S).groups()
+        return head + re.sub(r'[A-Za-z]', 'x', re.sub(r'\d', '0', re.sub(r'[^\x00-\x7f\s]', '喵', text)))
+
+    def map(self, o: Any, parent_type: Optional[str] = None) -> Any:
+        if isinstance(o, list):
+            return [self.map(v, parent_type) for v in o]
+        if not isinstance(o, dict):
+            return o
+        t = o.get('type', parent_type)
+        res = {}
+        for k, v in o.items():
+            if k in DROP_KEYS:
+                v = None
+            elif k in ID_KEYS and isinstance(v, int) and not (k == 'id' and t in MESSAGE_ID_TYPES):
+                v = self.map_id(v)
+            elif (k in NAME_KEYS or (k in CARD_CHANGE_KEYS and t == 'MemberCardChangeEvent')) and isinstance(v, str) and v != '':
+                v = f'u{hashlib.blake2b(f"{self.salt}:{v}".encode(), digest_size=3).hexdigest()}'
+            elif k == 'text' and t == 'Plain' and isinstance(v, str):
+                v = self.map_text(v)
+            elif k == 'message' and t == 'MemberJoinRequestEvent' and isinstance(v, str):
+                v = self.map_text(v)
+            else:
+                v = self.map(v, t)
+            res[k] = v
+        return res
+
+class TraceWriter():
+    def __init__(self, path: str, *, bot_qq: int, anonymize: bool = True, salt: Optional[str] = None, redact_text: bool = False, flush_interval: float = 5) -> None:
+        dir_name = os.path.dirname(path)
+        if dir_name != '':
+            os.makedirs(dir_name, exist_ok=True)
+        self.f = gzip.open(path, 'wt', encoding='utf-8')
+        self.started = time.time()
+        self.anonymizer = Anonymizer(salt or secrets.token_hex(8), keep={bot_qq: bot_qq}, redact_text=redact_text) if anonymize else None
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.write({'version': TRACE_VERSION, 'started': self.started, 'bot_qq': bot_qq, 'anonymized': anonymize})
+
+    def write(self, o: dict):
+        self.f.write(json.dumps(o, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def record(self, event: Event):
+        o = json.loads(event.json(by_alias=True))
+        if self.anonymizer is not None:
+            o = self.anonymizer.map(o)
+        self.write({'t': round(time.time() - self.started, 3), 'event': o})
+        self.records += 1
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.last_flush = now
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+def read_trace(path: str) -> Tuple[dict, Iterator[Tuple[float, Event]]]:
+    f = gzip.open(path, 'rt', encoding='utf-8')
+    header = json.loads(f.readline())
+    if header.get('version') != TRACE_VERSION:
+        raise ValueError(f'不支持的录制文件版本 {header.get("version")}')
+    def events():
+        with f:
+            while True:
+                # 进程被杀掉时文件末尾可能不完整
+                try:
+                    line = f.readline()
+                    if line == '': break
+                    o = json.loads(line)
+                except (EOFError, json.JSONDecodeError):
+                    break
+                if 'event' not in o:
+                    continue
+                yield o['t'], Event.parse_obj(o['event'])
+    return header, events()
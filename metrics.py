@@ -0,0 +1,153 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 对数分桶: 0.1ms起, 每桶增长25%, 最后一桶约127s
+BUCKET_BOUNDS: List[float] = [0.0001 * 1.25 ** i for i in range(64)]
+
+@dataclass
+class Histogram():
+    counts: List[int] = field(default_factory=lambda: [0] * (len(BUCKET_BOUNDS) + 1))
+    total: int = 0
+    sum: float = 0
+    max: float = 0
+
+    def record(self, seconds: float):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        if self.total == 0:
+            return 0
+        rank = q * self.total
+        seen = 0
+        for i, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= rank:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    @property
+    def avg(self):
+        return self.sum / self.total if self.total > 0 else 0
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'avg_ms': self.avg * 1000,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p95_ms': self.percentile(0.95) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+@dataclass
+class HandlerMetrics():
+    calls: int = 0
+    errors: int = 0 # 抛出到处理器之外的异常
+    swallowed: Dict[str, int] = field(default_factory=dict) # 被吞掉的异常, 按类型计数
+    latency: Histogram = field(default_factory=Histogram)
+
+    def record(self, seconds: float):
+        self.calls += 1
+        self.latency.record(seconds)
+
+class Timing():
+    def __init__(self, metrics: HandlerMetrics):
+        self.metrics = metrics
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, trace):
+        self.metrics.record(time.perf_counter() - self.started)
+        if type is not None:
+            self.metrics.errors += 1
+
+class Metrics():
+    handlers: Dict[Tuple[str, str], HandlerMetrics]
+    events: Dict[str, Histogram] # 从app.py收到事件到最后一次发送
+    processing: Dict[str, Histogram] # 从收到事件到处理结束
+    dispatch_wait: Dict[str, Histogram] # 事件在分发队列中的等待, 按通道类型(group/friend/...)
+    exceptions: Dict[str, int]
+    counters: Dict[str, int]
+    peaks: Dict[str, int] # 只保留最大值的量, 比如队列深度
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.handlers = {}
+        self.events = {}
+        self.processing = {}
+        self.dispatch_wait = {}
+        self.exceptions = {}
+        self.counters = {}
+        self.peaks = {}
+
+    def of(self, plugin_name: str, handler_name: str) -> HandlerMetrics:
+        key = (plugin_name, handler_name)
+        m = self.handlers.get(key)
+        if m is None:
+            m = self.handlers[key] = HandlerMetrics()
+        return m
+
+    def timing(self, plugin_name: str, handler_name: str) -> Timing:
+        return Timing(self.of(plugin_name, handler_name))
+
+    def swallowed(self, e: BaseException, plugin_name: Optional[str] = None, handler_name: Optional[str] = None):
+        name = type(e).__name__
+        self.exceptions[name] = self.exceptions.get(name, 0) + 1
+        if plugin_name is not None:
+            swallowed = self.of(plugin_name, handler_name).swallowed
+            swallowed[name] = swallowed.get(name, 0) + 1
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def peak(self, name: str, value: int):
+        if value > self.peaks.get(name, 0):
+            self.peaks[name] = value
+
+    def dispatch_waited(self, kind: str, seconds: float):
+        self.dispatch_wait.setdefault(kind, Histogram()).record(seconds)
+
+    def event_done(self, event_type: str, received: float, last_sent: Optional[float]):
+        now = time.perf_counter()
+        self.processing.setdefault(event_type, Histogram()).record(now - received)
+        if last_sent is not None:
+            self.events.setdefault(event_type, Histogram()).record(last_sent - received)
+
+    def top(self, n: int = 10, key: str = 'p95_ms') -> List[Tuple[Tuple[str, str], HandlerMetrics, dict]]:
+        items = [(k, m, m.latency.summary()) for k, m in self.handlers.items()]
+        items.sort(key=lambda it: -it[2][key])
+        return items[:n]
+
+    def snapshot(self) -> dict:
+        return {
+            'started': self.started,
+            'dumped': time.time(),
+            'handlers': {
+                f'{plugin_name}.{handler_name}': {
+                    'calls': m.calls,
+                    'errors': m.errors,
+                    'swallowed': m.swallowed,
+                    **m.latency.summary(),
+                } for (plugin_name, handler_name), m in self.handlers.items()
+            },
+            'events': {t: h.summary() for t, h in self.events.items()},
+            'processing': {t: h.summary() for t, h in self.processing.items()},
+            'dispatch_wait': {kind: h.summary() for kind, h in self.dispatch_wait.items()},
+            'exceptions': self.exceptions,
+            'counters': self.counters,
+            'peaks': self.peaks,
+        }
+
+    def dump(self, file_path: str):
+        with open(f'{file_path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(f'{file_path}.tmp', file_path)
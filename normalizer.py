@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from typing import FrozenSet, List, Optional
+from mirai import MessageChain, Plain
+import zhconv
+from zhconv.zhconv import getdict
+
+# 不会出现在消息里的分隔符, 批量转换时用来拼接多段文本
+BATCH_SEP = '\x00'
+
+# 入站文本的繁简转换, 输出与zhconv.convert(t, locale)一致
+class Normalizer():
+    triggers: Optional[FrozenSet[str]]
+    cache: OrderedDict
+
+    def __init__(self, locale: str = 'zh-cn', *, cache_size: int = 4096, cache_max_len: int = 32) -> None:
+        self.locale = locale
+        self.cache_size = cache_size
+        self.cache_max_len = cache_max_len
+        self.cache = OrderedDict()
+        self.triggers = None
+        self.ascii_safe = True
+        self.skipped = 0
+        self.cache_hits = 0
+        self.converted = 0
+
+    def load(self):
+        # 词典中每个词的第一个非ASCII字符, 文本里一个都没有就不可能匹配到任何词
+        triggers = set()
+        for word in getdict(self.locale):
+            ch = next((c for c in word if not c.isascii()), None)
+            if ch is None:
+                self.ascii_safe = False
+                ch = word[0]
+            triggers.add(ch)
+        self.triggers = frozenset(triggers)
+
+    def need_convert(self, text: str) -> bool:
+        if self.ascii_safe and text.isascii():
+            return False
+        if self.triggers is None:
+            self.load()
+        return not self.triggers.isdisjoint(text)
+
+    def convert(self, text: str) -> str:
+        if not self.need_convert(text):
+            self.skipped += 1
+            return text
+        if len(text) > self.cache_max_len:
+            self.converted += 1
+            return zhconv.convert(text, self.locale)
+        converted = self.cache.get(text)
+        if converted is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(text)
+            return converted
+        self.converted += 1
+        converted = self.cache[text] = zhconv.convert(text, self.locale)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return converted
+
+    def convert_batch(self, texts: List[str]) -> List[str]:
+        if len(texts) <= 1:
+            return [self.convert(text) for text in texts]
+        results = list(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            if not self.need_convert(text):
+                self.skipped += 1
+            elif len(text) <= self.cache_max_len and text in self.cache:
+                self.cache_hits += 1
+                self.cache.move_to_end(text)
+                results[i] = self.cache[text]
+            else:
+                pending.append(i)
+        if len(pending) == 1 or any(BATCH_SEP in texts[i] for i in pending):
+            for i in pending:
+                results[i] = self.convert(texts[i])
+            return results
+        if len(pending) > 1:
+            # 分隔符不在任何词里, 最大正向匹配不会跨过它
+            joined = zhconv.convert(BATCH_SEP.join(texts[i] for i in pending), self.locale)
+            self.converted += len(pending)
+            for i, converted in zip(pending, joined.split(BATCH_SEP)):
+                results[i] = converted
+                if len(texts[i]) <= self.cache_max_len:
+                    self.cache[texts[i]] = converted
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return results
+
+    def normalize_chain(self, chain: MessageChain) -> MessageChain:
+        indices = [i for i, comp in enumerate(chain) if isinstance(comp, Plain)]
+        texts = self.convert_batch([chain[i].text.replace('‭', '') for i in indices])
+        comps = list(chain)
+        for i, text in zip(indices, texts):
+            comps[i] = Plain(text)
+        return MessageChain(comps)
@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+import heapq
+import itertools
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from mirai import FriendMessage, GroupMessage, Mirai, Plain, TempMessage
+from mirai.models.entities import Friend, Group, GroupMember
+from mirai.models.message import MessageComponent
+
+from utilities import get_logger
+
+logger = get_logger()
+
+class Priority(IntEnum):
+    REPLY = 0 # 处理消息时的回复
+    NORMAL = 1 # 其他事件与后台任务中的发送
+    BROADCAST = 2 # 批量的通知
+
+_send_priority = contextvars.ContextVar[Optional[Priority]]('send_priority', default=None)
+
+# with send_priority(Priority.BROADCAST): 其中的发送都使用该优先级
+@contextmanager
+def send_priority(priority: Priority):
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+@dataclass
+class TokenBucket():
+    rate: float # 每秒补充的令牌数
+    burst: float
+    tokens: float = field(init=False)
+    updated: float = field(init=False)
+
+    def __post_init__(self):
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self.refill(now)
+        self.tokens -= 1
+
+@dataclass(order=True)
+class Outgoing():
+    priority: int
+    seq: int
+    key: Tuple = field(compare=False)
+    api: str = field(compare=False)
+    args: tuple = field(compare=False) # 消息链之前的参数
+    chain: list = field(compare=False)
+    quote: Any = field(compare=False)
+    enqueued: float = field(compare=False)
+    futures: List[asyncio.Future] = field(compare=False)
+
+@dataclass
+class OutboxStats():
+    queued: int = 0
+    sent: int = 0
+    coalesced: int = 0
+    failed: int = 0
+    max_depth: int = 0
+    total_wait: Dict[Priority, float] = field(default_factory=lambda: {p: 0 for p in Priority})
+    max_wait: Dict[Priority, float] = field(default_factory=lambda: {p: 0 for p in Priority})
+    count: Dict[Priority, int] = field(default_factory=lambda: {p: 0 for p in Priority})
+
+# 位于插件与bot之间: 所有发送按目标(群/私聊)用令牌桶限速, 回复优先于通知
+# 其他接口原样转发给bot, 发送返回的仍是bot的回执
+class Outbox():
+    queues: Dict[Tuple, List[Outgoing]]
+    buckets: Dict[Tuple, TokenBucket]
+    busy: Set[Tuple] # 每个目标同时只有一条在发送, 保证顺序
+
+    def __init__(self, bot: Mirai, *, rate: float = 1, burst: float = 5, global_rate: float = 5, global_burst: float = 10, temp_rate: float = 1 / 3, temp_burst: float = 1, coalesce: bool = False, coalesce_max_len: int = 200) -> None:
+        self.bot = bot
+        self.rate = rate
+        self.burst = burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        # 临时会话更容易被风控, 不论对象统一限速
+        self.temp_bucket = TokenBucket(temp_rate, temp_burst)
+        self.coalesce = coalesce
+        self.coalesce_max_len = coalesce_max_len
+        self.priority_of: Callable[[], Priority] = lambda: Priority.NORMAL
+        self.queues = {}
+        self.buckets = {}
+        self.busy = set()
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # 事件循环只保留任务的弱引用, 发送中的任务都记在这里
+        self.deliveries: Set[asyncio.Task] = set()
+        self.stats = OutboxStats()
+
+    def __getattr__(self, name):
+        if name == 'bot':
+            raise AttributeError(name)
+        return getattr(self.bot, name)
+
+    async def send_group_message(self, target: int, message_chain, quote=None):
+        return await self.enqueue(('group', target), 'send_group_message', (target,), message_chain, quote)
+
+    async def send_temp_message(self, qq: int, group: int, message_chain, quote=None):
+        return await self.enqueue(('temp', group, qq), 'send_temp_message', (qq, group), message_chain, quote)
+
+    async def send_friend_message(self, target: int, message_chain, quote=None):
+        return await self.enqueue(('friend', target), 'send_friend_message', (target,), message_chain, quote)
+
+    async def send(self, target, message, quote: bool = False):
+        quote_id = None
+        if quote and isinstance(target, (GroupMessage, FriendMessage, TempMessage)):
+            quote_id = target.message_chain.message_id
+        if isinstance(target, GroupMessage):
+            return await self.send_group_message(target.group.id, message, quote_id)
+        if isinstance(target, TempMessage):
+            return await self.send_temp_message(target.sender.id, target.group.id, message, quote_id)
+        if isinstance(target, FriendMessage):
+            return await self.send_friend_message(target.sender.id, message, quote_id)
+        if isinstance(target, Group):
+            return await self.send_group_message(target.id, message)
+        if isinstance(target, Friend):
+            return await self.send_friend_message(target.id, message)
+        if isinstance(target, GroupMember):
+            return await self.send_temp_message(target.id, target.group.id, message)
+        return await self.bot.send(target, message, quote)
+
+    async def enqueue(self, key: Tuple, api: str, args: tuple, chain, quote) -> Any:
+        if isinstance(chain, (str, MessageComponent)):
+            chain = [chain]
+        priority = _send_priority.get()
+        if priority is None:
+            priority = self.priority_of()
+        future = asyncio.get_running_loop().create_future()
+        item = Outgoing(int(priority), next(self.seq), key, api, args, list(chain), quote, time.monotonic(), [future])
+        queue = self.queues.setdefault(key, [])
+        heapq.heappush(queue, item)
+        self.stats.queued += 1
+        self.stats.max_depth = max(self.stats.max_depth, len(queue))
+        self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.schedule())
+        return await future
+
+    def bucket_of(self, key: Tuple) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def is_small_text(self, item: Outgoing) -> bool:
+        return item.quote is None and all(isinstance(c, (str, Plain)) for c in item.chain) and len(self.text_of(item)) <= self.coalesce_max_len
+
+    @staticmethod
+    def text_of(item: Outgoing) -> str:
+        return ''.join(c if isinstance(c, str) else c.text for c in item.chain)
+
+    def is_throttled(self, key: Tuple) -> bool:
+        # 取走当前这条的令牌后, 下一条是否还得等
+        if self.bucket_of(key).tokens < 1 or self.global_bucket.tokens < 1:
+            return True
+        return key[0] == 'temp' and self.temp_bucket.tokens < 1
+
+    def take_coalesced(self, item: Outgoing, queue: List[Outgoing]):
+        # 限速时同一目标排在后面的小段文字合并成一条发送, 每个调用者拿到同一个回执
+        # 令牌充足时照常逐条发送, 不改变回复的样子
+        if not self.coalesce or not self.is_small_text(item) or not self.is_throttled(item.key):
+            return
+        texts = [self.text_of(item)]
+        length = len(texts[0])
+        while len(queue) > 0 and queue[0].priority == item.priority and self.is_small_text(queue[0]):
+            text = self.text_of(queue[0])
+            if length + 1 + len(text) > self.coalesce_max_len:
+                break
+            merged = heapq.heappop(queue)
+            texts.append(text)
+            length += 1 + len(text)
+            item.futures.extend(merged.futures)
+            self.record_wait(merged)
+            self.stats.coalesced += 1
+        if len(texts) > 1:
+            item.chain = ['\n'.join(texts)]
+
+    def record_wait(self, item: Outgoing):
+        wait = time.monotonic() - item.enqueued
+        p = Priority(item.priority)
+        self.stats.count[p] += 1
+        self.stats.total_wait[p] += wait
+        self.stats.max_wait[p] = max(self.stats.max_wait[p], wait)
+
+    async def schedule(self):
+        while any(len(q) > 0 for q in self.queues.values()) or len(self.busy) > 0:
+            now = time.monotonic()
+            best: Optional[Outgoing] = None
+            wake: Optional[float] = None
+            for key, queue in self.queues.items():
+                if len(queue) == 0 or key in self.busy:
+                    continue
+                wait = self.bucket_of(key).wait_time(now)
+                if key[0] == 'temp':
+                    wait = max(wait, self.temp_bucket.wait_time(now))
+                if wait > 0:
+                    wake = wait if wake is None else min(wake, wait)
+                    continue
+                if best is None or queue[0] < best:
+                    best = queue[0]
+            if best is not None:
+                global_wait = self.global_bucket.wait_time(now)
+                if global_wait > 0:
+                    wake = global_wait if wake is None else min(wake, global_wait)
+                    best = None
+            if best is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wake)
+                except asyncio.TimeoutError: ...
+                continue
+
+            queue = self.queues[best.key]
+            heapq.heappop(queue)
+            self.record_wait(best)
+            self.bucket_of(best.key).take(now)
+            if best.key[0] == 'temp':
+                self.temp_bucket.take(now)
+            self.global_bucket.take(now)
+            self.take_coalesced(best, queue)
+            if len(queue) == 0:
+                self.queues.pop(best.key)
+            self.busy.add(best.key)
+            task = asyncio.create_task(self.deliver(best))
+            self.deliveries.add(task)
+            task.add_done_callback(self.deliveries.discard)
+        # 已经回满的桶与新建的没有区别, 清理掉
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[key]
+
+    async def deliver(self, item: Outgoing):
+        try:
+            kwargs = {} if item.quote is None else {'quote': item.quote}
+            resp = await getattr(self.bot, item.api)(*item.args, item.chain, **kwargs)
+            self.stats.sent += 1
+            for future in item.futures:
+                if not future.done():
+                    future.set_result(resp)
+        except Exception as e:
+            self.stats.failed += 1
+            logger.warning(f'{item.api}{item.args} failed {e=}')
+            for future in item.futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.busy.discard(item.key)
+            self.wakeup.set()
+
+    def depth(self):
+        return {key: len(queue) for key, queue in self.queues.items()}
@@ -5,8 +5,10 @@ import importlib.util
 import inspect
 import sys
 from types import MethodType, ModuleType
-from typing import Any, Awaitable, Callable, Final, Dict, ForwardRef, Generic, List, Literal, Optional, Set, Tuple, Type, TypeVar, Union, get_args, get_origin
+from typing import Any, Awaitable, Callable, Final, Dict, ForwardRef, Hashable, Generic, List, Literal, Optional, Set, Tuple, Type, TypeVar, Union, get_args, get_origin
 import pickle
+import struct
+import time
 import glob
 import re
 from typing import Union
@@ -20,11 +22,21 @@ import aiofile
 import inflection
 from functools import wraps
 import contextvars
+import tracemalloc
+from concurrent.futures import Future, ThreadPoolExecutor
 import traceback
 from collections.abc import Iterable
 from mirai.models.api import RespOperate
+from outbox import Priority
+from bot_cache import BotCache
+from roster import GroupRoster
+from metrics import Metrics
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
-from utilities import AchvEnum, GroupMemberOp, GroupOp, Msg, MsgOp, Overrides, Redirected, ResolverMixer, SourceOp, Target, User, bind, ensure_attr, get_logger, to_unbind
+from utilities import AchvEnum, GroupLocalStorage, GroupMemberOp, GroupOp, GroupSpec, JournaledStorage, journal_touches, remark_touched, Msg, MsgOp, Overrides, Redirected, ResolverMixer, SourceOp, SqliteGroupLocalStorage, SqliteGroupSpec, SqliteStorage, SqliteStore, SqliteUserSpec, Target, User, UserSpec, bind, ensure_attr, get_logger, lazy_timings, memoize, to_unbind, warm_up_lazy
 
 logger = get_logger()
 
@@ -43,6 +55,12 @@ class InstrAttr(Enum):
     FORECE_BACKUP = auto()
     BACKGROUND = auto()
     INTERCEPT_EXCEPTIONS = auto()
+    EXCLUSIVE = auto() # 并发模式下独占执行, 前后的处理器都不与之并行
+
+# 在指定的处理器('插件类名.方法名')之后执行; 并发模式下等它执行完后才开始
+@dataclass(frozen=True)
+class After():
+    target: str
 
 @dataclass
 class PluginPath():
@@ -113,16 +131,60 @@ class State():
     default: Any = None
     ...
 
+# 日志式持久化的快照, 记录快照已包含到的日志序号
+@dataclass
+class JournalSnapshot():
+    seq: int
+    target: 'Plugin'
+
+@dataclass
+class BackupStats():
+    writes: int = 0
+    bytes_written: int = 0
+    write_time: float = 0
+    coalesced: int = 0 # 被合并掉的脏标记
+    loop_pause: float = 0 # 在事件循环中序列化(日志记录, 首次快照)占用的时间
+    serialize_time: float = 0 # 在线程中序列化(压缩日志重写快照)的时间
+
 # 被注解的类变量是状态
 class BackupMan():
     t: asyncio.Task
     target: 'Plugin'
     # dirty: bool
 
+    JOURNAL_COMPACT_RECORDS: Final = 1000
+    JOURNAL_COMPACT_BYTES: Final = 8 * 1024 * 1024
+
+    # 加载时回放日志的结果: 序号, 记录数, 字节数
+    restored_journals: Dict[type, Tuple[int, int, int]] = {}
+    pending_restores: Dict[type, Future] = {}
+    # 恢复耗时与启动时等待的时间
+    restore_timings: Dict[type, Tuple[float, float]] = {}
+
     def __init__(self, target: 'Plugin'):
         self.t = None
         self.target = target
         # self.dirty = False
+        self.journal_enabled = ensure_attr(target.__class__, PluginConfig).journal
+        self.seq, self.journal_records, self.journal_bytes = 0, 0, 0
+        self.need_snapshot = not self.has_backup(target.__class__)
+        self.last_states: Dict[str, Any] = {}
+        if not target.is_restoring():
+            self.restored()
+
+        # 合并写入: 脏标记在间隔内合并, 最迟在max_staleness后写入
+        self.dirty = False
+        self.dirty_since = 0
+        self.last_dirty = 0
+        self.flushing = False
+        self.wakeup = asyncio.Event()
+        self.stats = BackupStats()
+
+    def restored(self):
+        self.seq, self.journal_records, self.journal_bytes = self.restored_journals.pop(self.target.__class__, (0, 0, 0))
+        if self.journal_enabled:
+            for storage in self.journaled_storages().values():
+                storage.track_dirty()
 
     def __enter__(self):
         ...
@@ -132,41 +194,304 @@ class BackupMan():
         ...
 
     def trigger_backup(self):
-        if self.t is not None and not self.t.done():
+        now = time.monotonic()
+        if self.dirty:
+            self.stats.coalesced += 1
+        else:
+            self.dirty = True
+            self.dirty_since = now
+        self.last_dirty = now
+        if self.t is None or self.t.done():
+            self.t = asyncio.create_task(self.flusher())
+
+    async def flusher(self):
+        # 写入期间又被标脏时会再写一次
+        while self.dirty:
+            engine = self.target.engine
+            deadline = min(self.last_dirty + engine.backup_interval, self.dirty_since + engine.backup_max_staleness)
+            delay = deadline - time.monotonic()
+            if delay > 0 and not self.flushing:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError: ...
+                continue
+            # 有事件正在处理时等它们结束再写, 免得记下处理到一半的状态; 最多等到max_staleness
+            staleness = self.dirty_since + engine.backup_max_staleness - time.monotonic()
+            if engine.active_contexts > 0 and staleness > 0 and not self.flushing:
+                try:
+                    await asyncio.wait_for(engine.idle.wait(), staleness)
+                except asyncio.TimeoutError: ...
+                continue
+            # 延迟恢复的插件先在循环上等状态就绪, 免得__getstate__阻塞等待
+            if self.target.is_restoring():
+                await self.target.wait_materialized()
+            self.dirty = False
+            job = self.make_job()
+            if job is None: continue
+            started = time.monotonic()
+            written = await job
+            self.stats.writes += 1
+            self.stats.bytes_written += written
+            self.stats.write_time += time.monotonic() - started
+
+    async def flush(self):
+        if self.t is None or self.t.done():
             return
+        self.flushing = True
+        self.wakeup.set()
+        try:
+            await self.t
+        finally:
+            self.flushing = False
+
+    def make_job(self) -> Optional[Awaitable[int]]:
+        job = self.make_state_job()
+        writes = [(storage, storage.prepare_write()) for storage in self.sqlite_storages().values() if storage.has_pending()]
+        if len(writes) == 0:
+            return job
+        async def fn():
+            loop = asyncio.get_running_loop()
+            written = 0
+            for storage, write in writes:
+                try:
+                    written += await loop.run_in_executor(None, write)
+                    storage.write_done(True)
+                except Exception as e:
+                    logger.error(f'sqlite write failed {e=}')
+                    storage.write_done(False)
+            logger.debug(f'{self.target.__class__.__name__} {len(writes)} sqlite tables written')
+            if job is not None:
+                written += await job
+            return written
+        return fn()
+
+    def make_state_job(self) -> Optional[Awaitable[int]]:
+        if self.journal_enabled:
+            try:
+                return self.prepare_journal()
+            except Exception as e:
+                logger.error(f'journal failed {e=}')
+                self.need_snapshot = True
+                return None
         async def fn():
             file_path = self.get_filepath(self.target.__class__)
             try:
-                by = pickle.dumps(self.target)
-                async with aiofile.async_open(file_path, 'wb') as f:
-                    await f.write(by)
+                written = await self.write_snapshot(self.target, file_path)
                 logger.debug(f'{self.target.__class__.__name__} state backuped')
+                return written
             except Exception as e:
                 logger.error(f'pickle failed {e=}')
                 print(self.target.__getstate__)
                 print(self.target.__getstate__())
-        self.t = asyncio.create_task(fn())
+                return 0
+        return fn()
+
+    def journaled_storages(self) -> Dict[str, JournaledStorage]:
+        return {k: v for k, v in self.target.__getstate__().items() if isinstance(v, JournaledStorage) and not isinstance(v, SqliteStorage)}
+
+    def sqlite_storages(self) -> Dict[str, SqliteStorage]:
+        return {k: v for k, v in self.target.__getstate__().items() if isinstance(v, SqliteStorage)}
+
+    def plain_states(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.target.__getstate__().items() if not isinstance(v, JournaledStorage)}
+
+    @staticmethod
+    def state_key(value: Any):
+        # 用于判断普通状态是否变化; 标量直接比较, 不必每次序列化
+        if value is None or isinstance(value, (bool, int, float, str, bytes)):
+            return (type(value), value)
+        return pickle.dumps(value)
+
+    def prepare_journal(self):
+        if self.need_snapshot or self.journal_records >= self.JOURNAL_COMPACT_RECORDS or self.journal_bytes >= self.JOURNAL_COMPACT_BYTES:
+            return self.compact()
+
+        started = time.perf_counter()
+        ops = []
+        for name, storage in self.journaled_storages().items():
+            if not storage.is_tracking():
+                # 存储被整个替换了, 直接记录整个存储
+                storage.track_dirty()
+                ops.append(('storage', name, storage))
+                continue
+            for key in storage.pop_dirty():
+                present, value = storage.journal_entry(key)
+                ops.append(('entry', name, key, present, value))
+        for name, value in self.plain_states().items():
+            by = self.state_key(value)
+            if self.last_states.get(name) != by:
+                self.last_states[name] = by
+                # 非标量的state_key就是序列化的结果, 直接写进日志, 不再序列化一次
+                ops.append(('pickled', name, by) if isinstance(by, bytes) else ('state', name, value))
+        if len(ops) == 0:
+            self.stats.loop_pause += time.perf_counter() - started
+            return None
+
+        self.seq += 1
+        payload = pickle.dumps((self.seq, ops))
+        record = struct.pack('<I', len(payload)) + payload
+        self.stats.loop_pause += time.perf_counter() - started
+        async def fn():
+            try:
+                async with aiofile.async_open(self.get_journal_path(self.target.__class__), 'ab') as f:
+                    await f.write(record)
+                self.journal_records += 1
+                self.journal_bytes += len(record)
+                logger.debug(f'{self.target.__class__.__name__} journal appended, {len(ops)} ops, {len(record)} bytes')
+                return len(record)
+            except Exception as e:
+                logger.error(f'journal failed {e=}')
+                self.need_snapshot = True
+                return 0
+        return fn()
+
+    def compact(self):
+        journal_path = self.get_journal_path(self.target.__class__)
+        if not self.need_snapshot:
+            # 快照文件与日志已经包含了全部状态, 在线程中用它们重写快照, 不触碰内存中的插件
+            async def rewrite():
+                try:
+                    written = await asyncio.get_running_loop().run_in_executor(None, self.rewrite_snapshot)
+                    self.journal_records = 0
+                    self.journal_bytes = 0
+                    return written
+                except Exception as e:
+                    logger.error(f'compact failed {e=}')
+                    self.need_snapshot = True
+                    return 0
+            return rewrite()
+
+        self.need_snapshot = False
+        for storage in self.journaled_storages().values():
+            storage.track_dirty()
+            storage.pop_dirty()
+        self.last_states = {k: self.state_key(v) for k, v in self.plain_states().items()}
+        snapshot = JournalSnapshot(self.seq, self.target)
+        async def fn():
+            try:
+                written = await self.write_snapshot(snapshot, self.get_filepath(self.target.__class__))
+                # 快照已包含日志中的全部记录
+                open(journal_path, 'wb').close()
+                self.journal_records = 0
+                self.journal_bytes = 0
+                logger.debug(f'{self.target.__class__.__name__} journal compacted, seq={self.seq}')
+                return written
+            except Exception as e:
+                logger.error(f'compact failed {e=}')
+                self.need_snapshot = True
+                return 0
+        return fn()
+
+    def rewrite_snapshot(self) -> int:
+        started = time.perf_counter()
+        target_cls = self.target.__class__
+        file_path = self.get_filepath(target_cls)
+        with open(file_path, 'rb') as f:
+            obj = pickle.load(f)
+        seq = 0
+        if isinstance(obj, JournalSnapshot):
+            seq = obj.seq
+            obj = obj.target
+        seq, _, _ = self.replay_journal(obj, seq)
+        with open(f'{file_path}.tmp', 'wb') as f:
+            pickle.dump(JournalSnapshot(seq, obj), f)
+        os.replace(f'{file_path}.tmp', file_path)
+        open(self.get_journal_path(target_cls), 'wb').close()
+        serialize = time.perf_counter() - started
+        self.stats.serialize_time += serialize
+        logger.debug(f'{target_cls.__name__} journal compacted off loop, seq={seq}, serialize {serialize * 1000:.1f}ms')
+        return os.path.getsize(file_path)
+
+    # 在事件循环中序列化, 保证得到一致的状态, 只有写文件在线程中进行
+    # 只用于首次快照与journal=False的插件; 其他情况下快照由rewrite_snapshot在线程中重写
+    async def write_snapshot(self, obj: Any, file_path: str) -> int:
+        loop = asyncio.get_running_loop()
+        tmp_path = f'{file_path}.tmp'
+        started = time.perf_counter()
+        data = pickle.dumps(obj)
+        paused = time.perf_counter() - started
+        def write():
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+        await loop.run_in_executor(None, write)
+        self.stats.loop_pause += paused
+        logger.debug(f'{self.target.__class__.__name__} snapshot: loop paused {paused * 1000:.1f}ms, {len(data)} bytes')
+        return len(data)
 
     def set_dirty(self):
         # self.dirty = True
+        # 长期运行的上下文(自动运行的任务)不会退出, 在标脏时重新标记访问过的条目
+        touches = journal_touches.get()
+        if touches is not None:
+            remark_touched(touches)
         self.target.engine.append_dirty_plugin(self.target)
 
     @classmethod
     def get_filepath(cls, target_cls: Type['Plugin']):
         return os.path.join(BACKUP_PATH, f'{target_cls.__module__.split(".")[-1]}.pkl')
 
+    @classmethod
+    def get_journal_path(cls, target_cls: Type['Plugin']):
+        return os.path.join(BACKUP_PATH, f'{target_cls.__module__.split(".")[-1]}.journal')
+
+    @classmethod
+    def get_sqlite_path(cls, target_cls: Type['Plugin']):
+        return os.path.join(BACKUP_PATH, f'{target_cls.__module__.split(".")[-1]}.sqlite3')
+
     @classmethod
     def has_backup(cls, target_cls: Type['Plugin']):
         return os.path.exists(cls.get_filepath(target_cls))
 
+    # 启动时并行恢复各插件的状态, 以免逐个读取反序列化拖慢启动
+    @classmethod
+    def start_restores(cls, target_classes: List[Type['Plugin']]):
+        pool = ThreadPoolExecutor(min(8, os.cpu_count() or 1), thread_name_prefix='restore')
+        for target_cls in target_classes:
+            if target_cls not in cls.pending_restores and cls.has_backup(target_cls):
+                cls.pending_restores[target_cls] = pool.submit(cls.restore, target_cls)
+        pool.shutdown(wait=False)
+
+    @classmethod
+    def restore(cls, target_cls: Type['Plugin']) -> Tuple['Plugin', float]:
+        started = time.perf_counter()
+        seq = 0
+        with open(cls.get_filepath(target_cls), 'rb') as f:
+            obj = pickle.load(f)
+        if isinstance(obj, JournalSnapshot):
+            seq = obj.seq
+            obj = obj.target
+        if ensure_attr(target_cls, PluginConfig).journal:
+            cls.restored_journals[target_cls] = cls.replay_journal(obj, seq)
+        cls.attach_sqlite(obj)
+        return obj, time.perf_counter() - started
+
+    @classmethod
+    def wait_restore(cls, target_cls: Type['Plugin'], restoring: Future) -> 'Plugin':
+        started = time.perf_counter()
+        obj, elapsed = restoring.result()
+        waited = time.perf_counter() - started
+        cls.restore_timings[target_cls] = (elapsed, waited)
+        logger.info(f'{target_cls.__name__} restored in {elapsed * 1000:.1f}ms, waited {waited * 1000:.1f}ms')
+        return obj
+
     @classmethod
     def load_plugin(cls, target_cls: Type['Plugin']) -> 'Plugin':
-        if cls.has_backup(target_cls):
+        restoring = cls.pending_restores.pop(target_cls, None)
+        if restoring is None and cls.has_backup(target_cls):
+            restoring = Future()
+            restoring.set_result(cls.restore(target_cls))
+        if restoring is not None:
             logger.debug(f'resume {target_cls.__name__} from backup')
-            with open(cls.get_filepath(target_cls), 'rb') as f:
-                obj = pickle.load(f)
-                obj.__init__()
+            if ensure_attr(target_cls, PluginConfig).lazy:
+                # 先用空的实例注册处理器, 状态在首次使用前合并进来
+                obj = target_cls()
+                obj.__dict__['_restoring_'] = restoring
                 return obj
+            obj = cls.wait_restore(target_cls, restoring)
+            obj.__init__()
+            return obj
         else:
             obj = target_cls()
             for anno in obj.__annotations__.keys():
@@ -177,14 +502,84 @@ class BackupMan():
                         attr = attr.create()
                     setattr(obj, anno, attr)
             obj.init_state()
-            return obj
+        if ensure_attr(target_cls, PluginConfig).journal:
+            cls.restored_journals[target_cls] = cls.replay_journal(obj, 0)
+        cls.attach_sqlite(obj)
+        return obj
+
+    @classmethod
+    def attach_sqlite(cls, obj: 'Plugin'):
+        migrate = ensure_attr(obj.__class__, PluginConfig).storage == 'sqlite'
+        store = None
+        # 改回pickle后, 已经在数据库中的存储仍从数据库读取
+        states = obj.__getstate__() if migrate else obj.__dict__.copy()
+        for name, storage in states.items():
+            if not migrate and not isinstance(storage, SqliteStorage): continue
+            if store is None:
+                store = SqliteStore(cls.get_sqlite_path(obj.__class__))
+            if isinstance(storage, SqliteStorage):
+                storage.attach(store, name)
+                continue
+            # 第一次启用时把快照中的数据导入数据库
+            for storage_t, sqlite_t in ((GroupLocalStorage, SqliteGroupLocalStorage), (UserSpec, SqliteUserSpec), (GroupSpec, SqliteGroupSpec)):
+                if isinstance(storage, storage_t):
+                    setattr(obj, name, sqlite_t.migrate(storage, store, name))
+                    logger.debug(f'{obj.__class__.__name__}.{name} stored in sqlite')
+                    break
+
+    @classmethod
+    def replay_journal(cls, obj: 'Plugin', seq: int) -> Tuple[int, int, int]:
+        journal_path = cls.get_journal_path(obj.__class__)
+        if not os.path.exists(journal_path):
+            return seq, 0, 0
+        with open(journal_path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        records = 0
+        while offset + 4 <= len(data):
+            size, = struct.unpack_from('<I', data, offset)
+            end = offset + 4 + size
+            if end > len(data):
+                break
+            try:
+                record_seq, ops = pickle.loads(data[offset + 4:end])
+            except Exception:
+                break
+            offset = end
+            records += 1
+            if record_seq <= seq: continue # 已包含在快照中
+            for op in ops:
+                cls.apply_journal_op(obj, op)
+            seq = record_seq
+        if offset < len(data):
+            logger.warning(f'{obj.__class__.__name__} journal has a torn tail, truncated at {offset}/{len(data)}')
+            with open(journal_path, 'r+b') as f:
+                f.truncate(offset)
+        logger.debug(f'{obj.__class__.__name__} journal replayed, {records} records, seq={seq}')
+        return seq, records, offset
+
+    @staticmethod
+    def apply_journal_op(obj: 'Plugin', op: tuple):
+        kind, name, *rest = op
+        if kind == 'entry':
+            key, present, value = rest
+            getattr(obj, name).apply_journal_entry(key, present, value)
+        elif kind == 'storage' or kind == 'state':
+            setattr(obj, name, rest[0])
+        elif kind == 'pickled':
+            setattr(obj, name, pickle.loads(rest[0]))
 
 def delegate(*attr):
+    # 标志位在装饰时算好, 调用时不再查attr
+    force_backup = InstrAttr.FORECE_BACKUP in attr
+    background = InstrAttr.BACKGROUND in attr
     def deco(fn: Callable):
-        @wraps(fn)
-        async def wrapper(self: 'Plugin', *args, **kwargs):
+        is_bound = hasattr(fn, '__self__')
+        func = to_unbind(fn)
+
+        async def slow_path(self: 'Plugin', args, kwargs):
             async def ctx_wrapper(ctx: 'Context'):
-                if not hasattr(fn, '__self__'):
+                if not is_bound:
                     bound_method = MethodType(fn, self)
                 else:
                     bound_method = fn
@@ -195,10 +590,10 @@ def delegate(*attr):
                     try:
                         return await bound_method(*resolved, **kwargs)
                     finally:
-                        if InstrAttr.FORECE_BACKUP in attr:
+                        if force_backup:
                             self.backup_man.set_dirty()
                 
-                if InstrAttr.BACKGROUND in attr:
+                if background:
                     logger.debug('task created')
                     copied = ctx.copy_overrides_stack()
                     async def wrap_with():
@@ -215,6 +610,27 @@ def delegate(*attr):
             else:
                 return await ctx_wrapper(ctx)
 
+        @wraps(fn)
+        async def wrapper(self: 'Plugin', *args, **kwargs):
+            engine = self.engine
+            if engine.restoring:
+                await engine.wait_materialized(self)
+            ctx = engine._context.get(None)
+            if ctx is None or background or is_bound:
+                return await slow_path(self, args, kwargs)
+            # 快速路径: 直接取已编译的解析计划, 不再每次创建绑定方法和闭包
+            plans = engine.resolution_plans.get(self)
+            plan = plans.get((func, type(ctx))) if plans is not None else None
+            if plan is None:
+                plan = engine.plan_of(ctx, MethodType(fn, self), self)
+            resolved = await ctx.run_plan(plan, list(args), self, None)
+            if not force_backup:
+                return await fn(self, *resolved, **kwargs)
+            try:
+                return await fn(self, *resolved, **kwargs)
+            finally:
+                self.backup_man.set_dirty()
+
         to_unbind(fn)._delegated_ = True
         return wrapper
     return deco
@@ -236,9 +652,13 @@ class Plugin(object, metaclass=MetaPlugin):
 
     def disable(self):
         self.disabled = True
+        if hasattr(self, 'engine'):
+            self.engine.handlers.refresh()
 
     def enable(self):
         self.disabled = False
+        if hasattr(self, 'engine'):
+            self.engine.handlers.refresh()
 
     def override(self, *args, to: Optional[Target] = None):
         return Overrides(
@@ -271,6 +691,9 @@ class Plugin(object, metaclass=MetaPlugin):
 
     
     def __setattr__(self, name, value):
+        if hasattr(self, 'engine') and (isinstance(value, ResolverMixer) or isinstance(self.__dict__.get(name), ResolverMixer)):
+            # 计划中引用了旧存储的解析器
+            self.engine.invalidate_plans(self)
         if name in self.__annotations__: 
             config = ensure_attr(self.__class__, PluginConfig)
             if config.backup_enabled and hasattr(self, 'backup_man'):
@@ -286,8 +709,34 @@ class Plugin(object, metaclass=MetaPlugin):
         config = ensure_attr(self.__class__, PluginConfig)
         return config
 
+    def is_restoring(self):
+        return '_restoring_' in self.__dict__
+
+    # 在事件循环上等待延迟恢复的状态就绪, 不阻塞其他协程
+    async def wait_materialized(self):
+        restoring = self.__dict__.get('_restoring_')
+        if restoring is None: return
+        await asyncio.wrap_future(restoring)
+        self.materialize()
+
+    # 合并延迟恢复的状态; 异步路径上应先await wait_materialized, 这里只在同步调用时才会阻塞等待
+    def materialize(self):
+        restoring = self.__dict__.pop('_restoring_', None)
+        if restoring is None: return
+        restored = BackupMan.wait_restore(self.__class__, restoring)
+        # 与直接恢复时一致: __init__中设置的属性优先
+        for k, v in restored.__dict__.items():
+            self.__dict__.setdefault(k, v)
+        if hasattr(self, 'engine'):
+            self.engine.invalidate_plans(self)
+            self.engine.restoring.discard(self)
+        if hasattr(self, 'backup_man'):
+            self.backup_man.restored()
+
     def __getstate__(self):
-        annos = self.__annotations__
+        self.materialize()
+        # 插件类自己没有注解时, self.__annotations__会取到Plugin的bot/engine等
+        annos = self.__class__.__dict__.get('__annotations__', {})
         states = {k: getattr(self, k) for k in annos if try_get_injector(annos[k]) is None and get_origin(annos[k]) is not Final and annos[k] is not Final}
         states.update({k: getattr(self, k) for k, v in self.__class__.__dict__.items() if isinstance(v, State) and k not in states})
         # print('get state', self.__class__.__name__, v)
@@ -307,43 +756,327 @@ def flatten(S):
 class PlaceholderEvent(Event):
     ...
 
+# IGNORECASE下ASCII字母额外等价的非ASCII字符
+CASE_FOLD_EXTRA: Final[Dict[str, str]] = {'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'}
+
+def fold_char(ch: str) -> Optional[str]:
+    if ch in CASE_FOLD_EXTRA:
+        return CASE_FOLD_EXTRA[ch]
+    if ch.isascii():
+        return ch.lower()
+    if ch.lower() == ch and ch.upper() == ch:
+        return ch
+    return None # 无法安全地做大小写无关比较
+
+def literal_prefixes(items) -> List[str]:
+    prefix = ''
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            ch = fold_char(chr(av))
+            if ch is None:
+                break
+            prefix += ch
+            continue
+        if op is sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            if add_flags or del_flags:
+                break
+            return [prefix + e for e in literal_prefixes(sub)]
+        if op is sre_parse.BRANCH:
+            _, branches = av
+            return [prefix + e for branch in branches for e in literal_prefixes(branch)]
+        if op is sre_parse.IN and all(o is sre_parse.LITERAL for o, _ in av):
+            chs = [fold_char(chr(v)) for _, v in av]
+            if None in chs:
+                break
+            return [prefix + ch for ch in chs]
+        break
+    return [prefix]
+
+class RouteTrieNode():
+    children: Dict[str, 'RouteTrieNode']
+    routes: List[int]
+
+    def __init__(self) -> None:
+        self.children = {}
+        self.routes = []
+
+@dataclass
+class Route():
+    plugin: 'Plugin'
+    method: MethodType
+    pattern: re.Pattern
+    prefixes: List[str]
+
+# 指令正则按字面量前缀建立前缀树, 匹配时只需测试前缀命中的候选和无法提取前缀的正则
+class CommandRouter():
+    routes: List[Route]
+    root: RouteTrieNode
+    regex_only: List[int]
+
+    def __init__(self, instr_attr_name: str, handlers: List[Tuple['Plugin', MethodType]]) -> None:
+        self.routes = []
+        self.root = RouteTrieNode()
+        self.regex_only = []
+        for plugin, method in handlers:
+            pattern = re.compile(getattr(method, instr_attr_name), re.IGNORECASE)
+            try:
+                prefixes = literal_prefixes(sre_parse.parse(pattern.pattern, pattern.flags))
+            except Exception:
+                prefixes = ['']
+            idx = len(self.routes)
+            self.routes.append(Route(plugin, method, pattern, prefixes))
+            if '' in prefixes:
+                self.regex_only.append(idx)
+                continue
+            for prefix in set(prefixes):
+                node = self.root
+                for ch in prefix:
+                    node = node.children.setdefault(ch, RouteTrieNode())
+                node.routes.append(idx)
+
+    def candidates(self, instr_name: str) -> List[int]:
+        res = set(self.regex_only)
+        node = self.root
+        for ch in instr_name:
+            node = node.children.get(fold_char(ch) or ch)
+            if node is None:
+                break
+            res.update(node.routes)
+        return sorted(res)
+
+    def resolve(self, instr_name: str) -> List[Tuple[Route, re.Match]]:
+        res = []
+        for idx in self.candidates(instr_name):
+            route = self.routes[idx]
+            match_result = route.pattern.fullmatch(instr_name)
+            if match_result:
+                res.append((route, match_result))
+        return res
+
+    def overlaps(self) -> List[Tuple[str, List[Route]]]:
+        res = []
+        reported = set()
+        for route in self.routes:
+            for probe in route.prefixes:
+                if probe == '':
+                    continue
+                matched = [r for r, _ in self.resolve(probe)]
+                key = tuple(id(r) for r in matched)
+                if len(matched) > 1 and key not in reported:
+                    reported.add(key)
+                    res.append((probe, matched))
+        return res
+
+# 按After约束排序(被依赖的排在前面), 没有约束的保持原来的顺序; 顺序执行与并发模式都以此为准
+def order_by_after(handlers: List[Tuple['Plugin', MethodType]]) -> List[Tuple['Plugin', MethodType]]:
+    names = {f'{p.__class__.__name__}.{m.__name__}': i for i, (p, m) in enumerate(handlers)}
+    res = []
+    state: Dict[int, int] = {} # 1: 访问中, 2: 已完成
+    def visit(i):
+        state[i] = 1
+        for attr in handlers[i][1]._instr_attrs_:
+            if not isinstance(attr, After): continue
+            j = names.get(attr.target)
+            # 成环的约束忽略, 由HandlerSchedule报告
+            if j is not None and state.get(j) is None:
+                visit(j)
+        state[i] = 2
+        res.append(handlers[i])
+    for i in range(len(handlers)):
+        if i not in state:
+            visit(i)
+    return res
+
+# 并发模式下的执行顺序: 独占的处理器把列表切成若干段, 段内只按After约束等待
+class HandlerSchedule():
+    segments: List[List[int]]
+    deps: Dict[int, List[int]]
+
+    def __init__(self, handlers: List[Tuple['Plugin', MethodType]]) -> None:
+        self.segments = []
+        self.deps = {}
+        names = {f'{p.__class__.__name__}.{m.__name__}': i for i, (p, m) in enumerate(handlers)}
+        curr = []
+        for i, (_, method) in enumerate(handlers):
+            if InstrAttr.EXCLUSIVE in method._instr_attrs_:
+                if len(curr) > 0:
+                    self.segments.append(curr)
+                    curr = []
+                self.segments.append([i])
+            else:
+                curr.append(i)
+        if len(curr) > 0:
+            self.segments.append(curr)
+        segment_of = {i: k for k, segment in enumerate(self.segments) for i in segment}
+
+        for i, (plugin, method) in enumerate(handlers):
+            for attr in method._instr_attrs_:
+                if not isinstance(attr, After): continue
+                j = names.get(attr.target)
+                if j is None or j == i:
+                    continue
+                if segment_of[j] == segment_of[i]:
+                    self.deps.setdefault(i, []).append(j)
+                elif segment_of[j] > segment_of[i]:
+                    logger.warning(f'{plugin.__class__.__name__}.{method.__name__}无法在{attr.target}之后执行, 中间隔着独占的处理器')
+        self.break_cycles(handlers)
+
+    def break_cycles(self, handlers: List[Tuple['Plugin', MethodType]]):
+        state: Dict[int, int] = {} # 1: 访问中, 2: 已完成
+        def visit(i):
+            state[i] = 1
+            for j in list(self.deps.get(i, [])):
+                if state.get(j) == 1:
+                    plugin, method = handlers[i]
+                    logger.warning(f'{plugin.__class__.__name__}.{method.__name__}的After约束成环, 已忽略')
+                    self.deps[i].remove(j)
+                elif state.get(j) is None:
+                    visit(j)
+            state[i] = 2
+        for i in range(len(handlers)):
+            if i not in state:
+                visit(i)
+
+# 加载时按处理器类型建立的索引, 分发时只需查表
+class HandlerRegistry():
+    CONCURRENT_KINDS: Final = ('_any_instr_', '_fall_instr_')
+    KINDS: Final = (
+        '_instr_name_',
+        '_top_instr_name_',
+        '_any_instr_',
+        '_fall_instr_',
+        '_nudge_instr_',
+        '_join_req_instr_',
+        '_joined_instr_',
+        '_member_card_changed_instr_',
+        '_recall_instr_',
+        '_unmute_instr_',
+        '_event_handler_',
+    )
+
+    plugin_handlers: Dict[Plugin, Dict[str, List[MethodType]]]
+    active_handlers: Dict[str, List[Tuple[Plugin, MethodType]]]
+    top_router: CommandRouter
+    plugin_routers: Dict[Plugin, CommandRouter]
+    schedules: Dict[str, HandlerSchedule]
+
+    def __init__(self) -> None:
+        self.plugin_handlers = {}
+        self.active_handlers = {kind: [] for kind in self.KINDS}
+        self.schedules = {kind: HandlerSchedule([]) for kind in self.CONCURRENT_KINDS}
+        self.top_router = CommandRouter('_top_instr_name_', [])
+        self.plugin_routers = {}
+
+    def register(self, plugin: Plugin):
+        handlers: Dict[str, List[MethodType]] = {kind: [] for kind in self.KINDS}
+        for _, method in inspect.getmembers(plugin, predicate=inspect.ismethod):
+            for kind in self.KINDS:
+                if hasattr(method, kind):
+                    handlers[kind].append(method)
+        self.plugin_handlers[plugin] = handlers
+        self.refresh()
+
+    def refresh(self):
+        self.active_handlers = {
+            kind: order_by_after([(p, m) for p, handlers in self.plugin_handlers.items() if not p.disabled for m in handlers[kind]])
+            for kind in self.KINDS
+        }
+        self.schedules = {kind: HandlerSchedule(self.active_handlers[kind]) for kind in self.CONCURRENT_KINDS}
+        self.top_router = CommandRouter('_top_instr_name_', self.active_handlers['_top_instr_name_'])
+        self.plugin_routers = {p: CommandRouter('_instr_name_', self.of('_instr_name_', [p])) for p in self.plugin_handlers}
+
+    def report_overlaps(self):
+        routers = [('top', self.top_router), *((p.__class__.__name__, r) for p, r in self.plugin_routers.items())]
+        for scope, router in routers:
+            for probe, routes in router.overlaps():
+                names = ', '.join(f'{r.plugin.__class__.__name__}.{r.method.__name__}' for r in routes)
+                logger.warning(f'[{scope}] 指令"{probe}"同时匹配了: {names}')
+
+    def of(self, kind: str, plugins: Optional[Iterable[Plugin]] = None) -> List[Tuple[Plugin, MethodType]]:
+        if plugins is None:
+            return self.active_handlers[kind]
+        return order_by_after([(p, m) for p in plugins if not p.disabled for m in self.plugin_handlers.get(p, {}).get(kind, [])])
+
 class Engine():
     plugins: Dict[str, Plugin]
     dirty_plugins: Set[Plugin]
+    handlers: HandlerRegistry
+    resolution_plans: Dict[Plugin, Dict[Tuple[Callable, type], 'ResolutionPlan']]
+    memo_hits: int
+    memo_misses: int
+    concurrent_handlers: bool
+    backup_interval: float
+    backup_max_staleness: float
     _context: contextvars.ContextVar
     bot: Mirai
 
     def __init__(self, bot: Mirai) -> None:
         self.plugins = {}
         self.dirty_plugins = set()
+        self.handlers = HandlerRegistry()
+        self.resolution_plans = {}
+        self.concurrent_handlers = False
+        self.backup_interval = 10
+        self.backup_max_staleness = 60
+        # 正在处理的事件数(不含自动运行的任务), 归零时置位idle
+        self.active_contexts = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.restoring: Set[Plugin] = set()
+        # 插件通过Inject注入的其他插件, 用于只等待处理器用得到的延迟恢复
+        self.dependencies: Dict[Plugin, List[Plugin]] = {}
+        self.profile_imports = False
+        self.metrics = Metrics()
+        self.import_report: Dict[str, Tuple[float, int]] = {}
+        self.memo_hits = 0
+        self.memo_misses = 0
         self._context = contextvars.ContextVar[Context]('Context')
         self.bot = bot
+        # 由app设置; 直接使用Mirai或假bot时为None
+        self.bot_cache: Optional[BotCache] = None
 
     def load(self):
+        started = time.perf_counter()
         mods: List[ModuleType] = []
+        if self.profile_imports:
+            tracemalloc.start()
         for file in glob.glob(PLUGIN_PATH):
             mod_name = file.replace('\\', '/').replace('./', '.').replace('/', '.')[:-3]
             mod_name = mod_name[1:]
             spec = importlib.util.spec_from_file_location(mod_name, file)
             mod = importlib.util.module_from_spec(spec)
             sys.modules[mod_name] = mod
+            import_started = time.perf_counter()
+            mem_before = tracemalloc.get_traced_memory()[0]
             spec.loader.exec_module(mod)
+            self.import_report[mod_name] = (time.perf_counter() - import_started, tracemalloc.get_traced_memory()[0] - mem_before)
             mods.append(mod)
+        if self.profile_imports:
+            tracemalloc.stop()
+        self.report_imports()
         
         for mod in mods:
             for _, member in inspect.getmembers(mod, lambda m: inspect.isclass(m) and m.__module__ == mod.__name__):
                 if issubclass(member, Plugin):
                     globals()[member.__name__] = member
 
-        for mod in mods:
-            for _, member in inspect.getmembers(mod, lambda m: inspect.isclass(m) and m.__module__ == mod.__name__):
-                if issubclass(member, Plugin):
-                    self._load_plugin_cls(member)
+        plugin_classes = [
+            member for mod in mods
+            for _, member in inspect.getmembers(mod, lambda m: inspect.isclass(m) and m.__module__ == mod.__name__)
+            if issubclass(member, Plugin)
+        ]
+        BackupMan.start_restores(plugin_classes)
+        for member in plugin_classes:
+            self._load_plugin_cls(member)
 
         for plugin in self.plugins.values():
             if isinstance(plugin, AllLoadedNotifier):
                 plugin.all_loaded()
 
+        self.handlers.report_overlaps()
+        logger.info(f'{len(self.plugins)} plugins loaded in {(time.perf_counter() - started) * 1000:.1f}ms, {len(self.restoring)} restoring lazily')
+
     def append_dirty_plugin(self, p: Plugin):
         self.dirty_plugins.add(p)
         ...
@@ -354,21 +1087,81 @@ class Engine():
         self.dirty_plugins.clear()
         ...
 
+    def report_imports(self):
+        # 包含插件模块首次导入的依赖, 内存只在profile_imports时统计
+        for mod_name, (elapsed, mem) in sorted(self.import_report.items(), key=lambda it: -it[1][0]):
+            logger.info(f'import {mod_name}: {elapsed * 1000:.1f}ms' + (f', {mem / 1024 / 1024:+.1f}MiB' if self.profile_imports else ''))
+        logger.info(f'{len(self.import_report)} plugin modules imported in {sum(elapsed for elapsed, _ in self.import_report.values()) * 1000:.1f}ms')
+
+    # 连接之后在后台线程中完成延迟导入, 首次使用时就不用再等
+    async def warm_up(self):
+        started = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, warm_up_lazy)
+        for name, elapsed in sorted(lazy_timings.items(), key=lambda it: -it[1]):
+            logger.debug(f'lazy import {name}: {elapsed * 1000:.1f}ms')
+        logger.info(f'{len(lazy_timings)} lazy imports warmed up in {(time.perf_counter() - started) * 1000:.1f}ms')
+
+    # 等待所有延迟恢复的插件就绪, 只用于启动等不在热路径上的地方
+    async def wait_restored(self):
+        for p in list(self.restoring):
+            await p.wait_materialized()
+
+    # 等待plugin及其(递归)注入的插件就绪, 与之无关的插件继续在后台恢复
+    async def wait_materialized(self, plugin: Plugin):
+        seen = set()
+        stack = [plugin]
+        while len(stack) > 0 and len(self.restoring) > 0:
+            p = stack.pop()
+            if p in seen: continue
+            seen.add(p)
+            if p.is_restoring():
+                await p.wait_materialized()
+            stack.extend(self.dependencies.get(p, ()))
+
+    # 批量获取群成员, 不在群中的成员不出现在结果中; 没有成员缓存时逐个向bot获取
+    async def get_group_members(self, group: Union[Group, int], member_ids: Iterable[int]) -> Dict[int, GroupMember]:
+        group_id = getattr(group, 'id', group)
+        if self.bot_cache is not None:
+            return await self.bot_cache.get_group_members(group_id, member_ids)
+        member_ids = list(dict.fromkeys(member_ids))
+        fetched = await asyncio.gather(*(self.bot.get_group_member(group_id, member_id) for member_id in member_ids), return_exceptions=True)
+        return {member_id: member for member_id, member in zip(member_ids, fetched) if isinstance(member, GroupMember)}
+
+    # 群成员镜像; 没有成员缓存时每次重新拉取成员列表, 不做维护
+    async def roster_of(self, group: Union[Group, int]) -> GroupRoster:
+        group_id = getattr(group, 'id', group)
+        if self.bot_cache is not None:
+            return await self.bot_cache.roster.of(group_id)
+        resp = await self.bot.member_list(group_id)
+        return GroupRoster(group_id, resp.data)
+
+    async def flush_backups(self):
+        # 还没退出的上下文(自动运行的任务, 退出时仍在处理的事件)中标脏的插件也要写入
+        self.clear_dirty_plugins()
+        await asyncio.gather(*[p.backup_man.flush() for p in self.plugins.values()])
+
+    def backup_stats(self) -> Dict[str, 'BackupStats']:
+        return {name: p.backup_man.stats for name, p in self.plugins.items()}
+
     def _load_plugin_cls(self, member: Type['Plugin']):
         may_already_exist = next((x for x in list(self.plugins.values()) if x.__class__ is member), None)
         if may_already_exist is not None:
             return may_already_exist
         logger.info(f'loading {member.__name__}...')
         p = BackupMan.load_plugin(member)
+        if p.is_restoring():
+            self.restoring.add(p)
         p.init(self.bot, self)
         config = ensure_attr(member, PluginConfig)
         self.plugins[config.name] = p
+        self.handlers.register(p)
 
         for name, anno in member.__annotations__.items():
             injected = self.try_load_injector(anno)
             if injected is None: continue
             logger.debug(f'inject {injected.__class__.__name__} -> {member.__name__}')
             setattr(p, name, injected)
+            self.dependencies.setdefault(p, []).append(injected)
             if isinstance(injected, InjectNotifier):
                 injected.injected(p)
         return p
@@ -382,8 +1175,26 @@ class Engine():
 
     def get_context(self) -> 'Context':
         return self._context.get(None)
+
+    # 供Outbox使用: 处理消息时的发送算作回复, 优先于其他发送
+    def send_priority(self) -> Priority:
+        ctx = self._context.get(None)
+        if ctx is not None and isinstance(ctx.event, MessageEvent):
+            return Priority.REPLY
+        return Priority.NORMAL
+
+    def plan_of(self, ctx: 'Context', method: Callable, plugin: Plugin) -> 'ResolutionPlan':
+        plans = self.resolution_plans.setdefault(plugin, {})
+        key = (getattr(method, '__func__', method), type(ctx))
+        plan = plans.get(key)
+        if plan is None:
+            plan = plans[key] = ctx.compile_plan(method, plugin)
+        return plan
+
+    def invalidate_plans(self, plugin: Plugin):
+        self.resolution_plans.pop(plugin, None)
     
-    def of(self, event: Optional[Event]=None):
+    def of(self, event: Optional[Event]=None, *, received: Optional[float]=None):
         outer = self
         if event is None:
             event = PlaceholderEvent(type='PlaceholderEvent')
@@ -409,18 +1220,59 @@ class Engine():
                 else:
                     raise RuntimeError('not impl')
                 ctx = context_factory(outer, event)
+                ctx.received = received
                 token = outer._context.set(ctx)
                 ctx.token = token
+                ctx.touches_token = journal_touches.set(ctx.touched)
+                # 自动运行的任务一直持有OutOfContext, 不计入
+                ctx.counted = not isinstance(event, PlaceholderEvent)
+                if ctx.counted:
+                    outer.active_contexts += 1
+                    outer.idle.clear()
                 return ctx
 
             def __exit__(self, type, value, trace):
                 ctx: Context = outer._context.get()
+                journal_touches.reset(ctx.touches_token)
+                if ctx.counted:
+                    outer.active_contexts -= 1
+                    if outer.active_contexts == 0:
+                        outer.idle.set()
                 outer._context.reset(ctx.token)
+                if ctx.received is not None:
+                    outer.metrics.event_done(ctx.event.type, ctx.received, ctx.last_sent)
         return CW()
     
 class ResolveFailedException(Exception):
     ...
 
+# 形参的解析方式在首次调用时确定, 之后按计划直接取值
+@dataclass
+class ResolverStep():
+    resolver: Optional[Callable]
+    bind_ctx: bool
+    is_coro: bool
+    memo_key: Optional[tuple] = None
+    plan: Optional['ResolutionPlan'] = None
+
+@dataclass
+class ParamPlan():
+    event_anno: Optional[type]
+    from_context: bool
+    injected: Optional[Plugin]
+    first: Optional[ResolverStep]
+    fallback_anno: Any
+    second: Optional[ResolverStep]
+    will_skip: bool
+    default: Any
+    patharg: Optional[Tuple[type, Any]]
+    var_positional: bool
+
+@dataclass
+class ResolutionPlan():
+    params: List[ParamPlan]
+    allowed_events: Optional[Tuple]
+
 class Context(ResolverMixer):
     token: contextvars.Token['Context']
 
@@ -430,13 +1282,25 @@ class Context(ResolverMixer):
         self.token = None
         self.event = event
         self.overrides_stack_save = contextvars.ContextVar[list[Overrides]]('overrides_stack_save')
-        self.redirected: 'Redirected' = None
+        self.redirected_save = contextvars.ContextVar['Redirected']('redirected_save')
+        self.redirected = None
         self.debug = False
+        # 本次事件中访问过的存储条目, 见journal_touches
+        self.touched: Dict[int, Tuple[Any, Set[Hashable]]] = {}
+        # 本次事件内已解析的值, 键为(解析器, 覆盖栈状态)
+        self.memo: Dict[tuple, Any] = {}
+        self.memo_hits = 0
+        self.memo_misses = 0
+        # app.py收到事件的时间与最后一次发送的时间, 用于统计端到端延迟
+        self.received: Optional[float] = None
+        self.last_sent: Optional[float] = None
 
     def __enter__(self):
         ...
 
     def __exit__(self, type, value, trace):
+        # 期间可能已经写过日志, 访问过的条目重新标脏, 保证记下的是处理后的值
+        remark_touched(self.touched)
         self.engine.clear_dirty_plugins()
         if type is not None and isinstance(self, OutOfContext):
             logger.warning('exception catched by context')
@@ -448,36 +1312,73 @@ class Context(ResolverMixer):
     def get_instr_attr_name(self):
         ...
 
-    async def instrs(self, instr_attr_name, cb: Callable[[MethodType], Awaitable], *, raise_error = False, plugins: list[Plugin] = None):
-        if plugins is None:
-            plugins = self.engine.plugins.values()
+    async def instrs(self, instr_attr_name, cb: Callable[[MethodType], Awaitable], *, raise_error = False, plugins: list[Plugin] = None, handlers: List[Tuple[Plugin, MethodType]] = None):
+        concurrent = self.engine.concurrent_handlers and handlers is None and plugins is None and instr_attr_name in HandlerRegistry.CONCURRENT_KINDS
+        if handlers is None:
+            handlers = self.engine.handlers.of(instr_attr_name, plugins)
         with self:
-            for plugin in plugins:
-                if plugin.disabled: continue
-                
-                for _, method in inspect.getmembers(plugin, predicate=inspect.ismethod):
-                    if hasattr(method, instr_attr_name):
-                        # print(f'found {method=}')
-                        if InstrAttr.FORECE_BACKUP in method._instr_attrs_:
-                            plugin.backup_man.set_dirty()
-                        res = None
-                        try:
-                            async with plugin.override() as redirected:
-                                self.set_redirected(None)
-                                try:
-                                    res = await cb(method) # 需要抛一个异常让with吃到
-                                except Exception as e:
-                                    if not isinstance(e, ExecFailedError) and InstrAttr.INTERCEPT_EXCEPTIONS not in method._instr_attrs_:
-                                        raise
-                                    else:
-                                        if self.debug:
-                                            traceback.print_exc()
-                        except: ...
-                        if res is not None:
-                            if self.redirected is None:
-                                redirected(res, attrs=method._instr_attrs_)
-                        if self.redirected is not None:
-                            await self.send()
+            if concurrent:
+                await self.run_concurrently(handlers, self.engine.handlers.schedules[instr_attr_name], cb)
+                return
+            for plugin, method in handlers:
+                # print(f'found {method=}')
+                if await self.run_handler(plugin, method, cb) is not None:
+                    await self.send()
+
+    async def run_handler(self, plugin: Plugin, method: MethodType, cb: Callable[[MethodType], Awaitable]) -> Optional['Redirected']:
+        if InstrAttr.FORECE_BACKUP in method._instr_attrs_:
+            plugin.backup_man.set_dirty()
+        res = None
+        metrics = self.engine.metrics.of(plugin.__class__.__name__, method.__name__)
+        try:
+            async with plugin.override() as override:
+                self.set_redirected(None)
+                started = time.perf_counter()
+                try:
+                    res = await cb(method) # 需要抛一个异常让with吃到
+                except Exception as e:
+                    if not isinstance(e, ExecFailedError) and InstrAttr.INTERCEPT_EXCEPTIONS not in method._instr_attrs_:
+                        metrics.errors += 1
+                        raise
+                    else:
+                        self.engine.metrics.swallowed(e, plugin.__class__.__name__, method.__name__)
+                        if self.debug:
+                            traceback.print_exc()
+                finally:
+                    metrics.record(time.perf_counter() - started)
+        except: ...
+        if res is not None:
+            if self.redirected is None:
+                redirected = await override.get_redirected()
+                if redirected is not None:
+                    redirected(res, attrs=method._instr_attrs_)
+        return self.redirected
+
+    async def run_concurrently(self, handlers: List[Tuple[Plugin, MethodType]], schedule: HandlerSchedule, cb: Callable[[MethodType], Awaitable]):
+        async def run(i: int, done: Dict[int, asyncio.Event]):
+            try:
+                for j in schedule.deps.get(i, []):
+                    await done[j].wait()
+                # 每个任务各自持有覆盖栈和回复
+                self.set_overrides_stack(self.copy_overrides_stack())
+                plugin, method = handlers[i]
+                return await self.run_handler(plugin, method, cb)
+            finally:
+                done[i].set()
+
+        for segment in schedule.segments:
+            done = {i: asyncio.Event() for i in segment}
+            tasks = [asyncio.create_task(run(i, done)) for i in segment]
+            try:
+                # 按注册顺序发送回复
+                for task in tasks:
+                    redirected = await task
+                    if redirected is not None:
+                        await self.send(redirected)
+            except:
+                for task in tasks:
+                    task.cancel()
+                raise
 
 
     async def exec(self):
@@ -485,13 +1386,15 @@ class Context(ResolverMixer):
             return await method(*(await self.resolve_args(method, [])))
         await self.instrs(self.get_instr_attr_name(), cb)
 
-    async def send(self):
+    async def send(self, redirected: Optional['Redirected'] = None):
         res = []
+        if redirected is None:
+            redirected = self.redirected
 
-        if self.redirected.mc is None:
+        if redirected.mc is None:
             return
 
-        attrs = self.redirected.attrs
+        attrs = redirected.attrs
         if attrs is None:
             attrs = []
         
@@ -500,15 +1403,15 @@ class Context(ResolverMixer):
             res.append('\n')
 
         if InstrAttr.NO_ALERT_CALLER not in [e for e in attrs]:
-            if self.redirected.to is None:
-                if self.redirected.source_op.get_target() == Target.GROUP:
-                    append_at(self.redirected.source_op.get_member_id())
+            if redirected.to is None:
+                if redirected.source_op.get_target() == Target.GROUP:
+                    append_at(redirected.source_op.get_member_id())
             else:
-                if self.redirected.to == Target.GROUP:
-                    append_at(self.redirected.source_op.get_member_id())
+                if redirected.to == Target.GROUP:
+                    append_at(redirected.source_op.get_member_id())
 
-        res.extend(self.redirected.mc)
-        await self.redirected.source_op.send(res, to=self.redirected.to)
+        res.extend(redirected.mc)
+        await redirected.source_op.send(res, to=redirected.to)
 
     def get_overrides_stack(self):
         s = self.overrides_stack_save.get(None)
@@ -527,7 +1430,19 @@ class Context(ResolverMixer):
         self.get_overrides_stack().append(o)
     
     def remove_overrides(self, o: Overrides):
-        self.get_overrides_stack().remove(o)
+        s = self.get_overrides_stack()
+        if len(s) > 0 and s[-1] is o:
+            s.pop()
+        else:
+            s.remove(o)
+
+    @property
+    def redirected(self) -> 'Redirected':
+        return self.redirected_save.get(None)
+
+    @redirected.setter
+    def redirected(self, redirected: 'Redirected'):
+        self.redirected_save.set(redirected)
 
     def set_redirected(self, redirected: 'Redirected'):
         self.redirected = redirected
@@ -549,111 +1464,128 @@ class Context(ResolverMixer):
         ...
 
     def resolver_mixin(self) -> Dict[type, Callable[..., Any]]:
-        async def resolve_user(event: Event):
-            if isinstance(event, (GroupMessage, FriendMessage, StrangerMessage, TempMessage)):
-                return User(event.sender.id)
-            elif isinstance(event, NudgeEvent):
-                return User(event.from_id)
-            elif isinstance(event, GroupRecallEvent):
-                return User(event.author_id)
-            elif isinstance(self.event, MemberJoinRequestEvent):
-                return User(self.event.from_id)
-            elif isinstance(event, (MemberJoinEvent, MemberUnmuteEvent, MemberCardChangeEvent)):
-                return User(event.member.id)
-            else:
-                raise ExecFailedError(f'消息类型不匹配 USER, {event=}')
-
-        async def resolve_msg(event: Event):
-            async def msg_from_event():
-                # print('[msg_from_event]')
-                if isinstance(event, MessageEvent):
-                    return Msg(event.message_chain.message_id)
-                
-            override = await self.get_override(Msg, msg_from_event)
-            if override is None:
-                raise ExecFailedError(f'消息类型不匹配 MSG, {event=}')
-            # print(f'{override=}')
-            return override
-        
-        async def resolve_quote(event: MessageEvent):
-            for c in event.message_chain:
-                if isinstance(c, Quote):
-                    return c
-            else:
-                raise ExecFailedError(f'消息类型不匹配 Quote, {event=}')
-        
-        async def resolve_msg_op(msg: Msg, group: Group):
-            return MsgOp(
-                bot=self.engine.bot,
-                msg=msg,
-                group=group
-            )
-
-        async def resolve_group(event: Event):
-            async def group_from_event():
-                if isinstance(event, GroupMessage):
-                    return event.sender.group
-                elif isinstance(event, TempMessage):
-                    return event.group
-                elif isinstance(event, NudgeEvent) and event.subject.kind == 'Group':
-                    return await self.engine.bot.get_group(event.subject.id)
-                elif isinstance(event, MemberJoinRequestEvent):
-                    return await self.engine.bot.get_group(event.group_id)
-                elif isinstance(event, GroupRecallEvent):
-                    return event.group
-                elif isinstance(event, MemberJoinEvent):
-                    return event.member.group
-                elif isinstance(event, MemberUnmuteEvent):
-                    return event.member.group
-                elif isinstance(event, MemberCardChangeEvent):
-                    return event.member.group
-                
-            member_override: GroupMember = await self.get_override(GroupMember)
-            if member_override is not None:
-                return member_override.group
-
-            override = await self.get_override(Group, group_from_event)
-            if override is None:
-                raise ExecFailedError(f'消息类型不匹配 GROUP, {event=}')
-            return override
-        async def resolve_group_member(event: Event):
-            async def group_member_from_event():
-                if isinstance(event, GroupMessage):
-                    return event.sender
-                elif isinstance(event, TempMessage):
-                    return event.sender
-                elif isinstance(event, NudgeEvent) and event.subject.kind == 'Group':
-                    return await self.engine.bot.get_group_member(event.subject.id, event.from_id)
-                elif isinstance(event, GroupRecallEvent):
-                    return await self.engine.bot.get_group_member(event.group.id, event.author_id)
-                elif isinstance(event, MemberJoinEvent):
-                    return event.member
-                elif isinstance(event, MemberUnmuteEvent):
-                    return event.member
-                elif isinstance(event, MemberCardChangeEvent):
-                    return event.member
-            override = await self.get_override(GroupMember, group_member_from_event)
-            if override is None:
-                raise ExecFailedError(f'消息类型不匹配 GROUP MEMBER, {event=}')
-            return override
-        def resolve_group_op(group: Group):
-            return GroupOp(bot=self.engine.bot, group=group)
-        def resolve_group_member_op(member: GroupMember):
-            return GroupMemberOp(bot=self.engine.bot, member=member)
-        def resolve_source_op(event: Event, group: Optional[Group], member: Optional[GroupMember]):
-            return SourceOp(bot=self.engine.bot, event=event, group=group, member=member)
         return {
-            Msg: resolve_msg,
-            MsgOp: resolve_msg_op,
-            User: resolve_user,
-            Group: resolve_group,
-            GroupMember: resolve_group_member,
-            GroupOp: resolve_group_op,
-            GroupMemberOp: resolve_group_member_op,
-            SourceOp: resolve_source_op,
-            Quote: resolve_quote,
+            Msg: self.resolve_msg,
+            MsgOp: self.resolve_msg_op,
+            User: self.resolve_user,
+            Group: self.resolve_group,
+            GroupMember: self.resolve_group_member,
+            GroupOp: self.resolve_group_op,
+            GroupMemberOp: self.resolve_group_member_op,
+            SourceOp: self.resolve_source_op,
+            Quote: self.resolve_quote,
         }
-    
+
+    @memoize
+    async def resolve_user(self, event: Event):
+        if isinstance(event, (GroupMessage, FriendMessage, StrangerMessage, TempMessage)):
+            return User(event.sender.id)
+        elif isinstance(event, NudgeEvent):
+            return User(event.from_id)
+        elif isinstance(event, GroupRecallEvent):
+            return User(event.author_id)
+        elif isinstance(self.event, MemberJoinRequestEvent):
+            return User(self.event.from_id)
+        elif isinstance(event, (MemberJoinEvent, MemberUnmuteEvent, MemberCardChangeEvent)):
+            return User(event.member.id)
+        else:
+            raise ExecFailedError(f'消息类型不匹配 USER, {event=}')
+
+    @memoize
+    async def resolve_msg(self, event: Event):
+        async def msg_from_event():
+            # print('[msg_from_event]')
+            if isinstance(event, MessageEvent):
+                return Msg(event.message_chain.message_id)
+
+        override = await self.get_override(Msg, msg_from_event)
+        if override is None:
+            raise ExecFailedError(f'消息类型不匹配 MSG, {event=}')
+        # print(f'{override=}')
+        return override
+
+    @memoize
+    async def resolve_quote(self, event: MessageEvent):
+        for c in event.message_chain:
+            if isinstance(c, Quote):
+                return c
+        else:
+            raise ExecFailedError(f'消息类型不匹配 Quote, {event=}')
+
+    @memoize
+    async def resolve_msg_op(self, msg: Msg, group: Group):
+        return MsgOp(
+            bot=self.engine.bot,
+            msg=msg,
+            group=group
+        )
+
+    @memoize
+    async def resolve_group(self, event: Event):
+        async def group_from_event():
+            if isinstance(event, GroupMessage):
+                return event.sender.group
+            elif isinstance(event, TempMessage):
+                return event.group
+            elif isinstance(event, NudgeEvent) and event.subject.kind == 'Group':
+                return await self.engine.bot.get_group(event.subject.id)
+            elif isinstance(event, MemberJoinRequestEvent):
+                return await self.engine.bot.get_group(event.group_id)
+            elif isinstance(event, GroupRecallEvent):
+                return event.group
+            elif isinstance(event, MemberJoinEvent):
+                return event.member.group
+            elif isinstance(event, MemberUnmuteEvent):
+                return event.member.group
+            elif isinstance(event, MemberCardChangeEvent):
+                return event.member.group
+
+        member_override: GroupMember = await self.get_override(GroupMember)
+        if member_override is not None:
+            return member_override.group
+
+        override = await self.get_override(Group, group_from_event)
+        if override is None:
+            raise ExecFailedError(f'消息类型不匹配 GROUP, {event=}')
+        return override
+
+    @memoize
+    async def resolve_group_member(self, event: Event):
+        async def group_member_from_event():
+            if isinstance(event, GroupMessage):
+                return event.sender
+            elif isinstance(event, TempMessage):
+                return event.sender
+            elif isinstance(event, NudgeEvent) and event.subject.kind == 'Group':
+                return await self.engine.bot.get_group_member(event.subject.id, event.from_id)
+            elif isinstance(event, GroupRecallEvent):
+                return await self.engine.bot.get_group_member(event.group.id, event.author_id)
+            elif isinstance(event, MemberJoinEvent):
+                return event.member
+            elif isinstance(event, MemberUnmuteEvent):
+                return event.member
+            elif isinstance(event, MemberCardChangeEvent):
+                return event.member
+        override = await self.get_override(GroupMember, group_member_from_event)
+        if override is None:
+            raise ExecFailedError(f'消息类型不匹配 GROUP MEMBER, {event=}')
+        return override
+
+    @memoize
+    def resolve_group_op(self, group: Group):
+        return GroupOp(bot=self.engine.bot, group=group)
+
+    @memoize
+    def resolve_group_member_op(self, member: GroupMember):
+        return GroupMemberOp(bot=self.engine.bot, member=member)
+
+    @memoize
+    def resolve_source_op(self, event: Event, group: Optional[Group], member: Optional[GroupMember]):
+        return SourceOp(bot=self.engine.bot, event=event, group=group, member=member, sent_cb=self.mark_sent)
+
+    def mark_sent(self):
+        self.last_sent = time.perf_counter()
+
     @staticmethod
     def is_type_of(var, cls):
         if type(cls) is str:
@@ -697,134 +1629,180 @@ class Context(ResolverMixer):
         return comp.text
 
 
+    def compile_plan(self, fn: Callable, plugin: Plugin, *, bind_ctx: bool = False) -> 'ResolutionPlan':
+        plugin.materialize()
+        params = [p for p in inspect.signature(fn).parameters.values() if p.kind not in (p.KEYWORD_ONLY, p.VAR_KEYWORD)]
+        if bind_ctx:
+            params = params[1:]
+        # 同时记下解析器的来源, 用于区分不同存储的同类型解析结果
+        resolvers = {anno: (r, plugin) for anno, r in plugin.get_resolvers().items()}
+        resolvers.update({anno: (r, None) for anno, r in self.resolver_mixin().items()})
+        for ff in plugin.__dict__.values():
+            if not isinstance(ff, ResolverMixer): continue
+            resolvers.update({anno: (r, ff) for anno, r in ff.resolver_mixin().items()})
+
+        def resolver_step(anno):
+            if anno not in resolvers: return None
+            resolvers_of_type, owner = resolvers[anno]
+            if not isinstance(resolvers_of_type, Iterable):
+                resolvers_of_type = [resolvers_of_type]
+            for resolver in resolvers_of_type:
+                memo_key = (anno, id(owner)) if getattr(resolver, '_memoize_', False) else None
+                if inspect.ismethod(resolver) and resolver.__self__ is self:
+                    return ResolverStep(resolver.__func__, True, inspect.iscoroutinefunction(resolver), memo_key)
+                return ResolverStep(resolver, False, inspect.iscoroutinefunction(resolver), memo_key)
+            return ResolverStep(None, False, False)
+
+        plan = ResolutionPlan(params=[], allowed_events=None)
+        for p in params:
+            allowed_events = self.get_allowed_events(p)
+            if allowed_events is not None and plan.allowed_events is None:
+                plan.allowed_events = allowed_events
+            injected = self.engine.try_load_injector(p.annotation)
+            if injected is not None and isinstance(injected, InjectNotifier):
+                injected.injected(plugin)
+            fallback_anno = p.annotation
+            will_skip = False
+            if self.is_optional(fallback_anno):
+                will_skip = True
+                fallback_anno = get_args(fallback_anno)[0]
+            if p.default is not inspect._empty:
+                will_skip = True
+            plan.params.append(ParamPlan(
+                event_anno=p.annotation if self.is_type_of(p.annotation, Event) else None,
+                from_context=self.is_type_of(p.annotation, Context),
+                injected=injected,
+                first=resolver_step(p.annotation),
+                fallback_anno=fallback_anno,
+                second=resolver_step(fallback_anno),
+                will_skip=will_skip,
+                default=None if p.default is inspect._empty else p.default,
+                patharg=try_get_patharg_params(fallback_anno, p.name),
+                var_positional=p.kind is inspect._ParameterKind.VAR_POSITIONAL,
+            ))
+        return plan
+
     async def resolve_args(self, method: MethodType, chain: List[Union[MessageComponent, Any]], plugin: Plugin = None, *, match: re.Match[str] = None):
-        s = inspect.signature(method)
         if plugin is None:
             plugin = method.__self__
-        params = [p for p in s.parameters.values() if p.kind not in (p.KEYWORD_ONLY, p.VAR_KEYWORD)]
-        
-        if isinstance(self.event, MessageEvent) and not self.is_target_msg(params, self.event):
+        if self.engine.restoring:
+            await self.engine.wait_materialized(plugin)
+        plan = self.engine.plan_of(self, method, plugin)
+        return await self.run_plan(plan, chain, plugin, match)
+
+    async def run_plan(self, plan: 'ResolutionPlan', chain: List[Union[MessageComponent, Any]], plugin: Plugin, match: Optional[re.Match[str]]):
+        if plan.allowed_events is not None and isinstance(self.event, MessageEvent) and not isinstance(self.event, plan.allowed_events):
             raise ExecFailedError(f'无法在当前上下文中调用')
         args = []
-        resolvers = plugin.get_resolvers()
-        resolvers.update(self.resolver_mixin())
-        for ff in plugin.__dict__.values():
-            if not isinstance(ff, ResolverMixer): continue
-            resolvers.update(ff.resolver_mixin())
-        for p in params:
+        for p in plan.params:
             #下面这些是不消耗实参，直接从上下文中获得的形参
-            if self.is_type_of(p.annotation, Event) and isinstance(self.event, p.annotation):
+            if p.event_anno is not None and isinstance(self.event, p.event_anno):
                 args.append(self.event)
                 continue
-            if self.is_type_of(p.annotation, Context):
+            if p.from_context:
                 args.append(self)
                 continue
-            injected = self.engine.try_load_injector(p.annotation)
-            if injected is not None:
-                if isinstance(injected, InjectNotifier):
-                    injected.injected(plugin)
-                args.append(injected)
+            if p.injected is not None:
+                args.append(p.injected)
                 continue
-            async def append_from_resolver(anno):
-                # print(f'append_from_resolver prep {anno=}, {resolvers=}')
-                if anno in resolvers:
-                    resolvers_of_type = resolvers[anno]
-
-                    if not isinstance(resolvers_of_type, Iterable):
-                        resolvers_of_type = [resolvers_of_type]
-                    
-                    for resolver in resolvers_of_type:
-                        # print(f'append_from_resolver try {anno=}, {resolver=}')
-                        sub_args = await self.resolve_args(resolver, chain, plugin)
-                        # print(f'{sub_args=}')
-                        try:
-                            if inspect.iscoroutinefunction(resolver):
-                                sub_res = await resolver(*sub_args)
-                            else:
-                                sub_res = resolver(*sub_args)
-                            args.append(sub_res)
-                            # print(f'append_from_resolver result {anno=}, {sub_res=}')
-                        except ExecFailedError as e:
-                            # traceback.print_exc()
-                            raise
-                        return True
-                return False
-
-            async def append_single_arg():
-                anno = p.annotation
-                will_skip = False
-                front = None
-                curr_arg = None
-                try:
-                    if await append_from_resolver(anno): return
-                except ExecFailedError as e:
-                    ...
-                if self.is_optional(anno):
-                    will_skip = True
-                    anno = get_args(anno)[0]
-                if  p.default is not inspect._empty:
-                    will_skip = True
-                try:
-                    if await append_from_resolver(anno): return
-                    patharg_params = try_get_patharg_params(anno, p.name)
-                    if patharg_params is not None and match is not None:
-                        xtype, pos = patharg_params
-                        curr_arg = match[pos]
-                        anno = xtype
-                    else:
-                        if len(chain) > 0:
-                            front = chain.pop(0)
-                            curr_arg = front
-                        else:
-                            raise ExecFailedError(f'参数不足, {anno=}')
-                    if curr_arg is None:
-                        raise ExecFailedError(f'无法识别的参数类型')
-                    if type(curr_arg) is anno:
-                        args.append(curr_arg)
-                        return
-                    if anno in (str, int, float, bool):
-                        if type(curr_arg) is not str or isinstance(curr_arg, Plain):
-                            raise ExecFailedError(f'参数类型错误')
-                        args.append(anno(curr_arg.text if isinstance(curr_arg, Plain) else curr_arg))
-                        return
-                    if issubclass(anno, Enum) and isinstance(curr_arg, anno) and type(curr_arg) is not anno:
-                        args.append(curr_arg)
-                        return
-                    if issubclass(anno, Enum):
-                        values = [e.value for e in anno]
-                        if curr_arg not in values:
-                            raise ExecFailedError(f'枚举值无效, 可选: {", ".join(values)}')
-                        args.append(anno(curr_arg))
-                        return
-                    if anno is At and isinstance(curr_arg, (Plain, str)):
-                        try:
-                            m_id = int(self.get_text(curr_arg))
-                        except:
-                            raise ExecFailedError(f'AT的目标id格式错误')
-                        args.append(At(target=m_id))
-                        return
-                    if anno is MessageComponent:
-                        args.append(curr_arg)
-                        return
-            
-                    raise ExecFailedError(f'参数类型错误, 未匹配, {anno=}, {type(curr_arg)=}')
-                # except ExecFailedError as e:
-                #     raise
-                except Exception as e:
-                    if not will_skip: raise
-                    if front is not None:
-                        chain.insert(0, front)
-                    default = p.default
-                    if default is inspect._empty:
-                        default = None
-                    args.append(default)
-            if p.kind is inspect._ParameterKind.VAR_POSITIONAL:
+            if p.var_positional:
                 while len(chain) > 0:
-                    await append_single_arg()
+                    await self.append_planned_arg(p, args, chain, plugin, match)
             else:
-                await append_single_arg()
+                await self.append_planned_arg(p, args, chain, plugin, match)
         return args
 
+    def override_state(self):
+        return tuple(o.serial for o in self.get_overrides_stack() if o.vals)
+
+    async def run_resolver(self, step: 'ResolverStep', chain: List[Union[MessageComponent, Any]], plugin: Plugin):
+        if step.memo_key is None:
+            return await self.call_resolver(step, chain, plugin)
+        key = (step.memo_key, self.override_state())
+        if key in self.memo:
+            self.memo_hits += 1
+            self.engine.memo_hits += 1
+            res = self.memo[key]
+            if isinstance(res, ExecFailedError):
+                raise res
+            return res
+        self.memo_misses += 1
+        self.engine.memo_misses += 1
+        try:
+            res = await self.call_resolver(step, chain, plugin)
+        except ExecFailedError as e:
+            self.memo[key] = e
+            raise
+        self.memo[key] = res
+        return res
+
+    async def call_resolver(self, step: 'ResolverStep', chain: List[Union[MessageComponent, Any]], plugin: Plugin):
+        if step.plan is None:
+            step.plan = self.compile_plan(step.resolver, plugin, bind_ctx=step.bind_ctx)
+        sub_args = await self.run_plan(step.plan, chain, plugin, None)
+        if step.bind_ctx:
+            sub_args.insert(0, self)
+        if step.is_coro:
+            return await step.resolver(*sub_args)
+        return step.resolver(*sub_args)
+
+    async def append_planned_arg(self, p: 'ParamPlan', args: list, chain: List[Union[MessageComponent, Any]], plugin: Plugin, match: Optional[re.Match[str]]):
+        front = None
+        try:
+            if p.first is not None and p.first.resolver is not None:
+                args.append(await self.run_resolver(p.first, chain, plugin))
+                return
+        except ExecFailedError as e:
+            ...
+        try:
+            if p.second is not None and p.second.resolver is not None:
+                args.append(await self.run_resolver(p.second, chain, plugin))
+                return
+            anno = p.fallback_anno
+            if p.patharg is not None and match is not None:
+                xtype, pos = p.patharg
+                curr_arg = match[pos]
+                anno = xtype
+            else:
+                if len(chain) > 0:
+                    front = chain.pop(0)
+                    curr_arg = front
+                else:
+                    raise ExecFailedError(f'参数不足, {anno=}')
+            args.append(self.convert_arg(anno, curr_arg))
+        except Exception as e:
+            if not p.will_skip: raise
+            if front is not None:
+                chain.insert(0, front)
+            args.append(p.default)
+
+    def convert_arg(self, anno, curr_arg):
+        if curr_arg is None:
+            raise ExecFailedError(f'无法识别的参数类型')
+        if type(curr_arg) is anno:
+            return curr_arg
+        if anno in (str, int, float, bool):
+            if type(curr_arg) is not str or isinstance(curr_arg, Plain):
+                raise ExecFailedError(f'参数类型错误')
+            return anno(curr_arg.text if isinstance(curr_arg, Plain) else curr_arg)
+        if issubclass(anno, Enum) and isinstance(curr_arg, anno) and type(curr_arg) is not anno:
+            return curr_arg
+        if issubclass(anno, Enum):
+            values = [e.value for e in anno]
+            if curr_arg not in values:
+                raise ExecFailedError(f'枚举值无效, 可选: {", ".join(values)}')
+            return anno(curr_arg)
+        if anno is At and isinstance(curr_arg, (Plain, str)):
+            try:
+                m_id = int(self.get_text(curr_arg))
+            except:
+                raise ExecFailedError(f'AT的目标id格式错误')
+            return At(target=m_id)
+        if anno is MessageComponent:
+            return curr_arg
+
+        raise ExecFailedError(f'参数类型错误, 未匹配, {anno=}, {type(curr_arg)=}')
+
 
 class OutOfContext(Context):
     event: PlaceholderEvent
@@ -869,19 +1847,17 @@ class JoinReqContext(Context):
                     fin_res = res
                     return
 
-            for plugin in self.engine.plugins.values():
-                if plugin.disabled: continue
+            for plugin, method in self.engine.handlers.of('_join_req_instr_'):
                 async with plugin.override():
-                    for _, method in inspect.getmembers(plugin, predicate=inspect.ismethod):
-                        if hasattr(method, '_join_req_instr_'):
-                            logger.debug(f'found {method=}')
-                            try:
-                                if InstrAttr.FORECE_BACKUP in method._instr_attrs_:
-                                    plugin.backup_man.set_dirty()
-                                res = await method(*(await self.resolve_args(method, [])))
-                                update_res(res)
-                            except:
-                                traceback.print_exc()
+                    logger.debug(f'found {method=}')
+                    try:
+                        if InstrAttr.FORECE_BACKUP in method._instr_attrs_:
+                            plugin.backup_man.set_dirty()
+                        with self.engine.metrics.timing(plugin.__class__.__name__, method.__name__):
+                            res = await method(*(await self.resolve_args(method, [])))
+                        update_res(res)
+                    except:
+                        traceback.print_exc()
             if fin_res is not None:
                 if not isinstance(fin_res, tuple):
                     fin_res = (fin_res,)
@@ -961,28 +1937,35 @@ class MessageContext(Context):
                 except: ...
 
         instr_attr_name = '_top_instr_name_' if top_instr_mod else '_instr_name_'
+        if top_instr_mod:
+            router = self.engine.handlers.top_router
+        else:
+            router = self.engine.handlers.plugin_routers.get(plugins[0])
+        routes = router.resolve(instr_name) if router is not None else []
+        matches = {route.method: match_result for route, match_result in routes}
         found = False
 
         async def cb(method: MethodType):
             nonlocal found
-            match_result = re.fullmatch(getattr(method, instr_attr_name), instr_name, flags=re.IGNORECASE)
-            if match_result:
-                logger.debug(f'{instr_name=}, {match_result=}')
-                found = True
-                self.stack.append(instr_name)
-                consume_param_cnt = 1 if top_instr_mod else 2
-                try:
-                    args = await self.resolve_args(method, processed_chain[consume_param_cnt:], match=match_result)
-                    return await method(*args)
-                except Exception as e:
-                    if instr_name == '来只纳延':
-                        traceback.print_exc()
-                    raise
+            match_result = matches[method]
+            logger.debug(f'{instr_name=}, {match_result=}')
+            found = True
+            self.stack.append(instr_name)
+            consume_param_cnt = 1 if top_instr_mod else 2
+            try:
+                args = await self.resolve_args(method, processed_chain[consume_param_cnt:], match=match_result)
+                return await method(*args)
+            except Exception as e:
+                if instr_name == '来只纳延':
+                    traceback.print_exc()
+                raise
 
-        await self.instrs(instr_attr_name, cb, plugins=plugins)
+        await self.instrs(instr_attr_name, cb, handlers=[(route.plugin, route.method) for route, _ in routes])
 
         if not found:
-            raise CommandNotFoundError(f'指令{instr_name}不存在')
+            e = CommandNotFoundError(f'指令{instr_name}不存在')
+            self.engine.metrics.swallowed(e)
+            raise e
 
         # with self:
         #     for plugin in plugins:
@@ -1190,6 +2173,9 @@ def try_get_patharg_params(anno, _def_pos: str):
 class PluginConfig():
     name: str = field(init=False)
     backup_enabled = False
+    journal = True
+    storage: Literal['pickle', 'sqlite'] = 'pickle'
+    lazy = False
     ...
 
 def route(name):
@@ -1203,10 +2189,18 @@ def route(name):
         return target
     return wrapper
 
-def enable_backup(cls):
-    config = ensure_attr(cls, PluginConfig)
-    config.backup_enabled = True
-    return cls
+# 默认以日志记录变更, 完整的快照只在压缩日志时于线程中重写; journal=False时每次备份都在事件循环中序列化整个插件
+def enable_backup(cls=None, *, journal=True, storage: Literal['pickle', 'sqlite'] = 'pickle', lazy=False):
+    def wrapper(cls):
+        config = ensure_attr(cls, PluginConfig)
+        config.backup_enabled = True
+        config.journal = journal
+        config.storage = storage
+        config.lazy = lazy
+        return cls
+    if cls is None:
+        return wrapper
+    return wrapper(cls)
     ...
 
 @dataclass
@@ -78,7 +78,7 @@ class CollectedAchvMan():
 #使用方式：插件注入Achv、并且插件同文件下存在从AchvEnum继承的枚举
 
 @route('成就系统')
-@enable_backup
+@enable_backup(journal=True, lazy=True)
 class Achv(Plugin, InjectNotifier):
     gls: GroupLocalStorage[CollectedAchvMan] = GroupLocalStorage[CollectedAchvMan]()
 
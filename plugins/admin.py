@@ -1,4 +1,5 @@
 import asyncio
+from array import array
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum, auto
@@ -14,20 +15,20 @@ from itertools import groupby
 from activator import SharpActivator
 import config
 from event_types import EffectiveSpeechEvent, ViolationEvent
+from outbox import Priority, send_priority
+from records import ChainRecord, MemberRef, Record
 import pytz
 import aiohttp
 from mirai import At, AtAll, Face, GroupMessage, Image, MessageChain, MessageEvent, Plain, TempMessage
 from mirai.models.entities import GroupMember, MemberInfoModel, Group
-from plugin import Context, Inject, InstrAttr, MessageContext, PathArg, Plugin, any_instr, autorun, delegate, enable_backup, join_req_instr, joined_instr, recall_instr, route, top_instr
-from utilities import AchvEnum, AchvOpts, AchvRarity, AdminType, GroupLocalStorage, GroupOp, GroupSpec, RewardEnum, Upgraded, get_logger, handler
+from plugin import After, Context, Inject, InstrAttr, MessageContext, PathArg, Plugin, any_instr, autorun, delegate, enable_backup, join_req_instr, joined_instr, recall_instr, route, top_instr
+from utilities import AchvEnum, AchvOpts, AchvRarity, AdminType, GroupLocalStorage, GroupOp, GroupSpec, RewardEnum, TimeSeries, Upgraded, get_logger, handler, lazy_import
 from mirai.models.events import GroupRecallEvent, MemberJoinRequestEvent
 import traceback
 from mirai.models.api import RespOperate
 from mirai.models.message import App, MusicShare, Quote, MarketFace, Source, Forward, ForwardMessageNode
 import cn2an
 
-import pyzbar.pyzbar
-from PIL import Image as PImage
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -39,6 +40,9 @@ if TYPE_CHECKING:
 
 logger = get_logger()
 
+pyzbar = lazy_import('pyzbar.pyzbar')
+PImage = lazy_import('PIL.Image')
+
 class AdminAchv(AchvEnum):
     CAN_NOT_STOP = 0, '停不下来', '违规刷屏', AchvOpts(condition_hidden=True, custom_obtain_msg='刹车坏了，没法停下来', display='🥵', min_display_durtion=60 * 60 * 24 * 7)
     ORIGINAL_SIN = 1, '原罪', '通过指令【#领取奖励】主动领取、功德超过3', AchvOpts(rarity=AchvRarity.LEGEND, custom_obtain_msg='获得了奖励🐾', is_punish=True, prompt='拥有此成就的群成员将受到更严格的刷屏判定', display='🔒', display_weight=100, display_pinned=True)
@@ -102,6 +106,7 @@ class BrushHistory():
 class ExpulsionMan():
     ...
 
+# 只用于读取旧备份
 @dataclass
 class ViolationRecord():
     reason: str
@@ -111,19 +116,38 @@ class ViolationRecord():
 @dataclass
 class ViolationMan(Upgraded):
     count: int = 0
-    records: list[ViolationRecord] = field(default_factory=list)
+    records: TimeSeries = field(default_factory=lambda: TimeSeries('q')) # 载荷为增加的功德数
 
-    def append_record(self, record: ViolationRecord):
-        self.records.append(record)
+    def append_record(self, added_cnt: int):
+        self.records.append(value=added_cnt)
 
     def count_after_ts(self, ts: int):
-        return len([r for r in self.records if r.created_ts >= ts])
-
-@dataclass
-class AdminOperationRecord():
-    event: MessageEvent
+        return self.records.count_since(ts)
+
+    def __setstate__(self, state):
+        if isinstance(state.get('records'), list):
+            state['records'] = TimeSeries.of(((r.created_ts, r.added_cnt) for r in state['records']), 'q')
+        records = state.get('records')
+        if isinstance(records, TimeSeries) and records.values is not None and records.values.typecode == 'i':
+            # 早先的备份用的是32位的'i'
+            records.values = array('q', records.values)
+        self.__dict__.update(state)
+
+@dataclass(slots=True)
+class AdminOperationRecord(Record):
+    message_id: int
+    text: str
     created_ts: int = field(default_factory=time.time)
 
+    @classmethod
+    def of(cls, event: MessageEvent):
+        return cls(event.message_chain.message_id, str(event.message_chain))
+
+    @classmethod
+    def migrate(cls, state):
+        event: MessageEvent = state.pop('event')
+        return {'message_id': event.message_chain.message_id, 'text': str(event.message_chain), **state}
+
 @dataclass
 class RequestedAdminMan():
     last_resign_ts: int = 0
@@ -167,34 +191,58 @@ class MemberAssociateMan():
         else:
             return {member_id}
 
+# 只用于读取旧备份
 @dataclass
 class EffectiveSpeechRecord():
     created_ts: int = field(default_factory=time.time)
 
 @dataclass
 class EffectiveSpeechMan():
-    records: list[EffectiveSpeechRecord] = field(default_factory=list)
+    records: TimeSeries = field(default_factory=TimeSeries)
 
     def record(self):
-        self.records.append(EffectiveSpeechRecord())
+        self.records.append()
 
     def count_after_ts(self, ts: int):
-        return len([r for r in self.records if r.created_ts >= ts])
+        return self.records.count_since(ts)
 
-@dataclass
-class HistoryItem():
-    member: GroupMember
-    message_chain: MessageChain
+    def __setstate__(self, state):
+        if isinstance(state.get('records'), list):
+            state['records'] = TimeSeries.of(r.created_ts for r in state['records'])
+        self.__dict__.update(state)
 
+@dataclass(slots=True)
+class HistoryItem(Record):
+    member: MemberRef
+    chain: ChainRecord
+
+    @classmethod
+    def migrate(cls, state):
+        # 旧的记录把消息id作为【id】写在消息链开头
+        chain: MessageChain = state['message_chain']
+        message_id = -1
+        if len(chain) > 0 and isinstance(chain[0], Plain):
+            matched = re.match(r'^【(-?\d+)】$', chain[0].text)
+            if matched is not None:
+                message_id = int(matched.group(1))
+                chain = chain[1:]
+        return {'member': MemberRef.of(state['member']), 'chain': ChainRecord.of(chain, message_id)}
+
+# 最近的消息按槽位循环存放在Admin.gls_message_history中, 每条消息只写一个条目的日志
 @dataclass
 class MessageHistoryMan():
-    history: list[HistoryItem] = field(default_factory=list)
+    history: list[HistoryItem] = field(default_factory=list) # 旧备份中整段保存的记录, 读到时迁移到槽位中
+    next_slot: int = 0
     MAX_HISTORY_LEN: Final = 100
 
-    def append(self, item: HistoryItem):
-        self.history.append(item)
-        if len(self.history) >= self.MAX_HISTORY_LEN:
-            self.history.pop(0)
+    def take_slot(self) -> int:
+        slot = self.next_slot % self.MAX_HISTORY_LEN
+        self.next_slot += 1
+        return slot
+
+    def slots(self) -> list[int]:
+        # 从旧到新
+        return [i % self.MAX_HISTORY_LEN for i in range(max(self.next_slot - self.MAX_HISTORY_LEN, 0), self.next_slot)]
     
 class ReslovedCensorSpeechQual(Enum):
     BASE = auto()
@@ -217,7 +265,7 @@ class ReslovedCensorSpeechKey():
         )
 
 @route('管理')
-@enable_backup
+@enable_backup(journal=True, lazy=True)
 class Admin(Plugin):
     gls_violation: GroupLocalStorage[ViolationMan] = GroupLocalStorage[ViolationMan]()
     gls_requested_admin: GroupLocalStorage[RequestedAdminMan] = GroupLocalStorage[RequestedAdminMan]()
@@ -225,6 +273,7 @@ class Admin(Plugin):
     gls_effective_speech: GroupLocalStorage[EffectiveSpeechMan] = GroupLocalStorage[EffectiveSpeechMan]()
     gspec_mam: GroupSpec[MemberAssociateMan] = GroupSpec[MemberAssociateMan]()
     gspec_message_history_man: GroupSpec[MessageHistoryMan] = GroupSpec[MessageHistoryMan]()
+    gls_message_history: GroupLocalStorage[HistoryItem] = GroupLocalStorage[HistoryItem]() # 键为(群号, 槽位)
     last_auto_clean_all_violation_cnt_ts: int = 0
     events: Inject['Events']
     achv: Inject['Achv']
@@ -323,7 +372,7 @@ class Admin(Plugin):
 
     @delegate(InstrAttr.FORECE_BACKUP)
     async def append_admin_op_record(self, event: MessageEvent, man: RequestedAdminMan):
-        man.append_operation_records(AdminOperationRecord(event))
+        man.append_operation_records(AdminOperationRecord.of(event))
 
     def privilege(self, *, type=AdminType.ACHV):
         outer = self
@@ -545,22 +594,33 @@ class Admin(Plugin):
 
     @any_instr(InstrAttr.FORECE_BACKUP)
     async def record_msg_history(self, event: GroupMessage, member: GroupMember, man: MessageHistoryMan):
-        man.append(
-            HistoryItem(
-                member=member,
-                message_chain=MessageChain([f'【{event.message_chain.message_id}】', *event.message_chain[1:]])
-            )
-        )
+        self.migrate_msg_history(event.group.id, man)
+        self.gls_message_history.set_data(event.group.id, man.take_slot(), HistoryItem(
+            member=MemberRef.of(member),
+            chain=ChainRecord.of(event.message_chain)
+        ))
+
+    def migrate_msg_history(self, group_id: int, man: MessageHistoryMan):
+        if len(man.history) == 0: return
+        items, man.history = man.history, []
+        for item in items:
+            self.gls_message_history.set_data(group_id, man.take_slot(), item)
 
     @top_instr('消息记录')
-    async def msg_history_cmd(self, man: MessageHistoryMan):
+    async def msg_history_cmd(self, group: Group, man: MessageHistoryMan):
         async with self.privilege():
+            self.migrate_msg_history(group.id, man)
+            # 只读, 不标脏
+            stored = self.gls_message_history.groups.get(group.id, {})
+            history = [stored[slot] for slot in man.slots() if slot in stored]
+            # 尽量显示现在的名片, 已退群的用记录时的
+            members = await self.engine.get_group_members(group.id, (item.member.id for item in history))
             return [
                 Forward(node_list=[
                     ForwardMessageNode.create(
-                        item.member, 
-                        [c for c in item.message_chain[:] if isinstance(c, (Plain, Image, Face, MarketFace))]
-                    ) for item in man.history
+                        members.get(item.member.id, item.member),
+                        [f'【{item.chain.message_id}】', *item.chain.components()]
+                    ) for item in history
                 ])
             ]
 
@@ -600,7 +660,7 @@ class Admin(Plugin):
         if has_special_title and has_all_the_time:
             await self.achv.remove(AdminAchv.ALL_THE_TIME, force=True)
 
-    @any_instr(InstrAttr.NO_ALERT_CALLER)
+    @any_instr(InstrAttr.NO_ALERT_CALLER, InstrAttr.EXCLUSIVE)
     async def proxy_execute(self, event: GroupMessage, quote: Quote, ctx: MessageContext):
         member_id = quote.sender_id
 
@@ -624,7 +684,7 @@ class Admin(Plugin):
                 await ctx.exec_cmd(chain)
 
 
-    @any_instr(InstrAttr.NO_ALERT_CALLER)
+    @any_instr(InstrAttr.NO_ALERT_CALLER, After('Admin.censor_speech'))
     async def brush_warning(self, history: BrushHistory, member: GroupMember, gop: GroupOp, fur: Inject['Fur']):
         try:
             has_orignial_sin = await self.achv.has(AdminAchv.ORIGINAL_SIN)
@@ -677,11 +737,9 @@ class Admin(Plugin):
             await self.kick_target(member.id)
             return
         
+        # 先记录: 次数超出范围时抛出, 不留下只改了一半的状态
+        man.append_record(to)
         man.count += to
-        man.append_record(ViolationRecord(
-            reason=reason,
-            added_cnt=to
-        ))
 
         await self.events.emit(ViolationEvent(
             member_id=member.id,
@@ -708,15 +766,16 @@ class Admin(Plugin):
 
     @delegate(InstrAttr.BACKGROUND)
     async def boardcast_to_admins(self, group: Group, *, mc: list):
-        members = await self.bot.member_list(group.id)
-
-        for m in members:
-            async with self.override(m):
-                if await self.achv.is_used(AdminAchv.ADMIN):
-                    try:
-                        await self.bot.send_temp_message(m.id, m.group.id, [f'【管理消息】【{group.name}】\n', *mc])
-                        await asyncio.sleep(3)
-                    except: ...
+        roster = await self.engine.roster_of(group.id)
+
+        # 临时会话的限速由Outbox负责
+        with send_priority(Priority.BROADCAST):
+            for m in list(roster.members.values()):
+                async with self.override(m):
+                    if await self.achv.is_used(AdminAchv.ADMIN):
+                        try:
+                            await self.bot.send_temp_message(m.id, m.group.id, [f'【管理消息】【{group.name}】\n', *mc])
+                        except: ...
         ...
 
     # @autorun
@@ -924,7 +983,7 @@ class Admin(Plugin):
                             return
                 if not is_in_white_list:
                     if isinstance(c, Image):
-                        qrcodes = pyzbar.pyzbar.decode(await self.load_image(c))
+                        qrcodes = pyzbar.decode(await self.load_image(c))
                         logger.debug(f'{qrcodes=}')
                         if len(qrcodes) > 0:
                             await try_recall('消息中包含不明二维码', '消息中包含不明二维码')
@@ -1,5 +1,4 @@
 import asyncio
-from datetime import datetime
 import time
 import traceback
 from plugin import Context, Inject, Plugin, any_instr, autorun, enable_backup, route
@@ -11,6 +10,7 @@ if TYPE_CHECKING:
     from plugins.known_groups import KnownGroups
     from plugins.achv import Achv
     from plugins.admin import Admin
+    from plugins.timer import Timer
 
 logger = get_logger()
 
@@ -24,6 +24,7 @@ class AutoPurge(Plugin):
     known_groups: Inject['KnownGroups']
     achv: Inject['Achv']
     admin: Inject['Admin']
+    timer: Inject['Timer']
 
     INACTIVE_NOTIFICATION_DAYS_THRESHOLD: Final = 7
     INACTIVE_REMOVE_DAYS_THRESHOLD: Final = 3
@@ -32,50 +33,64 @@ class AutoPurge(Plugin):
     # 在待清除名单中连续3天，则踢出群
 
     @autorun
-    async def purge_process(self, ctx: Context):
-        while True:
-            await asyncio.sleep(1)
-            with ctx:
-                for group_id in self.known_groups:
-                    resp = await self.bot.member_list(group_id)
-                    group = await self.bot.get_group(group_id)
+    async def schedule_purge(self):
+        await self.timer.every(60 * 60, self.purge_process, first=1)
 
-                    for i, member in enumerate(resp.data):
-                        async with self.override(member):
-                            try:
-                                if member.special_title != '':
-                                    continue
+    async def purge_process(self):
+        for group_id in self.known_groups:
+            roster = await self.engine.roster_of(group_id)
+            group = await self.bot.get_group(group_id)
 
-                                latest_active_day = max(member.join_timestamp, member.last_speak_timestamp)
+            # 超过阈值天数没有冒泡的成员, 由成员镜像的活跃时间索引给出
+            now = time.time()
+            inactive = roster.inactive_since(now - 60 * 60 * 24 * (self.INACTIVE_NOTIFICATION_DAYS_THRESHOLD + 1))
+            inactive_ids = {member.id for member in inactive}
 
-                                span = datetime.now().replace(tzinfo=None) - latest_active_day.replace(tzinfo=None)
+            # 已经冒泡的成员移除标记
+            async with self.override(group):
+                marked_ids = await self.achv.get_obtained_member_ids(AutoPurgeAchv.INACTIVE_MARK)
+            for member_id in marked_ids - inactive_ids:
+                member = roster.get(member_id)
+                if member is None: continue
+                async with self.override(member):
+                    try:
+                        await self.achv.remove(AutoPurgeAchv.INACTIVE_MARK, force=True)
+                    except:
+                        traceback.print_exc()
 
-                                if span.days <= self.INACTIVE_NOTIFICATION_DAYS_THRESHOLD:
-                                    
-                                    await self.achv.remove(AutoPurgeAchv.INACTIVE_MARK, force=True)
-                                    continue
+            for i, member in enumerate(inactive):
+                async with self.override(member):
+                    try:
+                        if member.special_title != '':
+                            continue
 
-                                if await self.achv.has(AutoPurgeAchv.INACTIVE_MARK):
-                                    # TODO: 超过三天, 移除群聊, 顺便删除INACTIVE_MARK
-                                    obtained_ts = await self.achv.get_achv_obtained_ts(AutoPurgeAchv.INACTIVE_MARK)
-                                    if time.time() - obtained_ts > 60 * 60 * 24 * self.INACTIVE_REMOVE_DAYS_THRESHOLD:
-                                        name = await self.achv.get_raw_member_name()
-                                        await self.bot.kick(group_id, member.id, '自动清理潜水群员, 误踢请重新加回')
-                                        await self.achv.remove(AutoPurgeAchv.INACTIVE_MARK, force=True)
-                                        await self.admin.boardcast_to_admins(mc=[f'自动清理了潜水成员"{name}"({member.id})'])
-                                else:
-                                    await self.achv.submit(AutoPurgeAchv.INACTIVE_MARK, silent=True)
-                                    await self.bot.send_temp_message(member.id, group_id, [
-                                        f'您在群{group.get_name()}({group_id})已经有{span.days}天没有冒泡啦, '
-                                        f'bot将在{self.INACTIVE_REMOVE_DAYS_THRESHOLD}天后执行自动清理潜水群员程序, '
-                                        '在此期间内进行冒泡可避免被误踢, 如被误踢请重新加回'
-                                    ])
-                                    logger.debug(f'[潜水通知] ({i + 1}/{len(resp.data)}) {member.get_name()}: {span.days}天')
-                                    await asyncio.sleep(60)
-                            except:
-                                traceback.print_exc()
+                        # 等待期间成员可能已经冒泡或退群
+                        last_active = roster.last_active.get(member.id)
+                        if last_active is None: continue
+                        span_days = int((time.time() - last_active) // (60 * 60 * 24))
+                        if span_days <= self.INACTIVE_NOTIFICATION_DAYS_THRESHOLD:
+                            await self.achv.remove(AutoPurgeAchv.INACTIVE_MARK, force=True)
+                            continue
 
-            await asyncio.sleep(60 * 60)
+                        if await self.achv.has(AutoPurgeAchv.INACTIVE_MARK):
+                            # TODO: 超过三天, 移除群聊, 顺便删除INACTIVE_MARK
+                            obtained_ts = await self.achv.get_achv_obtained_ts(AutoPurgeAchv.INACTIVE_MARK)
+                            if time.time() - obtained_ts > 60 * 60 * 24 * self.INACTIVE_REMOVE_DAYS_THRESHOLD:
+                                name = await self.achv.get_raw_member_name()
+                                await self.bot.kick(group_id, member.id, '自动清理潜水群员, 误踢请重新加回')
+                                await self.achv.remove(AutoPurgeAchv.INACTIVE_MARK, force=True)
+                                await self.admin.boardcast_to_admins(mc=[f'自动清理了潜水成员"{name}"({member.id})'])
+                        else:
+                            await self.achv.submit(AutoPurgeAchv.INACTIVE_MARK, silent=True)
+                            await self.bot.send_temp_message(member.id, group_id, [
+                                f'您在群{group.get_name()}({group_id})已经有{span_days}天没有冒泡啦, '
+                                f'bot将在{self.INACTIVE_REMOVE_DAYS_THRESHOLD}天后执行自动清理潜水群员程序, '
+                                '在此期间内进行冒泡可避免被误踢, 如被误踢请重新加回'
+                            ])
+                            logger.debug(f'[潜水通知] ({i + 1}/{len(inactive)}) {member.get_name()}: {span_days}天')
+                            await asyncio.sleep(60)
+                    except:
+                        traceback.print_exc()
     
     @any_instr()
     async def remove_inactive_mark(self):
@@ -5,7 +5,7 @@ from mirai import At, GroupMessage
 from plugin import AchvCustomizer, Inject, Plugin, any_instr, delegate, enable_backup, nudge_instr, top_instr, route, InstrAttr
 from mirai.models.message import Image
 from mirai.models.entities import GroupMember
-from utilities import AchvEnum, AchvOpts, AchvRarity, AdminType, GroupLocalStorage, GroupLocalStorageAsEvent, GroupMemberOp, throttle_config
+from utilities import AchvEnum, AchvOpts, AchvRarity, AdminType, GroupLocalStorage, GroupLocalStorageAsEvent, GroupMemberOp, TimeSeries, throttle_config
 import pytz
 from datetime import datetime
 import time
@@ -40,11 +40,11 @@ class BadTimeException(Exception):
 
 @dataclass
 class CheckInMan():
-    checkin_ts: List[float] = field(default_factory=list)
+    checkin_ts: TimeSeries = field(default_factory=TimeSeries)
 
     def get_checkin_ts_today(self):
-        if len(self.checkin_ts) == 0: return None
-        last_checkin_ts = self.checkin_ts[-1]
+        last_checkin_ts = self.checkin_ts.last()
+        if last_checkin_ts is None: return None
         if last_checkin_ts < self.get_start_ts_of_today(): return None
         return last_checkin_ts
 
@@ -52,9 +52,7 @@ class CheckInMan():
     def check_in(self):
         if self.get_checkin_ts_today() is not None:
             raise AlreadyCheckInException()
-        now = time.time()
-        self.checkin_ts.append(now)
-        return now
+        return self.checkin_ts.append()
     
     def re_check_in(self, target_ts: float):
         # if self.get_checkin_ts_today() is None:
@@ -63,17 +61,14 @@ class CheckInMan():
             raise BadTimeException()
         start_ts_of_that_day = self.get_start_ts_of_today(ts=target_ts)
         end_ts_of_that_day = start_ts_of_that_day + 60 * 60 * 24
-        if any([e >= start_ts_of_that_day and e < end_ts_of_that_day for e in self.checkin_ts]):
+        if self.checkin_ts.count_between(start_ts_of_that_day, end_ts_of_that_day) > 0:
             raise AlreadyCheckInException()
-        self.ordered_insert(self.checkin_ts, target_ts)
+        self.checkin_ts.append(target_ts)
 
-    @staticmethod
-    def ordered_insert(li: list, e):
-        try:
-            target_index = list(x > e for x in li).index(True)
-            li.insert(target_index, e)
-        except:
-            li.append(e)
+    def __setstate__(self, state):
+        if isinstance(state.get('checkin_ts'), list):
+            state['checkin_ts'] = TimeSeries.of(sorted(state['checkin_ts']))
+        self.__dict__.update(state)
 
     @property
     def consecutive_days(self):
@@ -89,7 +84,7 @@ class CheckInMan():
 
     @property
     def checkin_ts_this_month(self):
-        return [ts for ts in self.checkin_ts if ts >= self.get_start_ts_of_this_month()]
+        return self.checkin_ts.between(self.get_start_ts_of_this_month()).tolist()
 
     @classmethod
     def get_start_ts_of_today(cls, *, ts=None):
@@ -117,7 +112,7 @@ class CheckInMan():
 
 
 @route('check_in')
-@enable_backup
+@enable_backup(storage='sqlite')
 class CheckIn(Plugin, AchvCustomizer):
     gls: GroupLocalStorage[CheckInMan] = GroupLocalStorage[CheckInMan]()
     renderer: Inject['Renderer']
@@ -174,7 +169,7 @@ class CheckIn(Plugin, AchvCustomizer):
     @top_instr('取消签到', InstrAttr.FORECE_BACKUP)
     async def cancel_check_in_cmd(self, man: CheckInMan):
         async with self.admin.privilege(type=AdminType.SUPER):
-            man.checkin_ts = [ts for ts in man.checkin_ts if ts < man.get_start_ts_of_today()]
+            man.checkin_ts.drop_since(man.get_start_ts_of_today())
         
     @top_instr('帮群友补签', InstrAttr.NO_ALERT_CALLER, InstrAttr.FORECE_BACKUP)
     async def re_check_in_to_cmd(self, at: At, year: int, month: int, day: int):
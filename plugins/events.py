@@ -1,6 +1,7 @@
 import inspect
 import traceback
 from types import MethodType
+from typing import Callable, Dict, Iterable, List, Optional
 
 from plugin import AllLoadedNotifier, Plugin, route
 from utilities import get_logger
@@ -10,40 +11,80 @@ logger = get_logger()
 @route('events')
 class Events(Plugin, AllLoadedNotifier):
     registed_handlers: dict[Plugin, set[MethodType]]
+    handler_table: Dict[type, List[Callable]] # 参数注解的类型 -> 处理器
+    dispatch_table: Dict[type, List[Callable]] # 事件的实际类型 -> 处理器, 按MRO展开后缓存
 
     def __init__(self) -> None:
         self.registed_handlers = {}
+        self.handler_table = {}
+        self.dispatch_table = {}
 
+    @staticmethod
+    def event_types_of(handler: Callable) -> List[type]:
+        s = inspect.signature(handler)
+        return [p.annotation for p in s.parameters.values() if p.kind != p.KEYWORD_ONLY and inspect.isclass(p.annotation)]
+
+    def subscribe(self, handler: Callable, event_types: Optional[Iterable[type]] = None):
+        if event_types is None:
+            event_types = self.event_types_of(handler)
+        for t in event_types:
+            handlers = self.handler_table.setdefault(t, [])
+            if handler not in handlers:
+                handlers.append(handler)
+        target = getattr(handler, '__self__', None)
+        if target is not None:
+            self.registed_handlers.setdefault(target, set()).add(handler)
+        self.dispatch_table.clear()
+
+    def unsubscribe(self, handler: Callable):
+        for t, handlers in list(self.handler_table.items()):
+            if handler in handlers:
+                handlers.remove(handler)
+            if len(handlers) == 0:
+                del self.handler_table[t]
+        target = getattr(handler, '__self__', None)
+        if target in self.registed_handlers:
+            self.registed_handlers[target].discard(handler)
+            if len(self.registed_handlers[target]) == 0:
+                del self.registed_handlers[target]
+        self.dispatch_table.clear()
+
+    def handlers_of(self, t: type) -> List[Callable]:
+        handlers = self.dispatch_table.get(t)
+        if handlers is None:
+            handlers = []
+            for base in t.__mro__:
+                for handler in self.handler_table.get(base, ()):
+                    if handler not in handlers:
+                        handlers.append(handler)
+            self.dispatch_table[t] = handlers
+        return handlers
 
     async def emit(self, obj):
-        # t = type(obj)
-        # print(f'{t.__name__=}')
-        # globals()[t.__name__] = t
-
-        try:
-
-            for plguin, handlers in self.registed_handlers.items():
-                for handler in handlers:
-                    # print(f'[{handler=}]')
-                    s = inspect.signature(handler)
-                    params = [p for p in s.parameters.values() if p.kind != p.KEYWORD_ONLY]
-                    if not any([isinstance(obj, p.annotation) for p in params]):
-                        continue
-                    # print(f'matched [{handler=}]')
-                    try:
-                        await handler(obj)
-                    except: 
-                        traceback.print_exc()
-                        ...
-        except:
-            traceback.print_exc()
+        t = type(obj)
+        handlers = self.dispatch_table.get(t)
+        if handlers is None:
+            handlers = self.handlers_of(t)
+        metrics = self.engine.metrics
+        metrics.count(f'events.{t.__name__}.emitted')
+        if len(handlers) == 0:
+            return
+        metrics.count(f'events.{t.__name__}.dispatched', len(handlers))
+        # 复制一份, 处理器里可能会订阅或退订
+        for handler in tuple(handlers):
+            try:
+                with metrics.timing(getattr(handler, '__self__', self).__class__.__name__, handler.__name__):
+                    await handler(obj)
+            except: 
+                traceback.print_exc()
+                ...
 
     def all_loaded(self):
+        self.registed_handlers.clear()
+        self.handler_table.clear()
+        self.dispatch_table.clear()
         for target in self.engine.plugins.values():
             for _, method in inspect.getmembers(target, predicate=inspect.ismethod):
                 if hasattr(method, '_event_handler_'):
-                    if target not in self.registed_handlers:
-                        self.registed_handlers[target] = set()
-                    
                     logger.debug(f'found event handler {method.__self__.__class__.__name__}.{method.__name__}')
-                    self.registed_handlers[target].add(method)
\ No newline at end of file
+                    self.subscribe(method)
@@ -1,14 +1,16 @@
 from datetime import datetime, date, timedelta
 from mirai import MessageEvent, Plain
 from plugin import AchvCustomizer, Inject, InstrAttr, Plugin, any_instr, delegate, route, top_instr
-from utilities import AchvEnum, AchvOpts, AchvRarity, GroupMemberOp
-from borax.calendars.festivals2 import FestivalLibrary, Festival as Fes
+from utilities import AchvEnum, AchvOpts, AchvRarity, GroupMemberOp, lazy_import
 from dataclasses import dataclass
 import re
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from plugins.achv import Achv
+    from borax.calendars.festivals2 import Festival as Fes
+
+FestivalLibrary = lazy_import('borax.calendars.festivals2', 'FestivalLibrary')
 
 class FestivalAchv(AchvEnum):
     MID_AUTUMN_FESTIVAL = 0, '月饼', '在中秋节当天发送"中秋快乐"', AchvOpts(rarity=AchvRarity.RARE, display='🥮', dynamic_deletable=True)
@@ -32,7 +34,7 @@ class FursuitFriday():
     
 @dataclass
 class FestivalItem():
-    festival: Fes
+    festival: 'Fes'
     trigger_regex: str
     associated_achv: FestivalAchv
     duration_days: int = 1
@@ -47,8 +49,17 @@ class Festival(Plugin, AchvCustomizer):
     achv: Inject['Achv']
     
     def __init__(self):
-        self.library = FestivalLibrary.load_builtin()
-        self.festivals = [
+        self.festivals = None
+
+    # 节日库在第一次用到时才加载
+    def get_festivals(self):
+        if self.festivals is None:
+            self.library = FestivalLibrary.load_builtin()
+            self.festivals = self.create_festivals()
+        return self.festivals
+
+    def create_festivals(self):
+        return [
             FestivalItem(
                 festival=self.library.get_festival('中秋节'),
                 trigger_regex='中秋.*?快乐',
@@ -81,7 +92,7 @@ class Festival(Plugin, AchvCustomizer):
 
     @any_instr(InstrAttr.NO_ALERT_CALLER)
     async def festival_achv(self, event: MessageEvent, op: GroupMemberOp):
-        for item in self.festivals:
+        for item in self.get_festivals():
             if item.is_available():
                 if not await self.achv.has(item.associated_achv):
                     for c in event.message_chain:
@@ -94,13 +105,13 @@ class Festival(Plugin, AchvCustomizer):
 
     @delegate()
     async def is_achv_deletable(self, e: AchvEnum):
-        for item in self.festivals:
+        for item in self.get_festivals():
             if item.associated_achv is e:
                 return not item.is_available()
         return False
 
     def get_countdowns(self):
-        return {item.festival.name: item.festival.countdown()[0] for item in self.festivals}
+        return {item.festival.name: item.festival.countdown()[0] for item in self.get_festivals()}
 
     @top_instr('节日测试')
     async def test_fes(self, name: str):
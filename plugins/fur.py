@@ -11,11 +11,9 @@ import mirai.models.message
 from mirai.models.message import Quote
 from plugin import Context, Plugin, autorun, delegate, enable_backup, instr, top_instr, any_instr, InstrAttr, PathArg, route, Inject, nudge_instr, unmute_instr
 import random
-from bilibili_api import topic, dynamic
 import os
 import random
-from PIL import Image, ExifTags, TiffImagePlugin
-from utilities import AchvEnum, AchvInfo, AchvOpts, AchvRarity, AchvRarityVal, GroupLocalStorage, GroupLocalStorageAsEvent, GroupMemberOp, GroupSpec, MsgOp, SourceOp, Upgraded, get_delta_time_str, get_logger, throttle_config
+from utilities import AchvEnum, AchvInfo, AchvOpts, AchvRarity, AchvRarityVal, GroupLocalStorage, GroupLocalStorageAsEvent, GroupMemberOp, GroupSpec, MsgOp, SourceOp, Upgraded, get_delta_time_str, get_logger, lazy_import, throttle_config
 import uuid
 import aiohttp
 import base64
@@ -37,9 +35,16 @@ if TYPE_CHECKING:
     from plugins.admin import Admin
     from plugins.voucher import Voucher
     from plugins.throttle import Throttle
+    from plugins.timer import Timer
 
 logger = get_logger()
 
+topic = lazy_import('bilibili_api.topic')
+dynamic = lazy_import('bilibili_api.dynamic')
+Image = lazy_import('PIL.Image')
+ExifTags = lazy_import('PIL.ExifTags')
+TiffImagePlugin = lazy_import('PIL.TiffImagePlugin')
+
 # 小孩子不可以看
 class FurAchv(AchvEnum):
     LING_YI = 0, '灵翼事件', '通过非指定方式抽到由灵翼老师拍摄的返图', AchvOpts(rarity=AchvRarity.UNCOMMON, custom_obtain_msg='触发了灵翼事件', display='🦄')
@@ -131,9 +136,11 @@ class Fur(Plugin):
     admin: Inject['Admin']
     voucher: Inject['Voucher']
     throttle: Inject['Throttle']
+    timer: Inject['Timer']
 
     FETCH_AUTHOR_HISTORY_SIZE: Final = 10
     FETCH_IMG_PATH_HISTORY_SIZE: Final = 50
+    FUR_PIC_RECALL_DELAY: Final = 60
 
     fetch_author_history: Dict[str, List[str]] = {} # 目录的名字
     fetch_img_path_history: List[str] = []
@@ -142,22 +149,30 @@ class Fur(Plugin):
         random.seed()
         self.last_run_time = time.time()
 
+    async def schedule_fur_pic_recall(self, group_id: int, record: FurPicMsgRecord):
+        await self.timer.call_at(
+            record.created_ts + self.FUR_PIC_RECALL_DELAY, self.auto_recall_fur_pic, group_id,
+            key=f'fur.recall.{group_id}.{record.msg_id}', replace=False
+        )
+
     @autorun
-    async def auto_recall_fur_pic(self, ctx: Context):
-        while True:
-            await asyncio.sleep(1)
-            with ctx:
-                for g_id in self.gs_fur_pic_msg_man.groups.keys():
-                    group = await self.bot.get_group(g_id)
-                    if group is None: continue
-                    async with self.override(group):
-                        await self.recall_outdated_fur_pic()
+    async def schedule_pending_fur_pic_recalls(self):
+        # 定时器上线之前记下的图片
+        for g_id, man in list(self.gs_fur_pic_msg_man.groups.items()):
+            for r in man.records:
+                await self.schedule_fur_pic_recall(g_id, r)
+
+    async def auto_recall_fur_pic(self, group_id: int):
+        group = await self.bot.get_group(group_id)
+        if group is None: return
+        async with self.override(group):
+            await self.recall_outdated_fur_pic()
 
     @delegate()
     async def recall_outdated_fur_pic(self, group: Group, man: FurPicMsgMan):
         n = []
         for r in man.records:
-            if time.time() - r.created_ts > 60 * 1:
+            if time.time() - r.created_ts >= self.FUR_PIC_RECALL_DELAY:
                 self.backup_man.set_dirty()
                 try:
                     source_id = r.source_id
@@ -770,9 +785,9 @@ class Fur(Plugin):
             c = await generate_image()
             if c is not None:
                 resp = await source_op.send(c)
-                fur_pic_msg_man.records.append(
-                    FurPicMsgRecord(msg_id=resp.message_id, source_id=source_op.get_target_id())
-                )
+                record = FurPicMsgRecord(msg_id=resp.message_id, source_id=source_op.get_target_id())
+                fur_pic_msg_man.records.append(record)
+                await self.schedule_fur_pic_recall(group.id, record)
         
         # [".*?酒.*?${cat}?"]
         
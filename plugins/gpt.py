@@ -8,43 +8,30 @@ from plugin import Context, Inject, Plugin, autorun, delegate, instr, fall_instr
 from mirai.models.message import Quote, MarketFace, ShortVideo
 from mirai.models.events import NudgeEvent, Event, GroupRecallEvent
 from mirai.models.entities import Group, GroupMember
-import openai
 import os
 import random
 import json
 import time
 import inspect
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, Final, List, Optional, Set
 from enum import Enum
 import math
 from mirai.models.message import MessageComponent
 import aiohttp
 from asyncify import asyncify
-from huaweicloudsdkcore.auth.credentials import BasicCredentials
-from huaweicloudsdkcore.exceptions import exceptions
-from huaweicloudsdkimage.v2 import *
-from huaweicloudsdksis.v1.region.sis_region import SisRegion
-from huaweicloudsdksis.v1 import *
-from mako.lookup import TemplateLookup
 from abc import ABC, abstractmethod
-from PIL import Image as PImage
 from io import BytesIO
 import base64
 import aiofile
-from graiax import silkcoder
 import re
 import glob
 from pathlib import Path
 from enum import Enum, auto
-import google.generativeai as genai
-from google.generativeai.files import file_types
-from google.generativeai.types import Tool
-from google.generativeai.protos import FunctionResponse, Part
 import random
 
 from typing import TYPE_CHECKING
 
-from utilities import AchvRarity, SourceOp, breakdown_chain_sync, get_logger, handler
+from utilities import AchvRarity, Lazy, SourceOp, breakdown_chain_sync, get_logger, handler, lazy_import
 if TYPE_CHECKING:
     from plugins.rest import Rest
     from plugins.check_in import CheckIn
@@ -52,11 +39,32 @@ if TYPE_CHECKING:
     from plugins.achv import Achv
     from plugins.events import Events
     from plugins.festival import Festival
+    from plugins.timer import Timer
 
 logger = get_logger()
 
-genai.configure(api_key=config.GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-pro')
+# 这些依赖只在个别指令中用到, 延迟导入
+BasicCredentials = lazy_import('huaweicloudsdkcore.auth.credentials', 'BasicCredentials')
+exceptions = lazy_import('huaweicloudsdkcore.exceptions.exceptions')
+SisRegion = lazy_import('huaweicloudsdksis.v1.region.sis_region', 'SisRegion')
+SisClient = lazy_import('huaweicloudsdksis.v1', 'SisClient')
+RecognizeShortAudioRequest = lazy_import('huaweicloudsdksis.v1', 'RecognizeShortAudioRequest')
+Config = lazy_import('huaweicloudsdksis.v1', 'Config')
+PostShortAudioReq = lazy_import('huaweicloudsdksis.v1', 'PostShortAudioReq')
+TemplateLookup = lazy_import('mako.lookup', 'TemplateLookup')
+PImage = lazy_import('PIL.Image')
+silkcoder = lazy_import('graiax.silkcoder')
+genai = lazy_import('google.generativeai')
+file_types = lazy_import('google.generativeai.files', 'file_types')
+Tool = lazy_import('google.generativeai.types', 'Tool')
+FunctionResponse = lazy_import('google.generativeai.protos', 'FunctionResponse')
+Part = lazy_import('google.generativeai.protos', 'Part')
+
+def create_model():
+    genai.configure(api_key=config.GEMINI_API_KEY)
+    return genai.GenerativeModel('gemini-1.5-pro')
+
+model = Lazy('gemini model', create_model)
 
 class Dir(Enum):
     motions = auto()
@@ -72,12 +80,16 @@ class Gpt(Plugin):
     achv: Inject['Achv']
     events: Inject['Events']
     festival: Inject['Festival']
+    timer: Inject['Timer']
+
+    INITIATIVE_TALK_GROUP_IDS: Final = {139825481}
 
     def __init__(self) -> None:
         self.history = []
         self.enabled = False
         self.chat_ctx = ChatContextMan(self)
         self.news: List[str] = []
+        self.initiative_talking: Set[int] = set()
 
 
     @autorun
@@ -579,55 +591,66 @@ class Gpt(Plugin):
                         new_chain.append(s)
         return new_chain
 
-    @autorun
-    async def initiative_talk(self, ctx: Context):
-        while True:
-            await asyncio.sleep(1)
-            with ctx:
-                tasks = []
-                h = self.chat_ctx.groups.get(139825481, None)
-                hs = [h] if h is not None else []
-                # for history in self.chat_ctx.groups.values():
-                for history in hs:
-                    async def fn():
-                        prob = (
-                            math.log10(1 + history.member_speaking_times_during_last_initiative_talk) 
-                            * 1 / (60 * 60) # 平均半小时说一句话
-                        )
-                        if (time.time() - history.member_last_speak_tsc) > 5 * 60:
-                            prob = 0
-                        history.set_initiative_talk_prob(prob)
-                        history.set_last_initiative_talk_prob_update_tsc(time.time())
-                        await history._update_log_file()
-                        # with open(os.path.join(RESOURCE_PATH, 'prob.log'), 'wt', encoding='utf-8') as f:
-                        #     f.write(f'prob: {prob}')
-                        if random.uniform(0, 1) < prob:
-                            logger.info(f'主动发言: {history.id}')
-                            await history.append_system_msg(f'bot主动发言, 请考虑所有聊天记录进行发言(不一定要回复最后一条消息), 请勿使用第二人称称谓')
-                            for _ in range(5):
-                                try:
-                                    content = await self.chat(history)
-                                    history.member_speaking_times_during_last_initiative_talk = 0
-                                    group = await self.bot.get_group(history.id)
-                                    async with self.override(group):
-                                        await self.ai_ext.as_chat_seq(mc=content)
-                                    break
-                                except Exception as e:
-                                    logger.info(f'主动发言: {e}')
-                            else:
-                                await history.pop()
-                            logger.info(f'主动发言完成: {history.id}')
-                    tasks.append(fn())
-                await asyncio.gather(*tasks)
+    # 有人聊天时按每秒的概率prob主动发言, 安静5分钟后停止
+    # prob即发生率, 直接按指数分布抽取下一次发言前的等待时间, 不必每秒掷骰子
+    # 抽到的等待超过安静的期限时不安排, 由之后的聊天重新抽取; 指数分布无记忆, 与逐秒掷骰子等价
+    async def schedule_initiative_talk(self, group_id: int):
+        history = self.chat_ctx.groups.get(group_id, None)
+        # 正在主动发言时, 由那一次结束后安排下一次
+        if history is None or group_id in self.initiative_talking: return
+        prob = (
+            math.log10(1 + history.member_speaking_times_during_last_initiative_talk) 
+            * 1 / (60 * 60) # 平均半小时说一句话
+        )
+        remaining = history.member_last_speak_tsc + 5 * 60 - time.time()
+        if remaining <= 0:
+            prob = 0
+        history.set_initiative_talk_prob(prob)
+        history.set_last_initiative_talk_prob_update_tsc(time.time())
+        await history._update_log_file()
+        if prob == 0:
+            return
+        delay = random.expovariate(prob)
+        if delay >= remaining:
+            return
+        await self.timer.call_later(delay, self.initiative_talk, group_id, key=f'gpt.initiative_talk.{group_id}', replace=False)
+
+    async def initiative_talk(self, group_id: int):
+        history = self.chat_ctx.groups.get(group_id, None)
+        if history is None or group_id in self.initiative_talking: return
+        if (time.time() - history.member_last_speak_tsc) > 5 * 60:
+            return
+        logger.info(f'主动发言: {history.id}')
+        self.initiative_talking.add(group_id)
+        try:
+            await history.append_system_msg(f'bot主动发言, 请考虑所有聊天记录进行发言(不一定要回复最后一条消息), 请勿使用第二人称称谓')
+            for _ in range(5):
+                try:
+                    content = await self.chat(history)
+                    history.member_speaking_times_during_last_initiative_talk = 0
+                    group = await self.bot.get_group(history.id)
+                    async with self.override(group):
+                        await self.ai_ext.as_chat_seq(mc=content)
+                    break
+                except Exception as e:
+                    logger.info(f'主动发言: {e}')
+            else:
+                await history.pop()
+        finally:
+            self.initiative_talking.discard(group_id)
+        logger.info(f'主动发言完成: {history.id}')
+        # 发言结束后才安排下一次, 不会同时进行两次主动发言
+        await self.schedule_initiative_talk(group_id)
 
     @autorun
+    async def schedule_update_news(self):
+        await self.timer.every(60 * 60, self.update_news, first=0)
+
     async def update_news(self):
-        while True:
-            try:
-                await self.chat_ctx.update_news()
-            except: ...
-            logger.info('新闻已更新')
-            await asyncio.sleep(60 * 60)
+        try:
+            await self.chat_ctx.update_news()
+        except: ...
+        logger.info('新闻已更新')
 
     @nudge_instr(InstrAttr.INTERCEPT_EXCEPTIONS)
     async def nudge(self, event: NudgeEvent):
@@ -719,6 +742,8 @@ class Gpt(Plugin):
             history = self.chat_ctx.get_history_from_event(event)
             history.member_speaking_times_during_last_initiative_talk += 1
             history.update_member_last_speak_tsc()
+            if history.id in self.INITIATIVE_TALK_GROUP_IDS:
+                await self.schedule_initiative_talk(history.id)
             for c in event.message_chain:
                 if isinstance(c, At) and c.target == self.bot.qq:
                     try:
@@ -751,8 +776,9 @@ class MemberMan():
     def get_id_from_name(self, name: str, _def = None):
         return next(iter([k for k,v in self.members.items() if v == name]), _def)
 
-mako_lookup = TemplateLookup(directories=[Plugin.path.data])
-bot_profile = PImage.open(Plugin.path.data.of_file('test.jpg'))
+data_path = Plugin.path.data
+mako_lookup = Lazy('mako lookup', lambda: TemplateLookup(directories=[data_path]))
+bot_profile = Lazy('bot profile', lambda: PImage.open(data_path.of_file('test.jpg')))
 
 class History(ABC):
     ctx: 'ChatContextMan'
@@ -11,12 +11,11 @@ from aiomqtt import Client
 import aiomqtt
 from mirai import At, AtAll, Image
 from mirai.models.entities import GroupMember, Group, GroupConfigModel
-from bilibili_api import live
 import json
 
 from typing import TYPE_CHECKING, Final
 
-from utilities import AchvEnum, AchvInfo, AchvOpts, AchvRarity, GroupLocalStorage, UserSpec, breakdown_chain_sync, get_logger, throttle_config
+from utilities import AchvEnum, AchvInfo, AchvOpts, AchvRarity, GroupLocalStorage, UserSpec, breakdown_chain_sync, get_logger, lazy_import, throttle_config
 
 if TYPE_CHECKING:
     from plugins.achv import Achv
@@ -26,6 +25,8 @@ if TYPE_CHECKING:
 
 logger = get_logger()
 
+live = lazy_import('bilibili_api.live')
+
 class LiveAchv(AchvEnum):
     CAPTAIN = 0, '舰长', '通过【#绑定账号】与B站账号相关联后并且是B站账号为纳延的舰长时自动获取', AchvOpts(rarity=AchvRarity.RARE, custom_obtain_msg='成为了猫咪的舰长', display='⚓', locked=True)
     ...
@@ -5,8 +5,9 @@ from mirai.models.entities import GroupMember, MemberInfoModel
 from plugin import AchvCustomizer, Inject, Plugin, delegate, fall_instr, top_instr, any_instr, InstrAttr, route
 import random
 import os
-from graiax import silkcoder
-from utilities import AchvEnum, AchvOpts, AchvRarity
+from utilities import AchvEnum, AchvOpts, AchvRarity, lazy_import
+
+silkcoder = lazy_import('graiax.silkcoder')
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
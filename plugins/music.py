@@ -3,17 +3,12 @@ import config
 from mirai import Image, MessageEvent, Voice
 from plugin import Inject, PathArg, Plugin, top_instr, InstrAttr, route
 import random
-from pyncm_async import apis
-from pyncm_async.apis.login import LoginViaCellphone
 import os
 import aiofile
 import aiohttp
-from pychorus import find_and_output_chorus
 import uuid
 from asyncify import asyncify
-import pydub
-from graiax import silkcoder
-from utilities import get_logger, throttle_config
+from utilities import get_logger, lazy_import, throttle_config
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -21,6 +16,12 @@ if TYPE_CHECKING:
 
 logger = get_logger()
 
+apis = lazy_import('pyncm_async.apis')
+LoginViaCellphone = lazy_import('pyncm_async.apis.login', 'LoginViaCellphone')
+find_and_output_chorus = lazy_import('pychorus', 'find_and_output_chorus')
+pydub = lazy_import('pydub')
+silkcoder = lazy_import('graiax.silkcoder')
+
 @route('音乐')
 class Music(Plugin):
     throttle: Inject['Throttle']
@@ -2,18 +2,19 @@ import asyncio
 import io
 from mirai import Image
 from plugin import InstrAttr, Plugin, autorun, delegate, enable_backup, route
-from pyppeteer import launch
 import urllib.parse
 import json
 import time
 import base64
-import imageio
 import statistics
 
-from utilities import SourceOp, get_logger
+from utilities import SourceOp, get_logger, lazy_import
 
 logger = get_logger()
 
+launch = lazy_import('pyppeteer', 'launch')
+imageio = lazy_import('imageio')
+
 # ./.vscode/settings.json ["terminal.integrated.env.windows"]
 # $env:PYPPETEER_CHROMIUM_REVISION=1226537
 # https://vikyd.github.io/download-chromium-history-version/#/
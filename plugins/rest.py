@@ -2,6 +2,7 @@ import math
 from typing import Callable, ClassVar, Dict, Final, TypeVar
 from mirai import GroupMessage, Image
 from mirai.models.entities import GroupMember
+from records import MemberRef, Record
 from plugin import Inject, Plugin, delegate, enable_backup, fall_instr, top_instr, any_instr, InstrAttr, route
 from dataclasses import asdict, dataclass
 import time
@@ -23,9 +24,9 @@ class RestAchv(AchvEnum):
     SLEEPING = 3, '睡觉中', '成员在睡觉状态中时自动获得, 醒来自动删除', AchvOpts(display_pinned=True, locked=True, hidden=True, display='💤', display_weight=-1)
     ...
 
-@dataclass
-class RestInfo():
-    who: GroupMember
+@dataclass(slots=True)
+class RestInfo(Record):
+    who: MemberRef
     rest_tsc: float # 开始休息的时间点, 单位: 秒
 
     MAX_REST_TIME: ClassVar[int] = 60 * 60 * 8
@@ -44,12 +45,26 @@ class RestInfo():
             prefix = '超过'
         return f'{prefix}{get_delta_time_str(self.get_span(), use_seconds=False)}'
 
-@dataclass
-class RestHistory():
-    who: GroupMember
+    @classmethod
+    def migrate(cls, state):
+        return migrate_who(state)
+
+@dataclass(slots=True)
+class RestHistory(Record):
+    who: MemberRef
     total_span: float = 0
     last_awake_ts: float = 0
 
+    @classmethod
+    def migrate(cls, state):
+        return migrate_who(state)
+
+def migrate_who(state):
+    # 旧备份中保存的是整个GroupMember
+    if isinstance(state['who'], GroupMember):
+        state['who'] = MemberRef.of(state['who'])
+    return state
+
 @dataclass
 class ConvertedRestHistory():
     name: str
@@ -107,7 +122,7 @@ class Rest(Plugin):
         if who.id in bed_of_group:
             await self.achv.submit(RestAchv.FALSE_AWAKING)
             return
-        bed_of_group[who.id] = RestInfo(who=who, rest_tsc=time.time())
+        bed_of_group[who.id] = RestInfo(who=MemberRef.of(who), rest_tsc=time.time())
 
         await self.achv.submit(RestAchv.SLEEPING, silent=True)
 
@@ -142,15 +157,14 @@ class Rest(Plugin):
         group_id = event.group.id
         merged_history: Dict[int, RestHistory] = {}
 
-        members = (await self.bot.member_list(event.group.id)).data
+        members_by_id = (await self.engine.roster_of(group_id)).members
 
         T = TypeVar('T')
         async def acc(coll: Dict[int, T], fn: Callable[[T], float]):
             for member_id in coll:
-                if not any([m.id == member_id for m in members]): continue
+                if member_id not in members_by_id: continue
                 if member_id not in merged_history:
-                    mem = await self.bot.get_group_member(group_id, member_id)
-                    merged_history[member_id] = RestHistory(who=mem)
+                    merged_history[member_id] = RestHistory(who=MemberRef.of(members_by_id[member_id]))
                 merged_history[member_id].total_span += fn(coll[member_id])
 
         if group_id in self.bed:
@@ -214,8 +228,9 @@ class Rest(Plugin):
             self.history[who.group.id] = {}
         history_of_group = self.history[who.group.id]
         if who.id not in history_of_group:
-            history_of_group[who.id] = RestHistory(who=who)
+            history_of_group[who.id] = RestHistory(who=MemberRef.of(who))
         rest_history = history_of_group[who.id]
+        rest_history.who = MemberRef.of(who)
         rest_history.last_awake_ts = time.time()
 
         await self.achv.remove(RestAchv.SLEEPING, force=True)
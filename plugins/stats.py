@@ -0,0 +1,71 @@
+import asyncio
+import os
+import traceback
+import config
+from outbox import Outbox, Priority
+from plugin import Inject, Plugin, autorun, route, top_instr
+from utilities import LOGS_PATH, AdminType, get_logger
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from plugins.admin import Admin
+
+logger = get_logger()
+
+@route('统计')
+class Stats(Plugin):
+    admin: Inject['Admin']
+
+    TOP_N = 10
+
+    @autorun
+    async def dump_process(self):
+        interval = getattr(config, 'STATS_DUMP_INTERVAL', 300)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.engine.metrics.dump(os.path.join(LOGS_PATH, 'stats.json'))
+            except:
+                traceback.print_exc()
+
+    @top_instr('stats')
+    async def stats_cmd(self, sort_by: str = 'p95'):
+        async with self.admin.privilege(type=AdminType.SUPER):
+            metrics = self.engine.metrics
+            key = f'{sort_by}_ms' if sort_by in ('p50', 'p95', 'p99', 'max', 'avg') else 'p95_ms'
+            lines = [f'处理器耗时 (按{key[:-3]}排序):']
+            for (plugin_name, handler_name), m, summary in metrics.top(self.TOP_N, key):
+                swallowed = sum(m.swallowed.values())
+                lines.append(
+                    f'{plugin_name}.{handler_name}: {m.calls}次 '
+                    f'p50 {summary["p50_ms"]:.1f}ms p95 {summary["p95_ms"]:.1f}ms p99 {summary["p99_ms"]:.1f}ms'
+                    + (f' 错误{m.errors}' if m.errors > 0 else '')
+                    + (f' 吞掉{swallowed}' if swallowed > 0 else '')
+                )
+            if len(metrics.events) > 0:
+                lines.append('端到端 (收到事件→最后一次发送):')
+                for event_type, h in metrics.events.items():
+                    lines.append(f'{event_type}: {h.total}次 p50 {h.percentile(0.5) * 1000:.1f}ms p95 {h.percentile(0.95) * 1000:.1f}ms p99 {h.percentile(0.99) * 1000:.1f}ms')
+            if len(metrics.dispatch_wait) > 0:
+                lines.append('分发排队 (按通道类型):')
+                for kind, h in metrics.dispatch_wait.items():
+                    lines.append(f'{kind}: {h.total}次 p50 {h.percentile(0.5) * 1000:.1f}ms p95 {h.percentile(0.95) * 1000:.1f}ms 最长 {h.max * 1000:.0f}ms 最大深度{metrics.peaks.get(f"dispatch.{kind}.depth", 0)}')
+            if len(metrics.exceptions) > 0:
+                lines.append('被吞掉的异常: ' + ', '.join(f'{name} {cnt}' for name, cnt in metrics.exceptions.items()))
+            if len(metrics.counters) > 0:
+                lines.append('计数: ' + ', '.join(f'{name} {cnt}' for name, cnt in metrics.counters.items()))
+            rates = []
+            for name in ('member', 'profile', 'group'):
+                hit = metrics.counters.get(f'bot_cache.{name}.hit', 0)
+                miss = metrics.counters.get(f'bot_cache.{name}.miss', 0)
+                if hit + miss > 0:
+                    rates.append(f'{name} {hit / (hit + miss) * 100:.0f}% ({hit + miss}次)')
+            if len(rates) > 0:
+                lines.append('缓存命中率: ' + ', '.join(rates))
+            if isinstance(self.bot, Outbox):
+                s = self.bot.stats
+                lines.append(f'发送: {s.sent}条 合并{s.coalesced} 失败{s.failed} 最大排队{s.max_depth}')
+                for p in Priority:
+                    if s.count[p] > 0:
+                        lines.append(f'{p.name}: 平均等待 {s.total_wait[p] / s.count[p] * 1000:.0f}ms 最长 {s.max_wait[p] * 1000:.0f}ms')
+            return '\n'.join(lines)
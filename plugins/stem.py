@@ -7,16 +7,17 @@ from mirai.models.entities import GroupMember
 from plugin import Plugin, top_instr, any_instr, InstrAttr, route, PathArg
 import random
 import random
-from PIL import Image as img
-from PIL.Image import Image as PImage
 import aiohttp
 import aiofile
 from enum import Enum, auto
 
-from utilities import get_logger
+from utilities import get_logger, lazy_import
 
 logger = get_logger()
 
+img = lazy_import('PIL.Image')
+PImage = lazy_import('PIL.Image', 'Image')
+
 class Dir(Enum):
     小威 = auto()
 
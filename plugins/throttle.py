@@ -28,7 +28,7 @@ class ThrottleMan():
     fn_infos: dict[str, FnThrottleInfo] = field(default_factory=dict)
 
 @route('限流')
-@enable_backup
+@enable_backup(journal=True)
 class Throttle(Plugin):
     gls_throttle: GroupLocalStorage[ThrottleMan] = GroupLocalStorage[ThrottleMan]()
 
@@ -108,9 +108,8 @@ class Throttle(Plugin):
 
         associated: set[int] = await self.admin.get_associated(member_id=member.id)
         result = True
-        for member_id in associated:
-            curr_member = await self.bot.get_group_member(member.group.id, member_id)
-            if curr_member is None: continue
+        members = await self.engine.get_group_members(member.group.id, associated)
+        for curr_member in members.values():
             async with self.override(curr_member):
                 if not await self.do(recall=recall, cooldown_reamins=cooldown_reamins, fn=fn):
                     result = False
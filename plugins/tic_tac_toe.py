@@ -1,11 +1,16 @@
-import asyncio
 from enum import Enum, auto
+import time
 from typing import Final, List, Optional
 from mirai import At, GroupMessage
 from mirai.models.entities import GroupMember
-from plugin import Context, Plugin, autorun, instr, route
+from outbox import Priority, send_priority
+from plugin import Context, Inject, Plugin, instr, route
 import random
 
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from plugins.timer import Timer
+
 class GameResult(Enum):
     PENDING = auto(),
     WIN_O = auto(),
@@ -27,7 +32,7 @@ class Game():
         self.stared = False
         self.board = [[self.EMPTY, self.EMPTY, self.EMPTY] for _ in range(3)]
         self.id = ''.join(random.sample('zyxwvutsrqponmlkjihgfedcba0123456789',5))
-        self.des_rt = 60 # 销毁时间，没有任何操作则自动销毁
+        self.refresh_des_rt() # 没有任何操作则自动销毁
 
     def start(self):
         if self.parti is None:
@@ -52,7 +57,8 @@ class Game():
         self.parti = parti
 
     def refresh_des_rt(self):
-        self.des_rt = 60
+        self.des_ts = time.time() + 60
+        self.warned = False
 
     @property
     def curr_shape(self):
@@ -148,35 +154,44 @@ class Game():
 class TicTacToe(Plugin):
     games: List[Game] = []
 
-    @autorun
-    async def manage_game(self):
-        while True:
-            await asyncio.sleep(1)
-            next = []
-            for game in self.games:
-                game.des_rt -= 1
-                if game.des_rt == 30:
-                    bb = [f'{game}将在30s后自动结束']
-                    if game.stared:
-                        bb.extend([
-                            ', 请',
-                            At(target=game.current.id),
-                            '落子'
-                        ])
-                    await self.bot.send_group_message(game.owner.group.id, bb)
-                if game.des_rt <= 0:
-                    bb = [f'{game}由于长时间未操作自动结束']
-                    if game.stared:
-                        opposite = game.owner if game.current is not game.owner else game.parti
-                        bb.extend([
-                            ',',
-                            At(target=opposite.id),
-                            '获胜!'
-                        ])
-                    await self.bot.send_group_message(game.owner.group.id, bb)
-                    continue
-                next.append(game)
-            self.games = next
+    timer: Inject['Timer']
+
+    WARN_BEFORE_DESTROY: Final = 30
+
+    async def schedule_check(self, game: Game):
+        due = game.des_ts if game.warned else game.des_ts - self.WARN_BEFORE_DESTROY
+        await self.timer.call_at(due, self.check_game, game.id, key=f'tic_tac_toe.{game.id}')
+
+    # 到期时检查: 期间有过操作就按新的销毁时间重新安排
+    async def check_game(self, game_id: str):
+        game = next((game for game in self.games if game.id == game_id), None)
+        if game is None: return
+        remaining = game.des_ts - time.time()
+        # 超时提醒属于批量通知, 让位于指令回复
+        with send_priority(Priority.BROADCAST):
+            if remaining <= 0:
+                self.games.remove(game)
+                bb = [f'{game}由于长时间未操作自动结束']
+                if game.stared:
+                    opposite = game.owner if game.current is not game.owner else game.parti
+                    bb.extend([
+                        ',',
+                        At(target=opposite.id),
+                        '获胜!'
+                    ])
+                await self.bot.send_group_message(game.owner.group.id, bb)
+                return
+            if remaining <= self.WARN_BEFORE_DESTROY and not game.warned:
+                game.warned = True
+                bb = [f'{game}将在30s后自动结束']
+                if game.stared:
+                    bb.extend([
+                        ', 请',
+                        At(target=game.current.id),
+                        '落子'
+                    ])
+                await self.bot.send_group_message(game.owner.group.id, bb)
+        await self.schedule_check(game)
 
     def get_resolvers(self):
         def resolve_game(ctx: Context, event: GroupMessage, id: Optional[str]):
@@ -208,6 +223,7 @@ class TicTacToe(Plugin):
     async def create(self, event: GroupMessage):
         game = Game(event.sender)
         self.games.append(game)
+        await self.schedule_check(game)
         return [
             f'您已创建{game}, 参与者可使用[加入]命令加入对局'
         ]
@@ -260,4 +276,5 @@ class TicTacToe(Plugin):
                 '\n\n' + game.pretty_board(),
             ]
         self.games.remove(game)
+        await self.timer.cancel(f'tic_tac_toe.{game.id}')
         return resp
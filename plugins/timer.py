@@ -0,0 +1,152 @@
+import asyncio
+from dataclasses import dataclass, field
+import heapq
+import itertools
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from plugin import Plugin, autorun, enable_backup, route
+from utilities import get_logger
+
+logger = get_logger()
+
+@dataclass
+class TimerJob():
+    key: str
+    due: float # time.time()
+    plugin: str # 插件的route名
+    method: str
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    interval: Optional[float] = None # 周期任务的间隔
+    seq: int = 0 # 对应堆中的条目, 取消或重新登记后旧条目作废
+
+# 所有插件共用的定时器: 一个按到期时间排序的堆, 只在最早的任务到期时醒来
+# 任务以(插件名, 方法名, 参数)登记, 随备份保存, 重启后继续有效
+@route('timer')
+@enable_backup
+class Timer(Plugin):
+    jobs: Dict[str, TimerJob] = {}
+
+    def __init__(self) -> None:
+        self.heap: List[Tuple[float, int, str]] = []
+        self.seq = itertools.count(1)
+        self.wakeup = asyncio.Event()
+        self.running: Dict[str, asyncio.Task] = {}
+        # 事件循环只保留任务的弱引用, 执行中的任务都记在这里
+        self.tasks: Set[asyncio.Task] = set()
+        self.fired = 0
+
+    def target_of(self, method: Callable) -> Tuple[str, str]:
+        plugin = getattr(method, '__self__', None)
+        if not isinstance(plugin, Plugin):
+            raise ValueError(f'{method}不是插件的方法')
+        return plugin.get_config().name, method.__name__
+
+    async def call_at(self, due: float, method: Callable, *args, key: Optional[str] = None, interval: Optional[float] = None, replace: bool = True, **kwargs) -> str:
+        # replace=False时, 已经登记过同名任务则保留原来的
+        await self.engine.wait_materialized(self)
+        plugin_name, method_name = self.target_of(method)
+        if key is None:
+            key = f'{plugin_name}.{method_name}'
+        if not replace and key in self.jobs:
+            return key
+        job = TimerJob(key, due, plugin_name, method_name, args, kwargs, interval)
+        self.push(job)
+        self.backup_man.set_dirty()
+        return key
+
+    async def call_later(self, delay: float, method: Callable, *args, **kwargs) -> str:
+        return await self.call_at(time.time() + delay, method, *args, **kwargs)
+
+    async def every(self, interval: float, method: Callable, *args, first: Optional[float] = None, **kwargs) -> str:
+        # first: 第一次执行前的等待时间, 默认为一个间隔
+        return await self.call_at(time.time() + (interval if first is None else first), method, *args, interval=interval, **kwargs)
+
+    async def cancel(self, key: str) -> bool:
+        await self.engine.wait_materialized(self)
+        # 堆中的条目留着, 到期时发现任务已不存在就跳过
+        if self.jobs.pop(key, None) is None:
+            return False
+        self.backup_man.set_dirty()
+        return True
+
+    def pending(self, prefix: str = '') -> List[TimerJob]:
+        return sorted((job for key, job in self.jobs.items() if key.startswith(prefix)), key=lambda job: job.due)
+
+    def push(self, job: TimerJob):
+        job.seq = next(self.seq)
+        self.jobs[job.key] = job
+        heapq.heappush(self.heap, (job.due, job.seq, job.key))
+        if self.heap[0][1] == job.seq:
+            self.wakeup.set()
+
+    def is_current(self, seq: int, key: str) -> bool:
+        job = self.jobs.get(key)
+        return job is not None and job.seq == seq
+
+    def compact(self):
+        # 作废的条目太多时重建堆
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.jobs):
+            self.heap = [entry for entry in self.heap if self.is_current(entry[1], entry[2])]
+            heapq.heapify(self.heap)
+
+    @autorun
+    async def run(self):
+        await self.engine.wait_materialized(self)
+        # 堆不保存, 从恢复的任务重建
+        self.heap = []
+        for job in list(self.jobs.values()):
+            self.push(job)
+        while True:
+            now = time.time()
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                _, seq, key = heapq.heappop(self.heap)
+                if not self.is_current(seq, key):
+                    continue
+                job = self.jobs[key]
+                if job.interval is not None:
+                    # 错过的周期(比如停机期间)不补, 只执行一次
+                    job.due += job.interval
+                    if job.due <= now:
+                        job.due = now + job.interval
+                    self.push(job)
+                else:
+                    del self.jobs[key]
+                self.backup_man.set_dirty()
+                self.fire(job)
+            self.compact()
+            self.wakeup.clear()
+            timeout = self.heap[0][0] - now if len(self.heap) > 0 else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError: ...
+
+    def fire(self, job: TimerJob):
+        if job.interval is not None and job.key in self.running:
+            # 上一次还没执行完的周期任务跳过本次
+            logger.info(f'{job.key} 上一次执行尚未结束, 跳过')
+            return
+        plugin = self.engine.plugins.get(job.plugin)
+        method = getattr(plugin, job.method, None)
+        if method is None:
+            logger.warning(f'{job.key}: {job.plugin}.{job.method}不存在, 丢弃')
+            self.jobs.pop(job.key, None)
+            return
+        async def run_job():
+            self.fired += 1
+            try:
+                # 每个任务在自己的上下文中执行, 不共享override
+                with self.engine.of() as ctx, ctx:
+                    await self.engine.wait_materialized(plugin)
+                    await method(*job.args, **job.kwargs)
+            except:
+                traceback.print_exc()
+            finally:
+                if self.running.get(job.key) is task:
+                    del self.running[job.key]
+        task = asyncio.create_task(run_job())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if job.interval is not None:
+            self.running[job.key] = task
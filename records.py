@@ -0,0 +1,98 @@
+import copyreg
+from dataclasses import MISSING, dataclass, fields
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from mirai import Plain
+from mirai.models.entities import GroupMember
+from mirai.models.message import Face, Image, MarketFace, MessageChain, MessageComponent
+
+# 需要持久化的记录的基类, 子类用@dataclass(slots=True)声明
+# 只保存ID, 时间戳和必要的内容, 完整的mirai对象需要时再通过bot(成员缓存)查询
+# 序列化为字段名到值的映射, 增删字段后旧的备份仍能恢复
+class Record():
+    __slots__ = ()
+
+    def __reduce__(self):
+        # 与默认的__slots__序列化格式相同: (None, 字段名->值)
+        return copyreg.__newobj__, (self.__class__,), (None, {name: getattr(self, name) for name in self.__slots__})
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            _, state = state
+        else:
+            # 旧备份中是dataclass的__dict__, 可能带着整个GroupMember/MessageChain
+            state = self.migrate(dict(state))
+        for f in fields(self):
+            if f.name in state:
+                value = state[f.name]
+            elif f.default is not MISSING:
+                value = f.default
+            elif f.default_factory is not MISSING:
+                value = f.default_factory()
+            else:
+                raise TypeError(f'{self.__class__.__name__}的备份缺少字段{f.name}')
+            setattr(self, f.name, value)
+
+    @classmethod
+    def migrate(cls, state: Dict[str, Any]) -> Dict[str, Any]:
+        return state
+
+# 群成员的引用, 带一份名片的快照用于显示
+@dataclass(slots=True)
+class MemberRef(Record):
+    id: int
+    group_id: int
+    member_name: str = ''
+
+    @classmethod
+    def of(cls, member: GroupMember) -> 'MemberRef':
+        return cls(member.id, member.group.id, member.member_name)
+
+    def get_name(self) -> str:
+        return self.member_name
+
+    def get_avatar_url(self) -> str:
+        return f'http://q4.qlogo.cn/g?b=qq&nk={self.id}&s=140'
+
+# 消息链中保留的组件, 及其需要保存的字段
+KEPT_COMPONENTS = {
+    'Image': (Image, ('image_id', 'url')),
+    'Face': (Face, ('face_id', 'name')),
+    'MarketFace': (MarketFace, ('id', 'name')),
+}
+
+def plain_value(value):
+    return str(value) if isinstance(value, str) else value
+
+# 消息链的精简副本: 文字保存为str, 图片和表情保存为(类型, 字段...)的元组, 其他组件丢弃
+@dataclass(slots=True)
+class ChainRecord(Record):
+    message_id: int
+    items: Tuple[Union[str, tuple], ...] = ()
+
+    @classmethod
+    def of(cls, chain: Iterable[MessageComponent], message_id: Optional[int] = None) -> 'ChainRecord':
+        if message_id is None:
+            message_id = chain.message_id if isinstance(chain, MessageChain) else -1
+        items = []
+        for c in chain:
+            if isinstance(c, Plain):
+                items.append(c.text)
+            elif c.type in KEPT_COMPONENTS:
+                _, names = KEPT_COMPONENTS[c.type]
+                # url之类是str的子类, 转成普通的str保存
+                items.append((c.type, *(plain_value(getattr(c, n)) for n in names)))
+        return cls(message_id, tuple(items))
+
+    def components(self) -> List[MessageComponent]:
+        res = []
+        for item in self.items:
+            if isinstance(item, str):
+                res.append(Plain(item))
+                continue
+            kind, *values = item
+            component_t, names = KEPT_COMPONENTS[kind]
+            res.append(component_t(**{n: v for n, v in zip(names, values) if v is not None}))
+        return res
+
+    def text(self) -> str:
+        return ''.join(item for item in self.items if isinstance(item, str))
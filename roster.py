@@ -0,0 +1,225 @@
+import asyncio
+import bisect
+from datetime import datetime
+import time
+import traceback
+from typing import Dict, List, Optional, Set, Tuple
+from mirai import Event, GroupMessage, Mirai
+from mirai.models.entities import GroupMember, Permission
+from mirai.models.events import (
+    BotLeaveEventActive, BotLeaveEventKick, MemberCardChangeEvent, MemberJoinEvent, MemberLeaveEventKick,
+    MemberLeaveEventQuit, MemberMuteEvent, MemberPermissionChangeEvent, MemberSpecialTitleChangeEvent, MemberUnmuteEvent
+)
+
+from utilities import get_logger
+
+logger = get_logger()
+
+def epoch_of(dt: Optional[datetime]) -> float:
+    if dt is None:
+        return 0
+    try:
+        return dt.timestamp()
+    except (OverflowError, OSError, ValueError):
+        return 0
+
+# 一个群的成员镜像, 带按权限, 名片和最后活跃时间的索引
+class GroupRoster():
+    members: Dict[int, GroupMember]
+    last_active: Dict[int, float] # 入群或最后发言的时间戳
+    by_permission: Dict[Permission, Set[int]]
+    by_card: Dict[str, Set[int]]
+
+    def __init__(self, group_id: int, members: List[GroupMember]) -> None:
+        self.group_id = group_id
+        self.members = {}
+        self.last_active = {}
+        self.by_permission = {p: set() for p in Permission}
+        self.by_card = {}
+        # 按活跃时间排序的(时间戳, QQ号), 发言很频繁, 查询时才重建
+        self.activity_index: List[Tuple[float, int]] = []
+        self.activity_dirty = True
+        self.loaded = time.time()
+        for member in members:
+            self.put(member)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member_id: int):
+        return member_id in self.members
+
+    def get(self, member_id: int) -> Optional[GroupMember]:
+        return self.members.get(member_id)
+
+    def put(self, member: GroupMember, last_active: Optional[float] = None):
+        self.remove(member.id)
+        self.members[member.id] = member
+        self.by_permission[member.permission].add(member.id)
+        self.by_card.setdefault(member.member_name, set()).add(member.id)
+        if last_active is None:
+            last_active = max(epoch_of(member.join_timestamp), epoch_of(member.last_speak_timestamp))
+        self.last_active[member.id] = last_active
+        self.activity_dirty = True
+
+    def remove(self, member_id: int) -> Optional[GroupMember]:
+        member = self.members.pop(member_id, None)
+        if member is None:
+            return None
+        self.by_permission[member.permission].discard(member_id)
+        ids = self.by_card.get(member.member_name)
+        if ids is not None:
+            ids.discard(member_id)
+            if len(ids) == 0:
+                del self.by_card[member.member_name]
+        self.last_active.pop(member_id, None)
+        self.activity_dirty = True
+        return member
+
+    def update(self, member_id: int, **fields):
+        member = self.members.get(member_id)
+        if member is None:
+            return
+        self.put(member.copy(update=fields), self.last_active.get(member_id))
+
+    def touch(self, member_id: int, ts: float):
+        if member_id in self.last_active:
+            self.last_active[member_id] = ts
+            self.activity_dirty = True
+
+    def admins(self) -> List[GroupMember]:
+        return [self.members[i] for i in (*self.by_permission[Permission.Owner], *self.by_permission[Permission.Administrator])]
+
+    def with_card(self, card: str) -> List[GroupMember]:
+        return [self.members[i] for i in self.by_card.get(card, ())]
+
+    def inactive_since(self, ts: float) -> List[GroupMember]:
+        # 最后活跃早于ts的成员, 最久没活跃的在前
+        if self.activity_dirty:
+            self.activity_index = sorted((t, i) for i, t in self.last_active.items())
+            self.activity_dirty = False
+        end = bisect.bisect_left(self.activity_index, (ts, -1))
+        return [self.members[i] for _, i in self.activity_index[:end]]
+
+# 所有用到过的群的成员镜像: 第一次查询时拉取成员列表, 之后由事件维护, 定期与服务端对账
+class Roster():
+    groups: Dict[int, GroupRoster]
+    loading: Dict[int, asyncio.Task]
+    pending: Dict[int, List[Event]] # 拉取期间收到的事件, 拉取完成后补上
+
+    def __init__(self, bot: Mirai) -> None:
+        self.bot = bot
+        self.groups = {}
+        self.loading = {}
+        self.pending = {}
+        self.reconciled = 0
+
+    def __contains__(self, group_id: int):
+        return group_id in self.groups
+
+    def get(self, group_id: int) -> Optional[GroupRoster]:
+        return self.groups.get(group_id)
+
+    async def of(self, group_id: int) -> GroupRoster:
+        roster = self.groups.get(group_id)
+        if roster is not None:
+            return roster
+        task = self.loading.get(group_id)
+        if task is None:
+            # 与TtlCache.load一致: 拉取在单独的任务中进行, 某个调用者被取消时不影响其他等待者
+            task = self.loading[group_id] = asyncio.create_task(self.load(group_id))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def load(self, group_id: int) -> GroupRoster:
+        self.pending[group_id] = []
+        try:
+            roster = await self.fetch(group_id)
+        finally:
+            del self.loading[group_id]
+            pending = self.pending.pop(group_id)
+        self.groups[group_id] = roster
+        for event in pending:
+            self.apply(event)
+        return roster
+
+    async def fetch(self, group_id: int) -> GroupRoster:
+        resp = await self.bot.member_list(group_id)
+        return GroupRoster(group_id, resp.data)
+
+    async def reconcile(self, group_id: int):
+        # 全量对账, 补上断线期间漏掉的事件; 本地记下的发言时间更新, 保留
+        old = self.groups.get(group_id)
+        if old is None:
+            return
+        self.pending[group_id] = []
+        try:
+            new = await self.fetch(group_id)
+        finally:
+            pending = self.pending.pop(group_id)
+        if self.groups.get(group_id) is not old:
+            return
+        for member_id, ts in old.last_active.items():
+            if member_id in new:
+                new.touch(member_id, max(ts, new.last_active[member_id]))
+        added = new.members.keys() - old.members.keys()
+        removed = old.members.keys() - new.members.keys()
+        if len(added) > 0 or len(removed) > 0:
+            logger.info(f'群{group_id}对账: 新增{len(added)} 移除{len(removed)}')
+        self.groups[group_id] = new
+        for event in pending:
+            self.apply(event)
+        self.reconciled += 1
+
+    async def reconcile_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            for group_id in list(self.groups.keys()):
+                try:
+                    await self.reconcile(group_id)
+                except Exception:
+                    traceback.print_exc()
+
+    def group_id_of(self, event: Event) -> Optional[int]:
+        if isinstance(event, GroupMessage):
+            return event.sender.group.id
+        member = getattr(event, 'member', None)
+        if isinstance(member, GroupMember):
+            return member.group.id
+        if isinstance(member, dict):
+            # 这个版本的mirai中MemberMuteEvent没有声明member字段, 只留下原始的dict
+            return member.get('group', {}).get('id')
+        group = getattr(event, 'group', None)
+        return getattr(group, 'id', None)
+
+    def apply(self, event: Event):
+        group_id = self.group_id_of(event)
+        if group_id is None:
+            return
+        if group_id in self.pending:
+            self.pending[group_id].append(event)
+        roster = self.groups.get(group_id)
+        if roster is None:
+            return
+        if isinstance(event, GroupMessage):
+            if event.sender.id not in roster:
+                roster.put(event.sender)
+            roster.touch(event.sender.id, time.time())
+        elif isinstance(event, MemberJoinEvent):
+            roster.put(event.member, time.time())
+        elif isinstance(event, (MemberLeaveEventKick, MemberLeaveEventQuit)):
+            roster.remove(event.member.id)
+        elif isinstance(event, MemberCardChangeEvent):
+            roster.update(event.member.id, member_name=event.current)
+        elif isinstance(event, MemberSpecialTitleChangeEvent):
+            roster.update(event.member.id, special_title=event.current)
+        elif isinstance(event, MemberPermissionChangeEvent):
+            roster.update(event.member.id, permission=event.current)
+        elif isinstance(event, MemberMuteEvent):
+            member = event.member
+            member_id = member.get('id') if isinstance(member, dict) else member.id
+            roster.update(member_id, mute_time_remaining=event.duration_seconds)
+        elif isinstance(event, MemberUnmuteEvent):
+            roster.update(event.member.id, mute_time_remaining=0)
+        elif isinstance(event, (BotLeaveEventActive, BotLeaveEventKick)):
+            del self.groups[group_id]
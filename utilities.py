@@ -1,13 +1,23 @@
+from array import array
+import bisect
+from collections import OrderedDict
+import contextvars
 import dataclasses
 from datetime import datetime
 from enum import Enum, auto
+import importlib
 import inspect
+import itertools
 import logging
 import logging.handlers
 import os
+import pickle
 import re
+import sqlite3
+import threading
 import time
-from typing import Any, Callable, Dict, Final, Generic, Iterable, Optional, Type, TypeVar, Union, get_args
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Final, Generic, Hashable, Iterable, Mapping, Optional, Set, Tuple, Type, TypeVar, Union, get_args
 from dataclasses import Field, dataclass, field
 from abc import ABC, abstractmethod
 import typing
@@ -41,10 +51,110 @@ class Upgraded():
             setattr(obj, k, _def)
         return obj
 
+# 按时间排序的记录: 时间戳与可选的数值载荷分别存放在array中, 区间查询用二分
+# 通常只在末尾追加; 时间早于最后一条时按顺序插入
+class TimeSeries():
+    ts: array # 'd'
+    values: Optional[array]
+
+    def __init__(self, typecode: Optional[str] = None) -> None:
+        # typecode: 载荷的array类型, 为None时只记录时间戳
+        self.ts = array('d')
+        self.values = array(typecode) if typecode is not None else None
+
+    @classmethod
+    def of(cls, items: Iterable, typecode: Optional[str] = None) -> 'TimeSeries':
+        # items: 时间戳, 或(时间戳, 载荷)
+        series = cls(typecode)
+        for item in items:
+            if typecode is None:
+                series.append(item)
+            else:
+                series.append(*item)
+        return series
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __iter__(self):
+        return iter(self.ts)
+
+    def __getitem__(self, index: int) -> float:
+        return self.ts[index]
+
+    def append(self, ts: Optional[float] = None, value: Union[int, float] = 1) -> float:
+        if ts is None:
+            ts = time.time()
+        i = len(self.ts)
+        if i > 0 and ts < self.ts[-1]:
+            i = bisect.bisect_right(self.ts, ts)
+        # 先写载荷: 超出array类型范围时直接抛出, 时间戳与载荷不会错位
+        if self.values is not None:
+            self.values.insert(i, value)
+        try:
+            self.ts.insert(i, ts)
+        except:
+            if self.values is not None:
+                del self.values[i]
+            raise
+        return ts
+
+    def last(self) -> Optional[float]:
+        return self.ts[-1] if len(self.ts) > 0 else None
+
+    def index(self, ts: float) -> int:
+        # 第一条不早于ts的记录的下标
+        return bisect.bisect_left(self.ts, ts)
+
+    def count_since(self, ts: float) -> int:
+        return len(self.ts) - self.index(ts)
+
+    def count_between(self, start: float, end: float) -> int:
+        # [start, end)
+        return max(self.index(end) - self.index(start), 0)
+
+    def sum_since(self, ts: float) -> Union[int, float]:
+        if self.values is None:
+            return self.count_since(ts)
+        return sum(self.values[self.index(ts):])
+
+    def between(self, start: Optional[float] = None, end: Optional[float] = None) -> array:
+        # [start, end)内的时间戳
+        lo = 0 if start is None else self.index(start)
+        hi = len(self.ts) if end is None else self.index(end)
+        return self.ts[lo:hi]
+
+    def items_between(self, start: Optional[float] = None, end: Optional[float] = None) -> list:
+        # [start, end)内的(时间戳, 载荷)
+        lo = 0 if start is None else self.index(start)
+        hi = len(self.ts) if end is None else self.index(end)
+        values = self.values[lo:hi] if self.values is not None else [None] * (hi - lo)
+        return list(zip(self.ts[lo:hi], values))
+
+    def drop_since(self, ts: float):
+        i = self.index(ts)
+        del self.ts[i:]
+        if self.values is not None:
+            del self.values[i:]
+
+    def drop_before(self, ts: float):
+        i = self.index(ts)
+        del self.ts[:i]
+        if self.values is not None:
+            del self.values[:i]
+
+    def __repr__(self):
+        return f'TimeSeries(len={len(self.ts)})'
+
 class ResolverMixer(ABC):
     @abstractmethod
     def resolver_mixin(self) -> Dict[type, Callable[..., Any]]: ...
 
+# 标记解析器的结果在同一事件内可复用(结果只取决于事件和覆盖栈, 且不消耗实参)
+def memoize(fn):
+    fn._memoize_ = True
+    return fn
+
 class Target(Enum):
     GROUP = auto()
     TEMP = auto()
@@ -68,8 +178,63 @@ class MsgOp():
     async def recall(self):
         await self.bot.recall(self.msg.id, self.group.id)
 
+# 当前事件中访问过的条目: {id(存储): (存储, 键集合)}
+# 写日志时会取走脏标记, 处理器在那之后才修改的条目要在事件结束时重新标脏
+journal_touches = contextvars.ContextVar[Optional[Dict[int, Tuple[Any, Set[Hashable]]]]]('journal_touches', default=None)
+
+def touch(storage, key: Hashable):
+    touches = journal_touches.get()
+    if touches is None:
+        return
+    entry = touches.get(id(storage))
+    if entry is None:
+        entry = touches[id(storage)] = (storage, set())
+    entry[1].add(key)
+
+def remark_touched(touches: Dict[int, Tuple[Any, Set[Hashable]]]):
+    for storage, keys in touches.values():
+        storage.remark_dirty(keys)
+
+# 日志式持久化: 记录被访问过(可能被修改)的条目, 只把这些条目写入日志
+class JournaledStorage():
+    def track_dirty(self):
+        if '_dirty_keys_' not in self.__dict__:
+            self.__dict__['_dirty_keys_'] = set()
+
+    def is_tracking(self):
+        return '_dirty_keys_' in self.__dict__
+
+    def mark_dirty(self, key: Hashable):
+        dirty_keys = self.__dict__.get('_dirty_keys_')
+        if dirty_keys is not None:
+            dirty_keys.add(key)
+            touch(self, key)
+
+    def remark_dirty(self, keys: Set[Hashable]):
+        dirty_keys = self.__dict__.get('_dirty_keys_')
+        if dirty_keys is not None:
+            dirty_keys.update(keys)
+
+    def pop_dirty(self) -> Set[Hashable]:
+        dirty_keys = self.__dict__.get('_dirty_keys_')
+        if dirty_keys is None:
+            return set()
+        self.__dict__['_dirty_keys_'] = set()
+        return dirty_keys
+
+    @abstractmethod
+    def journal_entry(self, key: Hashable) -> Tuple[bool, Any]: ...
+
+    @abstractmethod
+    def apply_journal_entry(self, key: Hashable, present: bool, value: Any): ...
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_dirty_keys_', None)
+        return state
+
 @dataclass
-class UserSpec(Generic[T], ResolverMixer):
+class UserSpec(Generic[T], ResolverMixer, JournaledStorage):
     users: Dict[int, T] = field(default_factory=dict)
 
     def get_or_create_data(self, user_id: int, factory: Callable[[], T] = None):
@@ -77,13 +242,24 @@ class UserSpec(Generic[T], ResolverMixer):
             if factory is None:
                 factory = get_args(self.__orig_class__)[0]
             self.users[user_id] = factory()
+        self.mark_dirty(user_id)
         return self.users[user_id]
     
     def get_data(self, user_id: int, _default=None):
         if user_id not in self.users:
             return _default
+        self.mark_dirty(user_id)
         return self.users[user_id]
 
+    def journal_entry(self, key: int):
+        return key in self.users, self.users.get(key)
+
+    def apply_journal_entry(self, key: int, present: bool, value: T):
+        if present:
+            self.users[key] = value
+        else:
+            self.users.pop(key, None)
+
     def event_t(self) -> Type['UserSpecAsEvent[T]']:
         return UserSpecAsEvent[get_args(self.__orig_class__)]
 
@@ -91,6 +267,7 @@ class UserSpec(Generic[T], ResolverMixer):
         return UserSpecAsEvent[T](self, event, user)
 
     def resolver_mixin(self) -> Dict[type, Callable[..., Any]]:
+        @memoize
         def resolve(event: Event, user: User):
             return self.as_event(event, user)
         def resolve_opt_data(gse: self.event_t()):
@@ -118,7 +295,7 @@ class UserSpecAsEvent(Generic[T]):
         return self.outter.get_data(self.user.id, _default)
 
 @dataclass
-class GroupSpec(Generic[T], ResolverMixer):
+class GroupSpec(Generic[T], ResolverMixer, JournaledStorage):
     groups: Dict[int, T] = field(default_factory=dict)
 
     def get_or_create_data(self, group_id: int, factory: Callable[[], T] = None):
@@ -126,13 +303,24 @@ class GroupSpec(Generic[T], ResolverMixer):
             if factory is None:
                 factory = get_args(self.__orig_class__)[0]
             self.groups[group_id] = factory()
+        self.mark_dirty(group_id)
         return self.groups[group_id]
     
     def get_data(self, group_id: int, _default=None):
         if group_id not in self.groups:
             return _default
+        self.mark_dirty(group_id)
         return self.groups[group_id]
 
+    def journal_entry(self, key: int):
+        return key in self.groups, self.groups.get(key)
+
+    def apply_journal_entry(self, key: int, present: bool, value: T):
+        if present:
+            self.groups[key] = value
+        else:
+            self.groups.pop(key, None)
+
     def event_t(self) -> Type['GroupSpecAsEvent[T]']:
         return GroupSpecAsEvent[get_args(self.__orig_class__)]
 
@@ -140,6 +328,7 @@ class GroupSpec(Generic[T], ResolverMixer):
         return GroupSpecAsEvent[T](self, event, group)
 
     def resolver_mixin(self) -> Dict[type, Callable[..., Any]]:
+        @memoize
         def resolve(event: Event, group: Group):
             return self.as_event(event, group)
         def resolve_opt_data(gse: self.event_t()):
@@ -165,7 +354,7 @@ class GroupSpecAsEvent(Generic[T]):
     def get_data(self, _default=None):
         return self.outter.get_data(self.group.id, _default)
 
-class GroupLocalStorage(Generic[T], ResolverMixer):
+class GroupLocalStorage(Generic[T], ResolverMixer, JournaledStorage):
     groups: Dict[int, Dict[int, T]]
 
     def __init__(self) -> None:
@@ -179,6 +368,7 @@ class GroupLocalStorage(Generic[T], ResolverMixer):
             if factory is None:
                 factory = get_args(self.__orig_class__)[0]
             group[member_qq] = factory()
+        self.mark_dirty((group_id, member_qq))
         return group[member_qq]
     
     def get_data(self, group_id: int, member_qq: int, _default=None):
@@ -187,12 +377,30 @@ class GroupLocalStorage(Generic[T], ResolverMixer):
         group = self.groups[group_id]
         if member_qq not in group:
             return _default
+        self.mark_dirty((group_id, member_qq))
         return group[member_qq]
 
-    def get_data_of_group(self, group_id: int) -> Dict[int, T]:
-        if group_id not in self.groups:
-            return {}
-        return self.groups[group_id]
+    def set_data(self, group_id: int, member_qq: int, value: T):
+        self.groups.setdefault(group_id, {})[member_qq] = value
+        self.mark_dirty((group_id, member_qq))
+
+    # 只读, 不标脏; 要修改的条目用get_data/get_or_create_data取
+    def get_data_of_group(self, group_id: int) -> Mapping[int, T]:
+        return MappingProxyType(self.groups.get(group_id, {}))
+
+    def journal_entry(self, key: Tuple[int, int]):
+        group_id, member_qq = key
+        group = self.groups.get(group_id, {})
+        return member_qq in group, group.get(member_qq)
+
+    def apply_journal_entry(self, key: Tuple[int, int], present: bool, value: T):
+        group_id, member_qq = key
+        if present:
+            if group_id not in self.groups:
+                self.groups[group_id] = {}
+            self.groups[group_id][member_qq] = value
+        elif group_id in self.groups:
+            self.groups[group_id].pop(member_qq, None)
 
     def event_t(self) -> Type['GroupLocalStorageAsEvent[T]']:
         return GroupLocalStorageAsEvent[get_args(self.__orig_class__)]
@@ -207,6 +415,7 @@ class GroupLocalStorage(Generic[T], ResolverMixer):
         return GroupLocalStorageAsAt[T](self, event, at)
     
     def resolver_mixin(self) -> Dict[type, Callable[..., Any]]:
+        @memoize
         def resolve(event: Event, member: GroupMember):
             return self.as_event(event, member)
         def resolve_opt_data(glse: self.event_t()):
@@ -269,6 +478,234 @@ class GroupLocalStorageAsEvent(Generic[T]):
     def get_data_of_group(self):
         return self.outter.get_data_of_group(self.group_id)
 
+# 每个插件一个数据库文件, 每个存储一张表; 读在事件循环中进行, 批量写入在线程中进行
+class SqliteStore():
+    def __init__(self, path: str):
+        self.path = path
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.reader.execute('PRAGMA journal_mode=WAL')
+        self.writer = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def ensure_table(self, table: str):
+        with self.reader:
+            self.reader.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (k1 INTEGER NOT NULL, k2 INTEGER NOT NULL, value BLOB NOT NULL, PRIMARY KEY (k1, k2))')
+
+    def is_empty(self, table: str):
+        return self.reader.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone() is None
+
+    def load(self, table: str, k1: int, k2: int) -> Optional[bytes]:
+        row = self.reader.execute(f'SELECT value FROM "{table}" WHERE k1 = ? AND k2 = ?', (k1, k2)).fetchone()
+        return None if row is None else row[0]
+
+    def load_group(self, table: str, k1: int) -> Iterable[Tuple[int, bytes]]:
+        return self.reader.execute(f'SELECT k2, value FROM "{table}" WHERE k1 = ?', (k1, )).fetchall()
+
+    def load_all(self, table: str) -> Iterable[Tuple[int, int, bytes]]:
+        return self.reader.execute(f'SELECT k1, k2, value FROM "{table}"').fetchall()
+
+    def write(self, table: str, rows: Iterable[Tuple[int, int, bytes]]) -> int:
+        with self.lock, self.writer:
+            self.writer.executemany(f'INSERT OR REPLACE INTO "{table}" (k1, k2, value) VALUES (?, ?, ?)', rows)
+        return sum(len(row[2]) for row in rows)
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+# 行按需从数据库读出, 缓存最近使用的行; 被访问过(可能被修改)的行在写回之前不会被淘汰
+class SqliteStorage():
+    CACHE_SIZE: Final = 2048
+
+    store: SqliteStore
+    table: str
+
+    def attach(self, store: SqliteStore, table: str):
+        self.store = store
+        self.table = table
+        self.cache: OrderedDict[Tuple[int, int], Any] = OrderedDict()
+        self.dirty_rows: Set[Tuple[int, int]] = set()
+        self.writing_rows: Set[Tuple[int, int]] = set()
+        store.ensure_table(table)
+
+    def item_t(self):
+        return get_args(self.__orig_class__)[0]
+
+    def row(self, key: Tuple[int, int], factory: Callable[[], T] = None) -> Optional[T]:
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        by = self.store.load(self.table, *key)
+        if by is not None:
+            value = pickle.loads(by)
+        elif factory is not None:
+            value = factory()
+            self.dirty_rows.add(key)
+        else:
+            return None
+        # 调用方随后会标记这一行, 由mark_row负责淘汰
+        self.cache[key] = value
+        return value
+
+    def mark_row(self, key: Tuple[int, int]):
+        self.dirty_rows.add(key)
+        touch(self, key)
+        self.evict()
+
+    def remark_dirty(self, keys: Set[Tuple[int, int]]):
+        # 已被淘汰的行在写回之后没有再被取用过
+        self.dirty_rows.update(key for key in keys if key in self.cache)
+
+    def is_pinned(self, key: Tuple[int, int]):
+        return key in self.dirty_rows or key in self.writing_rows
+
+    def evict(self):
+        if len(self.cache) <= self.CACHE_SIZE:
+            return
+        for key in [k for k in self.cache if not self.is_pinned(k)][:len(self.cache) - self.CACHE_SIZE]:
+            del self.cache[key]
+
+    def rows_of(self, k1: int) -> Dict[int, T]:
+        # 只读: 扫描到的行不标脏, 要修改的行用get_data/get_or_create_data取
+        result = {k2: pickle.loads(by) for k2, by in self.store.load_group(self.table, k1)}
+        # 缓存中的行比数据库中的新, 尚未写回的新行只存在于缓存中
+        for key, value in self.cache.items():
+            if key[0] == k1:
+                result[key[1]] = value
+        for k2, value in result.items():
+            if (k1, k2) not in self.cache:
+                self.cache[(k1, k2)] = value
+        self.evict()
+        return result
+
+    # 只读: 不在缓存中的行是临时读出的副本, 对它们的修改不会保存
+    def all_rows(self) -> Dict[Tuple[int, int], T]:
+        result = {(k1, k2): pickle.loads(by) for k1, k2, by in self.store.load_all(self.table)}
+        result.update(self.cache)
+        return result
+
+    def has_pending(self):
+        return len(self.dirty_rows) > 0
+
+    def prepare_write(self) -> Callable[[], int]:
+        # 在事件循环中序列化, 保证写入的是一致的状态
+        self.writing_rows = self.dirty_rows
+        self.dirty_rows = set()
+        rows = [(k1, k2, pickle.dumps(self.cache[(k1, k2)])) for k1, k2 in self.writing_rows]
+        return lambda: self.store.write(self.table, rows)
+
+    def write_done(self, ok: bool):
+        if not ok:
+            self.dirty_rows |= self.writing_rows
+        self.writing_rows = set()
+        self.evict()
+
+    def import_rows(self, rows: Dict[Tuple[int, int], Any]):
+        self.store.write(self.table, [(k1, k2, pickle.dumps(v)) for (k1, k2), v in rows.items()])
+
+    # 只序列化表名, 数据在数据库中
+    def __getstate__(self):
+        return {'__orig_class__': self.__dict__.get('__orig_class__'), 'table': self.__dict__.get('table')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+class SqliteUserSpec(SqliteStorage, UserSpec[T]):
+    def __init__(self) -> None: ...
+
+    # 只读, 见all_rows
+    @property
+    def users(self) -> Mapping[int, T]:
+        return MappingProxyType({k1: v for (k1, _), v in self.all_rows().items()})
+
+    def get_or_create_data(self, user_id: int, factory: Callable[[], T] = None):
+        value = self.row((user_id, 0), factory or self.item_t())
+        self.mark_row((user_id, 0))
+        return value
+
+    def get_data(self, user_id: int, _default=None):
+        value = self.row((user_id, 0))
+        if value is None:
+            return _default
+        self.mark_row((user_id, 0))
+        return value
+
+    @classmethod
+    def migrate(cls, storage: UserSpec[T], store: SqliteStore, table: str) -> 'SqliteUserSpec[T]':
+        migrated = cls[get_args(storage.__orig_class__)]()
+        migrated.attach(store, table)
+        if store.is_empty(table):
+            migrated.import_rows({(k, 0): v for k, v in storage.users.items()})
+        return migrated
+
+class SqliteGroupSpec(SqliteStorage, GroupSpec[T]):
+    def __init__(self) -> None: ...
+
+    # 只读, 见all_rows
+    @property
+    def groups(self) -> Mapping[int, T]:
+        return MappingProxyType({k1: v for (k1, _), v in self.all_rows().items()})
+
+    def get_or_create_data(self, group_id: int, factory: Callable[[], T] = None):
+        value = self.row((group_id, 0), factory or self.item_t())
+        self.mark_row((group_id, 0))
+        return value
+
+    def get_data(self, group_id: int, _default=None):
+        value = self.row((group_id, 0))
+        if value is None:
+            return _default
+        self.mark_row((group_id, 0))
+        return value
+
+    @classmethod
+    def migrate(cls, storage: GroupSpec[T], store: SqliteStore, table: str) -> 'SqliteGroupSpec[T]':
+        migrated = cls[get_args(storage.__orig_class__)]()
+        migrated.attach(store, table)
+        if store.is_empty(table):
+            migrated.import_rows({(k, 0): v for k, v in storage.groups.items()})
+        return migrated
+
+class SqliteGroupLocalStorage(SqliteStorage, GroupLocalStorage[T]):
+    def __init__(self) -> None: ...
+
+    # 只读, 见all_rows
+    @property
+    def groups(self) -> Mapping[int, Mapping[int, T]]:
+        groups = {}
+        for (group_id, member_qq), v in self.all_rows().items():
+            groups.setdefault(group_id, {})[member_qq] = v
+        return MappingProxyType({k: MappingProxyType(v) for k, v in groups.items()})
+
+    def get_or_create_data(self, group_id: int, member_qq: int, factory: Callable[[], T] = None):
+        value = self.row((group_id, member_qq), factory or self.item_t())
+        self.mark_row((group_id, member_qq))
+        return value
+
+    def get_data(self, group_id: int, member_qq: int, _default=None):
+        value = self.row((group_id, member_qq))
+        if value is None:
+            return _default
+        self.mark_row((group_id, member_qq))
+        return value
+
+    def set_data(self, group_id: int, member_qq: int, value: T):
+        self.cache[(group_id, member_qq)] = value
+        self.mark_row((group_id, member_qq))
+
+    def get_data_of_group(self, group_id: int) -> Mapping[int, T]:
+        return MappingProxyType(self.rows_of(group_id))
+
+    @classmethod
+    def migrate(cls, storage: GroupLocalStorage[T], store: SqliteStore, table: str) -> 'SqliteGroupLocalStorage[T]':
+        migrated = cls[get_args(storage.__orig_class__)]()
+        migrated.attach(store, table)
+        if store.is_empty(table):
+            migrated.import_rows({
+                (group_id, member_qq): v for group_id, group in storage.groups.items() for member_qq, v in group.items()
+            })
+        return migrated
+
 @dataclass
 class AchvRarityVal():
     level: int
@@ -396,6 +833,8 @@ class RewardEnum(RewardInfo, Enum):
      def __hash__(self) -> int:
         return hash(self.name)
 
+override_serials = itertools.count(1)
+
 @dataclass
 class Overrides():
     context: 'Context'
@@ -403,37 +842,46 @@ class Overrides():
     outer: 'Plugin'
     to: Optional[Target] = field(default=None)
     redirected: 'Redirected' = field(init=False)
+    serial: int = field(init=False, default=0)
 
+    # 进入时只压栈; Redirected只在处理器真的有输出或抛出异常时才创建
     async def __aenter__(self):
-        self.context.push_overrides(self)
-
-        ctx = self.outer.engine.get_context()
+        self.serial = next(override_serials)
         self.redirected = None
+        self.context.push_overrides(self)
+        return self
 
+    async def get_redirected(self) -> Optional['Redirected']:
+        if self.redirected is not None:
+            return self.redirected
+        stack = self.context.get_overrides_stack()
+        # 已经退出的覆盖如果带有值, 解析时需要临时放回栈中
+        pushed = len(self.vals) > 0 and not any(o is self for o in stack)
+        if pushed:
+            stack.append(self)
         try:
-            self.redirected = Redirected(*await ctx.resolve_args(Redirected, [], self.outer))
+            self.redirected = Redirected(*await self.context.resolve_args(Redirected, [], self.outer))
             self.redirected.context = self.context
             self.redirected.to = self.to
-            self.redirected.context = self.context
-
-            # 把这个redirected放到栈顶
-            return self.redirected
         except: 
             from plugin import OutOfContext
             if not isinstance(self.context, OutOfContext):
                 ...
                 # traceback.print_exc()
             ...
-    
+        finally:
+            if pushed:
+                self.context.remove_overrides(self)
+        return self.redirected
 
     async def __aexit__(self, type, value: Exception, trace):
-        self.context.remove_overrides(self)
-
         # 如果发生异常了，就需要设置redirected
-        if type is not None and self.redirected is not None:
-            self.redirected([f' 错误: ', *value.args])
-            # self.context.set_redirected(self.redirected)
-            ...
+        if type is not None:
+            redirected = await self.get_redirected()
+            if redirected is not None:
+                redirected([f' 错误: ', *value.args])
+                # self.context.set_redirected(self.redirected)
+        self.context.remove_overrides(self)
 
 @dataclass
 class GroupMemberOp():
@@ -475,6 +923,7 @@ class SourceOp():
     event: Event
     group: Optional[Group]
     member: Optional[GroupMember]
+    sent_cb: Optional[Callable[[], None]] = field(default=None, repr=False, compare=False)
 
     def get_target(self):
         if isinstance(self.event, TempMessage):
@@ -505,6 +954,13 @@ class SourceOp():
         return self.group.id
 
     async def send(self, msg, *, to: Target=None):
+        try:
+            return await self.send_to(msg, to=to)
+        finally:
+            if self.sent_cb is not None:
+                self.sent_cb()
+
+    async def send_to(self, msg, *, to: Target=None):
         if to is None:
             to = self.get_target()
 
@@ -742,3 +1198,51 @@ def to_unbind(fn):
 
 def is_nested(func):
     return func.__code__.co_flags & inspect.CO_NESTED != 0
+
+logger = get_logger()
+
+# 延迟导入: 第一次使用时才真正导入, 连接之后由warm_up_lazy在后台提前导入
+class Lazy():
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.__dict__['_lazy_name_'] = name
+        self.__dict__['_lazy_factory_'] = factory
+        self.__dict__['_lazy_lock_'] = threading.Lock()
+        lazy_objects.append(self)
+
+    def _lazy_target_(self):
+        if '_lazy_value_' in self.__dict__:
+            return self.__dict__['_lazy_value_']
+        with self._lazy_lock_:
+            if '_lazy_value_' not in self.__dict__:
+                started = time.perf_counter()
+                self.__dict__['_lazy_value_'] = self._lazy_factory_()
+                lazy_timings[self._lazy_name_] = time.perf_counter() - started
+        return self.__dict__['_lazy_value_']
+
+    def _lazy_loaded_(self):
+        return '_lazy_value_' in self.__dict__
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_target_(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._lazy_target_()(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<lazy {self._lazy_name_}{"" if self._lazy_loaded_() else " (not loaded)"}>'
+
+lazy_objects: typing.List[Lazy] = []
+lazy_timings: Dict[str, float] = {}
+
+def lazy_import(module: str, attr: Optional[str] = None) -> Any:
+    def factory():
+        mod = importlib.import_module(module)
+        return mod if attr is None else getattr(mod, attr)
+    return Lazy(module if attr is None else f'{module}.{attr}', factory)
+
+def warm_up_lazy():
+    for obj in list(lazy_objects):
+        try:
+            obj._lazy_target_()
+        except Exception as e:
+            logger.warning(f'warm up {obj._lazy_name_} failed {e=}')